@@ -0,0 +1,255 @@
+"""
+Throughput, latency and peak memory of simulation and estimators for every sensor of config, written as JSON.
+Every case is timed call by call over frames of simulated sweep; peak memory is measured in a separate pass
+under tracemalloc (it slows calls down, so timed pass runs without it). Compare runs by comparing the files.
+"""
+from config.config_utils import get_default_sensors_config
+from hardware.linear_ccd_sensor import LinearCCDSensor
+from hardware.encoder_wheel import EncoderWheelWithTopAndBottomStrips
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_SHAPELY, ENGINE_CLOSED_FORM, ENGINE_LOOKUP_TABLE
+from simulation.collision_checker import CollisionChecker
+from processing.line_fitter import LineFitter
+from processing.y_shift_estimator import SensorYShiftEstimator
+from estimators import EstimatorPreviousN
+from main import SimplestEstimator, FinerEstimator, CORRELATION_INTERPOLATED, CORRELATION_FFT, useful_begin, \
+    R_mm, N_paskow, odleglosc_dolnego_paska
+from shapely import affinity
+import numpy as np
+import os
+import re
+import sys
+import json
+import time
+import platform
+import logging
+import argparse
+import warnings
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+sensor_tilt_deg = 1.4
+sensor_shift_um = (0, -765)
+percentiles = (50, 90, 99)
+results_dir = "benchmark_results"  # ignored by git
+
+
+class Context:
+    """
+    Sensor, wheel and simulated sweep shared by all cases of one sensor
+    """
+    def __init__(self, sensor, n_frames, step_as=5.0, seed=0):
+        self.sensor = sensor
+        self.wheel = EncoderWheelWithTopAndBottomStrips(R_mm, N_paskow, 10, odleglosc_dolnego_paska)
+        rng = np.random.default_rng(seed)
+        self.angles_deg = (np.arange(0, n_frames)*step_as + (0.5 - rng.random(n_frames))) / 3600.0
+        self.readouts = self.generator(ENGINE_CLOSED_FORM).for_angles(self.angles_deg)
+
+    def generator(self, engine):
+        return ReadoutGenerator(self.sensor, self.wheel, sensor_tilt_deg=sensor_tilt_deg,
+                                sensor_shift_um=sensor_shift_um, engine=engine)
+
+    def frame(self, i):
+        return self.readouts[i % len(self.readouts)]
+
+    def angle_deg(self, i):
+        return self.angles_deg[i % len(self.angles_deg)]
+
+
+class PolygonSet:
+    def __init__(self, polys, n=None):
+        self.polys = polys
+        self.N = n
+
+    def get_polys(self):
+        return self.polys
+
+
+def _place_like_sensor(p, wheel):
+    (x, y) = sensor_shift_um
+    p = affinity.rotate(p, 90 + sensor_tilt_deg, origin=(0, 0), use_radians=False)
+    return affinity.translate(p, x, y + wheel.radius_mm*1000)
+
+
+# Cases: every one takes Context and returns (call(i), frames per call)
+
+def case_for_angle(engine):
+    def case(ctx):
+        generator = ctx.generator(engine)
+        return lambda i: generator.for_angle(ctx.angle_deg(i)), 1
+    return case
+
+
+def case_for_angles(engine):
+    def case(ctx):
+        generator = ctx.generator(engine)
+        return lambda i: generator.for_angles(ctx.angles_deg), len(ctx.angles_deg)
+    return case
+
+
+def case_check_collisions(ctx):
+    segments = [_place_like_sensor(s, ctx.wheel) for s in ctx.sensor.get_array_segments()]
+    footprint = _place_like_sensor(ctx.sensor.get_total_rectangle(), ctx.wheel)
+    strips = [ctx.wheel.strips(angle, footprint=footprint) for angle in ctx.angles_deg]
+    checker = CollisionChecker()
+    checker.set_sensor(PolygonSet(segments, ctx.sensor.N))
+    checker.set_strips(PolygonSet(strips[0]))
+
+    def call(i):
+        checker.strips.polys = strips[i % len(strips)]
+        return checker.check_collisions()
+    return call, 1
+
+
+def case_simplest(ctx):
+    estimator = SimplestEstimator()
+    return lambda i: estimator.get_dx_px(ctx.frame(i)[useful_begin:], 60, True), 1
+
+
+def case_finer(method):
+    def case(ctx):
+        estimator = FinerEstimator(method)
+        return lambda i: estimator.get_dx_px(ctx.frame(i)[useful_begin:]), 1
+    return case
+
+
+def case_previous_n(ctx):
+    estimator = EstimatorPreviousN(10)
+    return lambda i: estimator.estimate(ctx.frame(i)), 1
+
+
+def case_line_fitter(ctx):
+    fitter = LineFitter(ctx.sensor)
+    return lambda i: fitter.fit_line(ctx.frame(i)), 1
+
+
+def case_y_shift(ctx):
+    estimator = SensorYShiftEstimator(ctx.sensor, ctx.wheel)
+    return lambda i: (estimator.estimate_bottom_edge(ctx.frame(i)), estimator.estimate_top_edge(ctx.frame(i))), 1
+
+
+def case_y_shift_batch(ctx):
+    estimator = SensorYShiftEstimator(ctx.sensor, ctx.wheel)
+    return lambda i: (estimator.estimate_bottom_edges(ctx.readouts),
+                      estimator.estimate_top_edges(ctx.readouts)), len(ctx.readouts)
+
+
+cases = {
+    "ReadoutGenerator.for_angle[shapely]": case_for_angle(ENGINE_SHAPELY),
+    "ReadoutGenerator.for_angle[closed_form]": case_for_angle(ENGINE_CLOSED_FORM),
+    "ReadoutGenerator.for_angle[lookup_table]": case_for_angle(ENGINE_LOOKUP_TABLE),
+    "ReadoutGenerator.for_angles[closed_form]": case_for_angles(ENGINE_CLOSED_FORM),
+    "ReadoutGenerator.for_angles[lookup_table]": case_for_angles(ENGINE_LOOKUP_TABLE),
+    "CollisionChecker.check_collisions": case_check_collisions,
+    "SimplestEstimator.get_dx_px": case_simplest,
+    "FinerEstimator.get_dx_px[interpolated]": case_finer(CORRELATION_INTERPOLATED),
+    "FinerEstimator.get_dx_px[fft]": case_finer(CORRELATION_FFT),
+    "EstimatorPreviousN.estimate": case_previous_n,
+    "LineFitter.fit_line": case_line_fitter,
+    "SensorYShiftEstimator.estimate_edges": case_y_shift,
+    "SensorYShiftEstimator.estimate_edges[batch]": case_y_shift_batch
+}
+
+
+def measure(call, frames_per_call, calls, warmup, max_seconds, memory_calls):
+    """
+    :return: dictionary with throughput, latency percentiles and peak memory
+    """
+    for i in range(0, warmup):
+        call(i)
+
+    latencies_s = []
+    start = time.perf_counter()
+    for i in range(0, calls):
+        t0 = time.perf_counter()
+        call(warmup + i)
+        latencies_s.append(time.perf_counter() - t0)
+        if time.perf_counter() - start > max_seconds:
+            break
+    total_s = time.perf_counter() - start
+    latencies_us = 1e6*np.array(latencies_s)
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for i in range(0, memory_calls):
+        call(i)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls": len(latencies_s),
+        "frames_per_call": frames_per_call,
+        "frames_per_s": frames_per_call*len(latencies_s) / total_s,
+        "latency_us": dict({f"p{p}": float(v) for p, v in zip(percentiles, np.percentile(latencies_us, percentiles))},
+                           mean=float(latencies_us.mean()), max=float(latencies_us.max())),
+        "peak_memory_kib": (peak - baseline) / 1024
+    }
+
+
+def run_case(name, ctx, args):
+    try:
+        call, frames_per_call = cases[name](ctx)
+        return measure(call, frames_per_call, args.calls, args.warmup, args.max_seconds, args.memory_calls)
+    except Exception as e:
+        logger.warning(f"{name} failed for {ctx.sensor}: {e!r}")
+        return {"error": repr(e)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of simulation and estimators for every sensor")
+    parser.add_argument("-c", "--config_for_sensors", default=get_default_sensors_config())
+    parser.add_argument("-s", "--sensors", default=None, help="comma separated names (default: all in config)")
+    parser.add_argument("-k", "--cases", default=".*", help="regular expression selecting cases by name")
+    parser.add_argument("-o", "--output", default=None,
+                        help=f"JSON file for results (default: timestamped file in {results_dir}/)")
+    parser.add_argument("-n", "--calls", type=int, default=200)
+    parser.add_argument("--frames", type=int, default=100, help="frames of simulated sweep")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--max_seconds", type=float, default=5.0, help="time limit of timed calls per case")
+    parser.add_argument("--memory_calls", type=int, default=3)
+    parser.add_argument("-l", "--log_level", default=20)
+    args = parser.parse_args()
+    if args.output is None:
+        os.makedirs(results_dir, exist_ok=True)
+        args.output = os.path.join(results_dir, time.strftime("benchmark_%Y%m%d_%H%M%S.json"))
+
+    logging.basicConfig(level=args.log_level,
+                        format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    # estimators log every frame at INFO, that would be measured too:
+    for noisy in ["main", "estimators", "processing", "simulation"]:
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+    warnings.simplefilter("ignore", RuntimeWarning)  # NaN results of frames without enough crossings
+
+    with open(args.config_for_sensors) as f:
+        sensor_config_json = json.load(f)
+    sensor_names = list(sensor_config_json) if args.sensors is None else args.sensors.split(",")
+    selected = [name for name in cases if re.search(args.cases, name)]
+
+    results = []
+    for sensor_name in sensor_names:
+        sensor = LinearCCDSensor.from_json(sensor_config_json[sensor_name])
+        ctx = Context(sensor, args.frames)
+        logger.info(sensor)
+        for name in selected:
+            result = dict(case=name, sensor=sensor_name, n_pixels=sensor.N, **run_case(name, ctx, args))
+            results.append(result)
+            if "error" not in result:
+                logger.info(f"{name:>45}: {result['frames_per_s']:>12.1f} frames/s, "
+                            f"p50 {result['latency_us']['p50']:>10.1f}us, p99 {result['latency_us']['p99']:>10.1f}us, "
+                            f"peak {result['peak_memory_kib']:>10.1f}KiB")
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "arguments": vars(args)
+        },
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
@@ -2,5 +2,17 @@ import os
 
 
 def get_default_sensors_config():
-    my_dir = os.path.split(__file__)[0].replace("/", "\\")
-    return os.path.join(my_dir, 'sensors_config.json')
\ No newline at end of file
+    my_dir = os.path.split(os.path.abspath(__file__))[0]
+    return os.path.join(my_dir, 'sensors_config.json')
+
+
+def get_fake_inputs_path():
+    my_dir = os.path.split(os.path.abspath(__file__))[0]
+    return os.path.join(my_dir, 'fake_inputs.json')
+
+def get_cache_dir():
+    """
+    Directory for files derived from inputs (e.g. converted readout stores), outside of source tree
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "enkoder")
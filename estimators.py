@@ -1,5 +1,10 @@
 
+import logging
 import numpy as np
+from processing.crossings import multi_threshold_crossing_mask, ragged_indices, last_indices
+from processing.instrumentation import stage
+
+logger = logging.getLogger(__name__)
 
 
 def normalize(image):
@@ -57,27 +62,17 @@ class Marker:
         self.begin_index = begin_index
         self.working_image = smoothed[self.begin_index:-self.begin_index]
 
+    def get_marks_matrix(self, thresholds):
+        """
+        :return: boolean matrix (T, len(working_image)), True where working image crosses threshold t
+        """
+        return multi_threshold_crossing_mask(self.working_image, thresholds)
+
     def get_marks(self, thresholds):
-        marks = []
-        is_unders = []
-        T = len(thresholds)
-        for t in range(0, T):
-            marks.append([])
-            threshold = thresholds[t]
-            is_unders.append(self.working_image[0] < threshold)
-
-        for i in range(0, len(self.working_image)):
-            p = self.working_image[i]
-            for t in range(0, T):
-                threshold = thresholds[t]
-                if p < threshold and not is_unders[t]:
-                    marks[t].append(i + self.begin_index)
-                    is_unders[t] = True
-                elif p > threshold and is_unders[t]:
-                    marks[t].append(i + self.begin_index)
-                    is_unders[t] = False
-
-        print(f"Marks = {marks}")
+        indices, offsets = ragged_indices(self.get_marks_matrix(thresholds))
+        indices += self.begin_index
+        marks = [indices[offsets[t]:offsets[t+1]].tolist() for t in range(0, len(thresholds))]
+        logger.debug("Marks = %s", marks)
         return marks
 
 
@@ -89,30 +84,64 @@ class EstimatorPreviousN:
         b_range = y_offset
         e_range = 1.0-y_offset
         self.thresholds = np.linspace(b_range, e_range, self.N)
-        print(self.thresholds)
+        logger.debug("Thresholds = %s", self.thresholds)
         self.previous = np.zeros(N)
         self.actual = np.zeros(N)
         self.T = len(self.thresholds)
         self.previous_marks = np.zeros(self.T)
         self.estimates = np.zeros(self.T)
 
+    @stage("EstimatorPreviousN.estimate")
     def estimate(self, readout):
         normalized_readout = normalize(readout)
         marker = Marker(normalized_readout)
-        marks = marker.get_marks(self.thresholds)
+        marks = marker.get_marks_matrix(self.thresholds)
 
-        for t in range(0, self.T):
-            if len(marks[t]) < 2:
-                self.estimates[t] = -100
-                continue
+        enough = np.count_nonzero(marks, axis=-1) >= 2
+        mark_values = last_indices(marks) + marker.begin_index
+        self.estimates = np.where(enough, mark_values - self.previous_marks, -100)
+        self.previous_marks = np.where(enough, mark_values, self.previous_marks)
 
-            mark_value = marks[t][-1]
-            self.estimates[t] = mark_value - self.previous_marks[t]
-            self.previous_marks[t] = mark_value
+        logger.debug("Estimates = %s", self.estimates)
 
-        print(f"Estimates = {self.estimates}")
+        good_estimates = self.estimates[(self.estimates > -10) & (self.estimates < 10)]
 
-        good_estimates = [e for e in self.estimates if e > -10 and e < 10]
+        return np.average(good_estimates)
 
 
-        return np.average(good_estimates)
+class Correlator:
+    """
+    Position of peak of correlation with one of the older images.
+    update() returns absolute position of the peak; old_main.py takes difference of consecutive results as shift
+    in pixels, which holds only while the reference image stays the same (estimate jumps when it is replaced).
+    """
+    def __init__(self, readout_t_us=200):
+        self.phi_as = 0
+        self.images = []
+        self.readout_t_us = readout_t_us
+        self.last_readout = 0
+        self.N = 10
+        self.difference_threshold = 1.0
+
+    @stage("Correlator.update")
+    def update(self, new_image):
+        if not self.images:
+            self.images.append(new_image)
+            return 0
+
+        if self.N > 0:
+            self.N -= 1
+        else:
+            self.N = 10
+            self.images.insert(0, new_image)
+
+        c = self._get_shift_in_pixels_between_images(new_image, self.images[-1])
+        if len(self.images) > self.N and abs(self.last_readout - c) > self.difference_threshold:
+            self.images.pop()
+
+        self.last_readout = c
+        return c
+
+    def _get_shift_in_pixels_between_images(self, new_image, old_image):
+        x_corr = np.correlate(new_image, old_image, "same")
+        return np.argmax(x_corr)
@@ -0,0 +1,344 @@
+"""
+Acquisition of telemetry sent by the encoder over serial line.
+
+Reader thread reads whatever bytes arrive, decoder turns them into records and every record is pushed
+into preallocated ring buffer together with its sequence number and time of arrival. Consumer drains
+the buffer in batches whenever it has time; nothing is overwritten silently, records lost because
+consumer was too slow are counted as overruns.
+
+FakeSerialDevice replays recorded (or synthetic) traffic through a pseudo-terminal at given rate,
+so the whole chain can be tested without hardware, see __main__ for search of maximum sustainable rate.
+"""
+import os
+import time
+import select
+import logging
+import threading
+import argparse
+import numpy as np
+from hardware.telemetry_protocol import AutoTelemetryDecoder, text_to_binary
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    Single producer, single consumer ring buffer of records of given dtype, without locks:
+    producer only moves `written`, consumer only moves `read`, both counters only grow.
+    When producer laps the consumer, the oldest records are overwritten and consumer counts them as overruns.
+    """
+    def __init__(self, capacity, dtype):
+        self.dtype = np.dtype([("sequence", "<u8")] + np.dtype(dtype).descr)
+        self.records = np.zeros(capacity, dtype=self.dtype)
+        self.capacity = capacity
+        self.written = 0
+        self.read = 0
+        self.overruns = 0
+
+    def __len__(self):
+        return min(self.written - self.read, self.capacity)
+
+    def push(self, values):
+        """
+        :param values: tuple of values of all fields except sequence
+        """
+        sequence = self.written
+        self.records[sequence % self.capacity] = (sequence,) + tuple(values)
+        self.written = sequence + 1
+
+    def extend(self, records, **constant_fields):
+        """
+        :param records: structured array with (some of) fields of the buffer
+        :param constant_fields: values of other fields, the same for all records (e.g. time of arrival)
+        """
+        n = len(records)
+        if n == 0:
+            return
+        first = self.written
+        kept = min(n, self.capacity)  # only the newest ones fit
+        sequences = np.arange(first + n - kept, first + n, dtype=np.uint64)
+        batch = np.empty(kept, dtype=self.dtype)
+        batch["sequence"] = sequences
+        for name, value in constant_fields.items():
+            batch[name] = value
+        for name in records.dtype.names:
+            batch[name] = records[name][n - kept:]
+        self.records[sequences % self.capacity] = batch
+        self.written = first + n
+
+    def drain(self, max_count=None):
+        """
+        :return: copy of records not read yet (at most max_count of them), oldest first
+        """
+        written = self.written
+        start = max(self.read, written - self.capacity)
+        end = written if max_count is None else min(written, start + max_count)
+        expected = np.arange(start, end, dtype=np.uint64)
+        batch = self.records[expected % self.capacity]
+        # producer may have overwritten the oldest slots while they were copied:
+        valid = batch["sequence"] == expected
+        self.overruns += (start - self.read) + int(np.count_nonzero(~valid))
+        self.read = end
+        return batch[valid]
+
+
+class FileConnection:
+    """
+    Serial port opened as plain file descriptor, enough for pseudo-terminals and for Linux tty devices
+    already configured (e.g. with stty). read() returns b"" when nothing arrives within timeout.
+    """
+    def __init__(self, path, timeout_s=0.1):
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        self.timeout_s = timeout_s
+
+    def read(self, size):
+        ready, _, _ = select.select([self.fd], [], [], self.timeout_s)
+        if not ready:
+            return b""
+        try:
+            return os.read(self.fd, size)
+        except BlockingIOError:
+            return b""
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PySerialConnection:
+    def __init__(self, port, baudrate=115200, timeout_s=0.1):
+        import serial
+        self.port = serial.Serial(port, baudrate, timeout=timeout_s)
+
+    def read(self, size):
+        return self.port.read(min(size, max(1, self.port.in_waiting)))
+
+    def close(self):
+        self.port.close()
+
+
+def open_connection(port, baudrate=115200, timeout_s=0.1):
+    """
+    pyserial when it is installed, plain file descriptor otherwise
+    """
+    try:
+        return PySerialConnection(port, baudrate, timeout_s)
+    except ImportError:
+        logger.warning("pyserial is not installed, %s is read as plain file (baudrate is not set)", port)
+        return FileConnection(port, timeout_s)
+
+
+def read_lines(connection, chunk_size=4096):
+    """
+    Lines (with line ends) as they arrive, endless: empty reads when device pauses longer than timeout
+    are skipped, iteration ends only when connection is closed (or consumer stops iterating)
+    """
+    pending = b""
+    while True:
+        try:
+            data = connection.read(chunk_size)
+        except (OSError, ValueError):  # closed connection
+            break
+        if not data:
+            continue
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if pending:
+        yield pending
+
+
+class SerialReader:
+    """
+    Thread reading connection, decoding and pushing records into ring buffer with time of arrival.
+    Decoder is anything with dtype, feed(bytes) returning structured array of records and stats(),
+    by default binary or text protocol is recognised from the stream.
+    """
+    def __init__(self, connection, decoder=None, capacity=1 << 16, chunk_size=4096):
+        self.connection = connection
+        self.decoder = AutoTelemetryDecoder() if decoder is None else decoder
+        self.buffer = RingBuffer(capacity, [("received_s", "<f8")] + self.decoder.dtype.descr)
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="serial-reader", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            data = self.connection.read(self.chunk_size)
+            if not data:
+                continue
+            received_s = time.monotonic()
+            self.bytes_read += len(data)
+            self.buffer.extend(self.decoder.feed(data), received_s=received_s)
+
+    def drain(self, max_count=None):
+        return self.buffer.drain(max_count)
+
+    def stats(self):
+        return dict(self.decoder.stats(), bytes_read=self.bytes_read, overruns=self.buffer.overruns,
+                    buffered=len(self.buffer))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def synthetic_telemetry_lines(n, seed=0):
+    """
+    Lines in format of Enkoder.ino, with slowly rotating phase and noise
+    """
+    rng = np.random.default_rng(seed)
+    phi = np.linspace(0, 8*np.pi, n)
+    a = (6000 + 2000*np.sin(phi) + rng.normal(0, 20, n)).astype(int)
+    b = (6000 + 2000*np.cos(phi) + rng.normal(0, 20, n)).astype(int)
+    return [f"[E] A:{a[i]:12d},B:{b[i]:12d},C:{0:12d},D:{0:12d},E:{int(100*phi[i]):12d},F:{0:12d},"
+            f"T:{1000*i:16d}\r\n".encode() for i in range(0, n)]
+
+
+class FakeSerialDevice:
+    """
+    Stand-in for the encoder: pseudo-terminal replaying given lines at given rate (lines per second).
+    Slave side (self.port) can be opened like real serial port. When nobody reads fast enough
+    and the terminal buffer is full, lines are dropped like by a device with full transmit buffer.
+    """
+    def __init__(self, lines, rate_hz, repeat=True):
+        import tty
+        self.lines = lines
+        self.rate_hz = rate_hz
+        self.repeat = repeat
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.port = os.ttyname(self.slave_fd)
+        self.lines_sent = 0
+        self.lines_dropped = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="fake-serial-device", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops sending, what was already sent can still be read
+        """
+        self.stop_event.set()
+        self.thread.join()
+
+    def close(self):
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    @property
+    def finished(self):
+        return not self.repeat and self.lines_sent + self.lines_dropped >= len(self.lines)
+
+    def _run(self):
+        start = time.monotonic()
+        pending = b""
+        next_line = 0
+        max_burst = 1024
+        while not self.stop_event.is_set() and not self.finished:
+            if pending:
+                pending = self._write(pending)
+            due = int((time.monotonic() - start)*self.rate_hz) - (self.lines_sent + self.lines_dropped)
+            if due <= 0:
+                time.sleep(min(1.0/self.rate_hz, 0.001))
+                continue
+            if not self.repeat:
+                due = min(due, len(self.lines) - next_line)
+            burst = [self.lines[(next_line + i) % len(self.lines)] for i in range(0, min(due, max_burst))]
+            next_line += len(burst)
+            if pending:
+                self.lines_dropped += len(burst)
+                continue
+            pending = self._write(b"".join(burst))
+            self.lines_sent += len(burst)
+        while pending and select.select([], [self.master_fd], [], 1.0)[1]:
+            pending = self._write(pending)
+
+    def _write(self, data):
+        try:
+            written = os.write(self.master_fd, data)
+        except BlockingIOError:
+            written = 0
+        return data[written:]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.thread.is_alive():
+            self.stop()
+        self.close()
+
+
+def measure_rate(lines, rate_hz, duration_s, drain_period_s, capacity):
+    """
+    Replays lines at rate_hz for duration_s, consumer drains buffer every drain_period_s
+    :return: dictionary with counts of sent, received and lost records
+    """
+    received = 0
+    with FakeSerialDevice(lines, rate_hz) as device:
+        connection = open_connection(device.port)
+        with SerialReader(connection, capacity=capacity) as reader:
+            end = time.monotonic() + duration_s
+            while time.monotonic() < end:
+                time.sleep(drain_period_s)
+                received += len(reader.drain())
+            device.stop()
+            sent = device.lines_sent
+            time.sleep(0.2)  # what is still on its way
+            received += len(reader.drain())
+            stats = reader.stats()
+        connection.close()
+        dropped_by_device = device.lines_dropped
+    return dict(stats, rate_hz=rate_hz, sent=sent, received=received, dropped_by_device=dropped_by_device,
+                lost=sent - received + dropped_by_device)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays telemetry through pseudo-terminal at increasing rates "
+                                                 "to find the highest rate received without losses")
+    parser.add_argument("-r", "--replay", default=None, help="file with recorded traffic (default: synthetic)")
+    parser.add_argument("--rates", default="1000,5000,20000,50000,100000,200000",
+                        help="comma separated rates in records per second")
+    parser.add_argument("-d", "--duration_s", type=float, default=2.0)
+    parser.add_argument("--drain_period_s", type=float, default=0.05)
+    parser.add_argument("-b", "--binary", action="store_true", help="replay traffic converted to binary frames")
+    parser.add_argument("--capacity", type=int, default=1 << 16)
+    parser.add_argument("-l", "--log_level", default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level,
+                        format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    if args.replay is None:
+        traffic = synthetic_telemetry_lines(10000)
+    else:
+        with open(args.replay, "rb") as f:
+            traffic = [line for line in f.read().splitlines(keepends=True) if line.strip()]
+    if args.binary:
+        traffic = text_to_binary(traffic)
+
+    sustainable = None
+    for rate in [float(r) for r in args.rates.split(",")]:
+        result = measure_rate(traffic, rate, args.duration_s, args.drain_period_s, args.capacity)
+        logger.info(f"{rate:>10.0f} records/s: sent {result['sent']}, received {result['received']}, "
+                    f"dropped by device {result['dropped_by_device']}, overruns {result['overruns']}, "
+                    f"decode errors {result['decode_errors']}")
+        if result["lost"] == 0 and result["decode_errors"] == 0:
+            sustainable = rate
+    logger.info(f"Highest rate without losses: {sustainable} records/s")
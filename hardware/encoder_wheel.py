@@ -1,9 +1,28 @@
-from shapely.geometry import Polygon
+from shapely.geometry import Polygon, Point
 from numpy import pi
 from shapely import affinity
+import numpy as np
+from hardware.geometry_cache import GeometryCache
+
+
+def rotate_vertices(vertices, angle_deg):
+    """
+    Rotate polygon corners counterclockwise around (0, 0), same as affinity.rotate(p, angle_deg, origin=(0, 0))
+    :param vertices: array of corners (..., 2)
+    :param angle_deg: rotation angle, scalar or array broadcastable to vertices.shape[:-2]
+    :return: array of rotated corners
+    """
+    angle_rad = np.radians(angle_deg)
+    c = np.cos(angle_rad)[..., np.newaxis]
+    s = np.sin(angle_rad)[..., np.newaxis]
+    x = vertices[..., 0]
+    y = vertices[..., 1]
+    return np.stack([c*x - s*y, s*x + c*y], axis=-1)
 
 
 class EncoderWheel:
+    margin = 80
+
     def __init__(self, r_mm, cpr, h_mm):
         self.radius_mm = r_mm
         self.count = cpr
@@ -12,6 +31,7 @@ class EncoderWheel:
         self.d_um = self.circ_um / (2.0 * self.count)
         self.dphi_deg = 360/(self.count)
         self.mm_to_um = 1000
+        self.templates_cache = GeometryCache()
 
     @property
     def line_height_um(self):
@@ -25,18 +45,124 @@ class EncoderWheel:
     def strip_max_y_um(self):
         return self.strip_min_y_um + self.line_height_um
 
-    def strips(self, angle_deg):
-        return self._create_strips_polygons(angle_deg)
+    def strips(self, angle_deg, footprint=None):
+        """
+        Polygons of strips for wheel rotated by angle_deg.
+        :param footprint: polygon (in coordinates of the wheel) which strips will be compared with.
+                          When given, only strips from angular window of footprint are generated,
+                          otherwise fixed margin of strips around angle 0 is used.
+        """
+        templates = self._templates()
+        if footprint is None:
+            return templates["fixed_polygons"] + [affinity.rotate(strip,
+                                                                  angle_deg,
+                                                                  origin=(0, 0),
+                                                                  use_radians=False)
+                                                  for strip in templates["polygons"]]
 
-    def _create_strips_polygons(self, angle_deg):
-        ss = []
-        margin = 80
+        first, count = self._visible_range(angle_deg, footprint)
+        fixed = [p for p in templates["fixed_polygons"] if p.intersects(footprint)]
+        return fixed + [affinity.rotate(templates["strip"],
+                                        (first + i)*self.dphi_deg + angle_deg,
+                                        origin=(0, 0),
+                                        use_radians=False)
+                        for i in range(0, count)]
+
+    def strips_vertices(self, angle_deg, footprint=None):
+        """
+        Same strips as strips(angle_deg, footprint), but as corners in array of shape (n_strips, 4, 2).
+        For array of angles the result has shape (*angle_deg.shape, n_strips, 4, 2),
+        number of strips is then the largest window among all angles.
+        """
+        templates = self._templates()
+        angle_deg = np.asarray(angle_deg, dtype=float)
+        fixed_vertices = templates["fixed_vertices"]
+        if footprint is None:
+            rotating = rotate_vertices(templates["vertices"], angle_deg[..., np.newaxis])
+        else:
+            first, count = self._visible_range(angle_deg, footprint)
+            rotations_deg = np.add.outer(first, np.arange(0, count))*self.dphi_deg + angle_deg[..., np.newaxis]
+            rotating = rotate_vertices(np.array(self._strip_corners()), rotations_deg)
+            (x0, y0, x1, y1) = footprint.bounds
+            touching = (fixed_vertices[:, :, 0].max(axis=-1) > x0) & (fixed_vertices[:, :, 0].min(axis=-1) < x1) & \
+                       (fixed_vertices[:, :, 1].max(axis=-1) > y0) & (fixed_vertices[:, :, 1].min(axis=-1) < y1)
+            fixed_vertices = fixed_vertices[touching]
+        fixed = np.broadcast_to(fixed_vertices, angle_deg.shape + fixed_vertices.shape)
+        return np.concatenate([fixed, rotating], axis=-3)
+
+    def visible_window(self, footprint):
+        """
+        Angular window of footprint widened by angular half width of a strip.
+        Angles are in degrees, counterclockwise from axis y, same as rotation of wheel.
+        :return: (phi_min_deg, phi_max_deg) or None if footprint is out of radial reach of strips
+        """
+        corners = np.asarray(footprint.exterior.coords)[:-1]
+        r_min = footprint.distance(Point(0, 0))
+        r_max = np.hypot(corners[:, 0], corners[:, 1]).max()
+        if r_max < self.strip_min_y_um or r_min > np.hypot(self.d_um/2, self.strip_max_y_um):
+            return None
+        if r_min == 0:
+            return -180.0, 180.0
+
+        phi = np.degrees(np.arctan2(-corners[:, 0], corners[:, 1]))
+        center = phi[0]
+        relative = np.mod(phi - center + 180.0, 360.0) - 180.0
+        half_width = np.degrees(np.arctan2(self.d_um/2, self.strip_min_y_um))
+        return center + relative.min() - half_width, center + relative.max() + half_width
+
+    def _visible_range(self, angle_deg, footprint):
+        """
+        Strip i lies at angle i*dphi + angle_deg, so window of footprint gives range of i directly.
+        Indices are not wrapped, rotation by (i + count)*dphi is the same strip anyway.
+        :return: (first index for every angle, number of strips - the same for all angles)
+        """
+        window = self.visible_window(footprint)
+        if window is None:
+            return np.zeros(np.shape(angle_deg), dtype=int), 0
+
+        (phi_min, phi_max) = window
+        eps = 1e-9
+        first = np.ceil((phi_min - angle_deg)/self.dphi_deg - eps).astype(int)
+        last = np.floor((phi_max - angle_deg)/self.dphi_deg + eps).astype(int)
+        count = int(np.max(last - first, initial=-1)) + 1
+        return first, min(count, self.count)
+
+    def _template_key(self):
+        return self.radius_mm, self.count, self.line_height_mm, self.margin
+
+    def _templates(self):
+        """
+        Strips at angle 0, which only need to be rotated by the angle of wheel
+        and lines fixed to the sensor side which do not rotate at all.
+        """
+        return self.templates_cache.get(self._template_key(), self._create_templates)
 
-        strip = Polygon([
+    def _strip_corners(self):
+        return [
             (-self.d_um/2, self.strip_min_y_um),
             (self.d_um/2, self.strip_min_y_um),
             (self.d_um/2, self.strip_max_y_um),
-            (-self.d_um/2, self.strip_max_y_um)])
+            (-self.d_um/2, self.strip_max_y_um)]
+
+    def _fixed_corners(self):
+        return []
+
+    def _create_templates(self):
+        rotations_deg = np.arange(-self.margin, self.margin)*self.dphi_deg
+        fixed = self._fixed_corners()
+        return {
+            "strip": Polygon(self._strip_corners()),
+            "polygons": self._create_strips_polygons(0),
+            "vertices": rotate_vertices(np.array(self._strip_corners()), rotations_deg),
+            "fixed_polygons": [Polygon(corners) for corners in fixed],
+            "fixed_vertices": np.array(fixed, dtype=float).reshape((len(fixed), 4, 2))
+        }
+
+    def _create_strips_polygons(self, angle_deg):
+        ss = []
+        margin = self.margin
+
+        strip = Polygon(self._strip_corners())
         for i in range(-margin, margin):
             ss.append(affinity.rotate(strip,
                                       i*self.dphi_deg + angle_deg,
@@ -53,27 +179,33 @@ class EncoderWheelWithTopAndBottomStrips(EncoderWheel):
         self.bottom_line_width_um = h_line_um
         self.top_line_width_um = h_line_um
 
-    def _create_strips_polygons(self, angle_deg):
+    def _template_key(self):
+        return EncoderWheel._template_key(self) + (self.distance_to_bottom_line_um, self.bottom_line_width_um,
+                                                   self.distance_to_top_line_um, self.top_line_width_um)
+
+    def _line_bottom_corners(self):
         x0 = -40000
         x1 = 40000
         y0 = self.strip_min_y_um - self.distance_to_bottom_line_um
         y1 = self.strip_min_y_um - (self.distance_to_bottom_line_um + self.bottom_line_width_um)
-
-        line_bottom = Polygon([
+        return [
             (x0, y0),
             (x1, y0),
             (x1, y1),
             (x0, y1)
-        ])
+        ]
 
+    def _line_top_corners(self):
+        x0 = -40000
+        x1 = 40000
         y0 = self.strip_max_y_um + self.distance_to_top_line_um
         y1 = self.strip_max_y_um + (self.distance_to_top_line_um + self.top_line_width_um)
-
-        line_top = Polygon([
+        return [
             (x0, y0),
             (x1, y0),
             (x1, y1),
             (x0, y1)
-        ])
+        ]
 
-        return [line_bottom] + EncoderWheel._create_strips_polygons(self, angle_deg) # + [line_top]
+    def _fixed_corners(self):
+        return [self._line_bottom_corners()]  # + [self._line_top_corners()]
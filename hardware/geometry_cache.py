@@ -0,0 +1,36 @@
+import time
+
+
+class GeometryCache:
+    """
+    Single-entry cache for geometry derived from a few parameters.
+    Value is rebuilt whenever the key (tuple of parameters it depends on) changes.
+    """
+    def __init__(self):
+        self.key = None
+        self.value = None
+        self.hits = 0
+        self.misses = 0
+        self.build_time_s = 0.0
+
+    def get(self, key, build):
+        if self.value is not None and key == self.key:
+            self.hits += 1
+            return self.value
+
+        self.misses += 1
+        start = time.perf_counter()
+        self.value = build()
+        self.build_time_s += time.perf_counter() - start
+        self.key = key
+        return self.value
+
+    def invalidate(self):
+        self.key = None
+        self.value = None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "build_time_s": self.build_time_s}
+
+    def __repr__(self):
+        return f"GeometryCache(hits={self.hits}, misses={self.misses}, build_time={self.build_time_s:.6f}s)"
@@ -1,7 +1,7 @@
-import json
-import os
 from shapely.geometry import Polygon
 from shapely import affinity
+from config.config_utils import get_fake_inputs_path
+from storage.readout_store import open_converted
 
 
 class LinearCCDSensor:
@@ -14,6 +14,7 @@ class LinearCCDSensor:
         self.pixel_h_um = pixel_h_um
         self.horizontal_spacing_um = horizontal_spacing_um
         self.dx = pixel_w_um + horizontal_spacing_um
+        self.readout_store = None
 
     @property
     def height(self):
@@ -53,15 +54,12 @@ class LinearCCDSensor:
         return segments
 
     def get_data(self, i=0):
-        my_dir = os.path.split(__file__)[0].replace("/", "\\")
-        dir_below = os.path.split(my_dir)[0]
-        default_config_dir = os.path.join(dir_below, "config")
-        fake_input_json = os.path.join(default_config_dir, 'fake_inputs.json')
-        with open(fake_input_json) as f:
-            j = json.load(f)
-
-        data_array_of_readouts = j["data"]
-        return data_array_of_readouts[i]
+        """
+        :return: i-th frame of fake inputs, as a row view of memory mapped readout store
+        """
+        if self.readout_store is None:
+            self.readout_store = open_converted(get_fake_inputs_path())
+        return self.readout_store.get_data(i)
 
     @classmethod
     def from_json(cls, j):
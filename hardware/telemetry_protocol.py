@@ -0,0 +1,258 @@
+"""
+Telemetry of the encoder: binary frames and the old text lines.
+
+Binary frame, all numbers little endian:
+
+    sync    2 bytes  A5 5A
+    kind    uint8    KIND_READOUT or KIND_CCD_FRAME
+    length  uint16   length of payload in bytes
+    payload
+    crc     uint32   zlib.crc32 of kind, length and payload
+
+Payload of KIND_READOUT is A, B (uint32), C, D, E, F (int32), T (uint32, micros() of Arduino),
+payload of KIND_CCD_FRAME is T (uint32) followed by uint16 value of every pixel.
+
+Text lines are what printReadoutToSerial in old_stuff/Enkoder.ino prints; they are still decoded,
+so logs of old firmware can be replayed. All decoders have the same interface: feed(bytes) returns
+structured array of records of TELEMETRY_DTYPE, stats() returns counters.
+"""
+import re
+import zlib
+import struct
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SYNC = b"\xa5\x5a"
+KIND_READOUT = 1
+KIND_CCD_FRAME = 2
+
+HEADER = struct.Struct("<2sBH")
+CRC = struct.Struct("<I")
+MAX_PAYLOAD = 8192
+
+FIELDS = ("A", "B", "C", "D", "E", "F", "T")
+TELEMETRY_DTYPE = np.dtype([(f, "<i8") for f in FIELDS])
+READOUT_WIRE_DTYPE = np.dtype([("A", "<u4"), ("B", "<u4"), ("C", "<i4"), ("D", "<i4"), ("E", "<i4"),
+                               ("F", "<i4"), ("T", "<u4")])
+
+
+def _frame(kind, payload):
+    header = HEADER.pack(SYNC, kind, len(payload))
+    return header + payload + CRC.pack(zlib.crc32(header[len(SYNC):] + payload))
+
+
+def encode_readouts(records):
+    """
+    :param records: structured array with fields A..T (e.g. of TELEMETRY_DTYPE)
+    :return: list of binary frames, one per record
+    """
+    wire = np.empty(len(records), dtype=READOUT_WIRE_DTYPE)
+    for f in FIELDS:
+        wire[f] = records[f]
+    return [_frame(KIND_READOUT, payload.tobytes()) for payload in wire]
+
+
+def encode_ccd_frame(t, pixels):
+    return _frame(KIND_CCD_FRAME, struct.pack("<I", t) + np.asarray(pixels, dtype="<u2").tobytes())
+
+
+def ccd_frame_dtype(n_pixels):
+    return np.dtype([("T", "<u4"), ("pixels", "<u2", (n_pixels,))])
+
+
+def _gather(buffer, positions, length):
+    """
+    :return: array of shape (len(positions), length) with bytes starting at every position
+    """
+    return buffer[positions[:, np.newaxis] + np.arange(0, length)]
+
+
+class TextTelemetryDecoder:
+    """
+    Lines like printed by printReadoutToSerial in Enkoder.ino:
+    [E] A:         123,B:         456,C:          -7,D:           8,E:           9,F:          10,T:      1234567
+    Other lines (e.g. "[G] Global state = 1") are counted as skipped, broken telemetry lines as decode errors.
+    """
+    tag = b"[E]"
+    dtype = TELEMETRY_DTYPE
+    pair = re.compile(rb"\s*([A-Z])\s*:\s*(-?\d+)\s*")
+
+    def __init__(self):
+        self.pending = b""
+        self.records = 0
+        self.skipped = 0
+        self.decode_errors = 0
+
+    def feed(self, data):
+        """
+        :param data: bytes as they arrived, lines may be split anywhere
+        :return: structured array of decoded records
+        """
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+        decoded = []
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(self.tag):
+                self.skipped += bool(line)
+                continue
+            record = self.decode_line(line[len(self.tag):])
+            if record is None:
+                self.decode_errors += 1
+            else:
+                decoded.append(record)
+        self.records += len(decoded)
+        return np.array(decoded, dtype=self.dtype)
+
+    def decode_line(self, line):
+        values = {}
+        for item in line.split(b","):
+            match = self.pair.fullmatch(item)
+            if match is None:
+                return None
+            values[match.group(1).decode()] = int(match.group(2))
+        if len(values) != len(FIELDS) or any(f not in values for f in FIELDS):
+            return None
+        return tuple(values[f] for f in FIELDS)
+
+    def stats(self):
+        return {"records": self.records, "skipped": self.skipped, "decode_errors": self.decode_errors}
+
+
+class BinaryTelemetryDecoder:
+    """
+    Frames are only located one by one (sync, header and CRC check), payloads of all frames found in
+    the buffer are then converted at once. Bytes before sync and frames with wrong CRC are skipped
+    and counted, decoding continues from the next sync.
+    """
+    dtype = TELEMETRY_DTYPE
+
+    def __init__(self, on_ccd_frames=None):
+        """
+        :param on_ccd_frames: called with structured array of ccd_frame_dtype for every batch of CCD frames
+        """
+        self.on_ccd_frames = on_ccd_frames
+        self.pending = b""
+        self.records = 0
+        self.ccd_frames = 0
+        self.skipped = 0
+        self.decode_errors = 0
+
+    def feed(self, data):
+        """
+        :param data: bytes as they arrived, frames may be split anywhere
+        :return: structured array of decoded readouts
+        """
+        data = self.pending + data
+        readouts, frames, consumed = self.decode(data)
+        self.pending = data[consumed:]
+        self.records += len(readouts)
+        for block in frames:
+            self.ccd_frames += len(block)
+            if self.on_ccd_frames is not None:
+                self.on_ccd_frames(block)
+        return readouts
+
+    def decode(self, data):
+        """
+        :return: (readouts, list of arrays of CCD frames - one per number of pixels, number of bytes consumed)
+        """
+        positions, kinds, lengths, consumed = self._locate(data)
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        readout = kinds == KIND_READOUT
+        valid = readout & (lengths == READOUT_WIRE_DTYPE.itemsize)
+        self.decode_errors += int(np.count_nonzero(readout & ~valid))
+        payloads = _gather(buffer, positions[valid], READOUT_WIRE_DTYPE.itemsize)
+        readouts = payloads.view(READOUT_WIRE_DTYPE)[:, 0].astype(self.dtype)
+        frames = []
+        for length in np.unique(lengths[~readout]):
+            selected = ~readout & (lengths == length)
+            if length <= 4 or length % 2:
+                self.decode_errors += int(np.count_nonzero(selected))
+                continue
+            payloads = _gather(buffer, positions[selected], length)
+            frames.append(payloads.view(ccd_frame_dtype((length - 4) // 2))[:, 0])
+        return readouts, frames, consumed
+
+    def _locate(self, data):
+        """
+        :return: (positions of payloads, kinds, lengths, number of bytes consumed)
+        """
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        starts = np.flatnonzero((buffer[:-1] == SYNC[0]) & (buffer[1:] == SYNC[1]))
+        positions, kinds, lengths = [], [], []
+        position = 0
+        for start in starts.tolist():
+            if start < position:  # sync bytes inside payload of already decoded frame
+                continue
+            self.skipped += start - position
+            position = start
+            if start + HEADER.size > len(data):
+                break
+            _, kind, length = HEADER.unpack_from(data, start)
+            end = start + HEADER.size + length + CRC.size
+            if length > MAX_PAYLOAD or kind not in (KIND_READOUT, KIND_CCD_FRAME):
+                self.decode_errors += 1
+                position = start + 1
+                continue
+            if end > len(data):
+                break
+            (crc,) = CRC.unpack_from(data, end - CRC.size)
+            if crc != zlib.crc32(memoryview(data)[start + len(SYNC):end - CRC.size]):
+                self.decode_errors += 1
+                position = start + 1
+                continue
+            positions.append(start + HEADER.size)
+            kinds.append(kind)
+            lengths.append(length)
+            position = end
+        else:
+            # everything up to the last byte (it may be first byte of sync) is consumed
+            tail = len(data) - (len(data) > position and data[-1] == SYNC[0])
+            self.skipped += max(tail - position, 0)
+            position = max(position, tail)
+        return np.array(positions, dtype=int), np.array(kinds, dtype=int), np.array(lengths, dtype=int), position
+
+    def stats(self):
+        return {"records": self.records, "ccd_frames": self.ccd_frames, "skipped": self.skipped,
+                "decode_errors": self.decode_errors}
+
+
+class AutoTelemetryDecoder:
+    """
+    Binary or text decoder, whichever protocol appears first in the stream
+    """
+    dtype = TELEMETRY_DTYPE
+
+    def __init__(self, on_ccd_frames=None):
+        self.on_ccd_frames = on_ccd_frames
+        self.decoder = None
+        self.pending = b""
+
+    def feed(self, data):
+        if self.decoder is None:
+            self.pending += data
+            binary = self.pending.find(SYNC)
+            text = self.pending.find(b"\n")
+            if binary < 0 and text < 0:
+                return np.empty(0, dtype=self.dtype)
+            if binary >= 0 and (text < 0 or binary < text):
+                self.decoder = BinaryTelemetryDecoder(self.on_ccd_frames)
+            else:
+                self.decoder = TextTelemetryDecoder()
+            logger.info("Telemetry decoded by %s", type(self.decoder).__name__)
+            data, self.pending = self.pending, b""
+        return self.decoder.feed(data)
+
+    def stats(self):
+        return {} if self.decoder is None else self.decoder.stats()
+
+
+def text_to_binary(lines):
+    """
+    Converts log of old firmware into binary frames (lines which are not readouts are dropped)
+    """
+    decoder = TextTelemetryDecoder()
+    return encode_readouts(decoder.feed(b"".join(line.rstrip(b"\r\n") + b"\n" for line in lines)))
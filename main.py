@@ -1,6 +1,7 @@
 from hardware.linear_ccd_sensor import LinearCCDSensor
 from hardware.encoder_wheel import EncoderWheelWithTopAndBottomStrips
 from processing.line_fitter import LineFitter, split_vertically_by_threshold
+from processing.crossings import first_crossings
 from scipy.ndimage import gaussian_filter1d
 from processing.y_shift_estimator import SensorYShiftEstimator, normalize, gauss_4, gauss_5, gauss_6
 from visualisation.plotter import Plotter
@@ -13,6 +14,13 @@ import json
 import argparse
 import logging
 from config.config_utils import get_default_sensors_config
+from processing.pipeline import Pipeline, simulated_source, preprocess, estimate_shift, estimate_width, \
+    integrate, log_sink
+from processing.error_analytics import ErrorAnalytics
+from functools import partial
+from processing import instrumentation
+from processing.instrumentation import stage
+from simulation.noise import SensorNoiseModel
 
 useful_begin = 15
 constant_as_to_deg = 0.1/360  # 1/3600 of one degree
@@ -38,38 +46,27 @@ logger = logging.getLogger(__name__)
 history_period_arcsek = 1296000.0 / N_paskow
 
 
-def get_one_width(image, threshold):
-    rising = True if image[0] < threshold else False
-    map_of_crossings = {}
-    larger = False
-    for i in range(0, len(image)):
-        p = image[i]
-        if rising and p > threshold:
-            map_of_crossings[rising] = i
-            larger = rising
-            rising = False
-        if not rising and p < (1.0 - threshold):
-            map_of_crossings[rising] = i
-            larger = rising
-            rising = True
+width_thresholds = np.arange(0, 1, 0.1)
 
-    if True in map_of_crossings and False in map_of_crossings:
-        return map_of_crossings[larger] - map_of_crossings[not larger]
-    return 0
 
-
-def get_width_of_stripe_in_pixels(raw, sane_estimate):
-    threshold_of_sanity = 0.8
+def get_widths_of_stripe_in_pixels(raw, thresholds=width_thresholds):
+    """
+    Distance between first crossing of normalized image rising above threshold
+    and first crossing falling under (1 - threshold), for every threshold.
+    For edges of the same slope it does not depend on threshold.
+    :return: array of widths, NaN for thresholds not crossed both ways
+    """
     image = normalize(raw)
-    thresholds = np.arange(0, 1, 0.1)
-    samples = [get_one_width(image, p) for p in thresholds]
-
-    def is_sane(x):
-        return abs(x - sane_estimate) < threshold_of_sanity * sane_estimate
+    rising, falling = first_crossings(image, thresholds, 1.0 - thresholds)
+    return np.abs(falling - rising)
 
-    useful_samples = np.array([p for p in samples if is_sane(p)])
-    return np.median(useful_samples) if useful_samples.any() else 0
 
+@stage("get_width_of_stripe_in_pixels")
+def get_width_of_stripe_in_pixels(raw, sane_estimate):
+    threshold_of_sanity = 0.8
+    samples = get_widths_of_stripe_in_pixels(raw)
+    useful_samples = samples[np.abs(samples - sane_estimate) < threshold_of_sanity * sane_estimate]
+    return np.median(useful_samples) if useful_samples.size else 0
 
 
 class HistoricalCrossing:
@@ -136,6 +133,7 @@ class CrudestEstimator:
 
         raise Exception("something is bad")
 
+    @stage("CrudestEstimator.update_with_global")
     def update_with_global(self, fi_as, raw_image):
         image = normalize(raw_image)
         if self.control_pixel_index is None:
@@ -175,9 +173,25 @@ class CrudestEstimator:
 
 finer_threshold = 2
 
+CORRELATION_INTERPOLATED = "interpolated"
+CORRELATION_FFT = "fft"
+correlation_methods = [CORRELATION_INTERPOLATED, CORRELATION_FFT]
+
 
 class FinerEstimator:
-    def __init__(self):
+    def __init__(self, method=CORRELATION_INTERPOLATED, max_shift_px=10):
+        """
+        :param method: CORRELATION_INTERPOLATED correlates frames upsampled with quadratic spline,
+                       CORRELATION_FFT compares native frames through FFT against cached spectrum of reference frame
+                       and refines the best shift with parabola through three samples
+        :param max_shift_px: largest shift searched for by CORRELATION_FFT
+        """
+        if method not in correlation_methods:
+            raise ValueError(f"Unknown correlation method: {method}, expected one of {correlation_methods}")
+        self.method = method
+        self.margin_px = int(np.ceil(max_shift_px)) + 1
+        self.reference_spectrum = None
+        self.spectrum_of = None
         self.last_x = None
         self.last_image = None
         self.oldest_image = None
@@ -186,6 +200,8 @@ class FinerEstimator:
 
     def prepare_image(self, raw):
         image = np.array(raw) - np.average(raw)
+        if self.method == CORRELATION_FFT:
+            return image
 
         x = np.arange(0, len(image))
         f = interp1d(x, image, 'quadratic')
@@ -195,6 +211,9 @@ class FinerEstimator:
         return ynew
 
     def calculate_shift_px(self, prepared):
+        if self.method == CORRELATION_FFT:
+            return self._calculate_shift_px_fft(prepared)
+
         x_corr = np.correlate(prepared[100:-100], self.last_image, "valid")
         # plotter = Plotter()
         # plotter.plot_simple(prepared)
@@ -206,6 +225,32 @@ class FinerEstimator:
         maximum_x = np.argmax(x_corr) - 100
         return maximum_x / self.xcorr_scale
 
+    def _calculate_shift_px_fft(self, image):
+        """
+        Shift minimizing sum of squared differences between current frame and middle part of reference,
+        which does not depend on energy of frame moving in and out of the window like raw correlation peak does.
+        Correlation part comes from product of spectra (spectrum of reference is cached until it is replaced),
+        energy of every window from cumulative sum.
+        """
+        m = self.margin_px
+        n = len(image)
+        w = n - 2*m
+        padded_n = n + w
+        if self.reference_spectrum is None or self.spectrum_of is not self.last_image:
+            self.reference_spectrum = np.conj(np.fft.rfft(self.last_image[m:n-m], n=padded_n))
+            self.spectrum_of = self.last_image
+        x_corr = np.fft.irfft(np.fft.rfft(image, n=padded_n) * self.reference_spectrum, n=padded_n)[:2*m + 1]
+
+        cumulative_energy = np.concatenate([[0.0], np.cumsum(image * image)])
+        ssd = cumulative_energy[w:w + 2*m + 1] - cumulative_energy[:2*m + 1] - 2.0*x_corr
+
+        p = min(max(np.argmin(ssd), 1), 2*m - 1)
+        y1, y2, y3 = ssd[p - 1:p + 2]
+        curvature = y1 - 2.0*y2 + y3
+        offset = 0.5*(y1 - y3)/curvature if curvature > 0 else 0.0
+        return p - m + offset
+
+    @stage("FinerEstimator.get_dx_px")
     def get_dx_px(self, image):
         if self.last_image is None:
             self.last_image = self.prepare_image(image)
@@ -234,6 +279,7 @@ class FinerEstimator:
  #            updates.append(set_point_in_history(i, rising))
 
 
+@stage("calculate_dfi_as")
 def calculate_dfi_as(width_of_stripe_px, pixel_difference_from_last_reading):
     if width_of_stripe_px == 0 or R_um == 0:
         return 0
@@ -250,6 +296,7 @@ class SimplestEstimator:
         self.last_index = {}
         self.gaussed = None
 
+    @stage("threshold_scanning")
     def get_first_above(self, image, threshold=0.5):
         starting_dir = image[0] < threshold
         for i in range(0, len(image)):
@@ -257,6 +304,7 @@ class SimplestEstimator:
             if direction is not starting_dir:
                 return i
 
+    @stage("threshold_scanning")
     def get_first_under(self, image, threshold):
         starting_dir = image[0] > threshold
         for i in range(0, len(image)):
@@ -264,6 +312,7 @@ class SimplestEstimator:
             if direction is not starting_dir:
                 return i
 
+    @stage("SimplestEstimator.get_dx_px")
     def get_dx_px(self, raw, percents=50, low=False):
         image = gauss_6(raw)[6:-6]
         image = normalize(image)
@@ -304,10 +353,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config_for_sensors", default=get_default_sensors_config())
     parser.add_argument("-l", "--log_level", default=20)
+    parser.add_argument("-p", "--profile_stages", action="store_true", help="log latencies of stages at the end")
+    parser.add_argument("-t", "--trace", default=None, help="write Chrome trace of all stages to this file")
+    parser.add_argument("-n", "--noise", action="store_true", help="simulate noise of sensor and ADC")
+    parser.add_argument("--seed", type=int, default=None, help="seed of simulated noise")
     args = parser.parse_args()
 
     logging.basicConfig(level=args.log_level,
                         format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    if args.profile_stages or args.trace:
+        instrumentation.enable(trace=args.trace is not None)
 
     logger.debug(f"Opening config file from {args.config_for_sensors}")
     with open(args.config_for_sensors) as f:
@@ -321,75 +376,39 @@ if __name__ == "__main__":
 
     # Main loop:
     begin_angle_as = 0
-    actual_estimate_fi_as = None  # as is short for arcsecond, obviously
-    last_dfi_as = 0
-    index = 0
     angles_deg = np.arange(begin_angle_as, begin_angle_as + 720, 5)*constant_as_to_deg
     r_angles = constant_as_to_deg * (0.5 - np.random.rand(len(angles_deg)))
     angles_deg = np.add(angles_deg, r_angles)
-    register_fi = []
 
     readout_generator = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=1.4, sensor_shift_um=(0, -765))
     crudest_estimator = CrudestEstimator()
     finer_estimator = FinerEstimator()
     simplest_estimator = SimplestEstimator()
 
-    for angle_deg in angles_deg:
-        raw = readout_generator.for_angle(angle_deg)
-        #raw = [ 0.0, 5.39682, 12.1429, 21.5873, 32.3809, 37.7778, 41.8254, 47.2222, 52.619, 163.254, 248.254, 255.0, 215.873, 147.063, 111.984, 110.635, 125.476, 117.381, 125.476, 129.524, 130.873, 138.968, 145.714, 149.762, 151.111, 151.111, 155.159, 155.159, 168.651, 175.397, 170.0, 170.0, 178.095, 183.492, 184.841, 190.238, 190.238, 203.73, 201.032, 210.476, 203.73, 219.921, 226.667, 226.667, 236.111, 238.809, 241.508, 245.555, 241.508, 241.508, 246.905, 226.667, 228.016, 233.413, 225.317, 240.159, 238.809, 240.159, 241.508, 249.603, 238.809, 223.968, 242.857, 252.302, 248.254, 245.555, 238.809, 238.809, 222.619, 219.921, 222.619, 222.619, 213.174, 211.825, 203.73, 198.333, 201.032, 201.032, 194.286, 196.984, 190.238, 184.841, 187.54, 186.19, 176.746, 174.048, 168.651, 170.0, 167.302, 167.302, 167.302, 161.905, 160.555, 149.762, 148.413, 149.762, 144.365, 137.619, 143.016, 134.921, 137.619, 133.571, 126.825, 120.079, 116.032, 114.682, 116.032, 114.682, 114.682, 114.682, 113.333, 113.333, 113.333, 114.682, 113.333, 113.333, 114.682, 114.682, 114.682, 114.682, 114.682, 114.682, 114.682, 116.032, 116.032, 136.27, 174.048, 179.444 ]
-        #raw = [ 0.0, 2.41706, 6.04265, 8.45971, 10.8768, 41.09, 170.403, 240.498, 255.0, 134.147, 53.1753, 42.2986, 39.8815, 38.673, 39.8815, 41.09, 41.09, 41.09, 39.8815, 39.8815, 39.8815, 39.8815, 41.09, 41.09, 42.2986, 42.2986, 43.5071, 47.1327, 45.9241, 44.7156, 49.5497, 55.5924, 56.8009, 54.3839, 64.0521, 74.9289, 73.7203, 78.5545, 89.4312, 101.517, 96.6824, 97.891, 113.602, 126.896, 122.062, 125.687, 138.981, 134.147, 145.024, 154.692, 161.943, 166.777, 155.9, 165.569, 180.071, 167.986, 172.82, 182.488, 187.322, 190.948, 189.739, 189.739, 188.531, 184.905, 180.071, 188.531, 201.825, 201.825, 171.611, 184.905, 182.488, 189.739, 196.99, 167.986, 166.777, 174.028, 174.028, 163.152, 152.275, 152.275, 143.815, 136.564, 130.521, 128.104, 113.602, 111.185, 102.725, 99.0995, 87.0142, 78.5545, 76.1374, 68.8862, 61.635, 65.2606, 64.0521, 61.635, 60.4265, 56.8009, 54.3839, 54.3839, 54.3839, 55.5924, 55.5924, 55.5924, 56.8009, 56.8009, 55.5924, 55.5924, 55.5924, 56.8009, 56.8009, 60.4265, 61.635, 64.0521, 65.2606, 65.2606, 66.4692, 64.0521, 65.2606, 72.5118, 83.3886, 84.5971, 88.2227, 96.6824, 108.768, 138.981, 143.815, 132.938 ]
-        useful_raw = raw[useful_begin:]
-
-        # plotter = Plotter()
-        # plotter.plot_simple(useful_raw)
-        # plotter.show_plot()
-
-        # pixel_difference_from_last_reading = finer_estimator.get_dx_px(useful_raw)
-        pixel_difference_from_last_reading = 0
-
-
-        dx4, i4 = simplest_estimator.get_dx_px(useful_raw, 60, True)
-
-
-        pixel_difference_from_last_reading = dx4
-
-        width_of_stripe_px = 45.0  # TODO
-
-        #############
-        dy_inaccurate_but_sane = 45.0
-        dy = get_width_of_stripe_in_pixels(useful_raw, dy_inaccurate_but_sane)
-        threshold_of_sanity = 0.8
-        if (abs(dy - dy_inaccurate_but_sane) > threshold_of_sanity * dy_inaccurate_but_sane):
-            dy = dy_inaccurate_but_sane
-        ##########
-        # width_of_stripe_px = dy
-
-        # logger.info(f"DY calculated = {dy}, DY working nice = {fragment.length+5}, used = {used}")
-
-
-        # To first approximation this should not change much:
-        dfi_as = calculate_dfi_as(width_of_stripe_px, pixel_difference_from_last_reading)
-
-        if actual_estimate_fi_as is None:
-            actual_estimate_fi_as = 0
-        else:
-            actual_estimate_fi_as += (dfi_as if abs(dfi_as) < sensitivity_threshold_as else last_dfi_as)
-            last_dfi_as = dfi_as
-
-        # actual_estimate_fi_as = crudest_estimator.update_with_global(actual_estimate_fi_as, useful_raw)
-
-        relative_angle_as = angle_deg*constant_deg_to_as - begin_angle_as
-        logger.info(f"Index = {index}. "
-                    f"Angle = {relative_angle_as}\". "
-                    f"Actual estimate = {actual_estimate_fi_as}\"")
-
-        register_fi.append(actual_estimate_fi_as)
-        index += 1
+    dy_inaccurate_but_sane = 45.0
+    analytics = ErrorAnalytics(period=pasek_as, capacity=len(angles_deg), increments=False)
+    noise = SensorNoiseModel.for_sensor(sensor, seed=args.seed) if args.noise else None
+    pipeline = Pipeline(simulated_source(readout_generator, angles_deg, noise=noise),
+                        partial(preprocess, begin=useful_begin),
+                        partial(estimate_shift, estimator=simplest_estimator, args=(60, True)),
+                        partial(estimate_width, width_function=get_width_of_stripe_in_pixels,
+                                sane_estimate_px=dy_inaccurate_but_sane),
+                        partial(integrate, dfi_function=calculate_dfi_as,
+                                sensitivity_threshold_as=sensitivity_threshold_as),
+                        log_sink,
+                        partial(analytics.sink, origin_as=begin_angle_as))
+    pipeline.run()
+    pipeline.log_stats()
+    if instrumentation.is_enabled():
+        instrumentation.log_summary()
+    if args.trace:
+        instrumentation.export_chrome_trace(args.trace)
+    analytics.log_summary()
+    snapshot = analytics.snapshot()
 
     plotter = Plotter()
-    plotter.plot_simple(register_fi)
-    angles = [int(3600 * a) - begin_angle_as for a in angles_deg]
-    plotter.plot_simple(angles)
-    plotter.plot_simple([a - b for (a, b) in zip(angles, register_fi)])
+    plotter.plot_simple(snapshot["estimate"])
+    plotter.plot_simple(snapshot["position"])
+    plotter.plot_simple(-snapshot["cumulative"])
     plotter.show_plot()
     plotter.save_plot()
@@ -5,6 +5,8 @@ import matplotlib.pyplot as plt
 from shapely import affinity
 from shapely.geometry import Polygon
 from estimators import EstimatorPreviousN, smooth
+from simulation.collision_checker import CollisionChecker
+from processing.error_analytics import ErrorAnalytics
 
 sensor_N = 128
 grubosc_paska_mm = 0.128
@@ -23,7 +25,8 @@ global_readout = np.zeros(sensor_N)
 global_line = None
 global_line_smooth = None
 global_phi = 0
-global_errors = []
+# first estimate has no previous frame:
+global_errors = ErrorAnalytics(period=pasek_as, warmup=1)
 
 class DrawableRectangleObject:
     def __init__(self, xy, w, h, c, a):
@@ -152,29 +155,6 @@ class Strips:
         return self.polys
 
 
-class CollisionChecker:
-    def __init__(self):
-        self.sensor = None
-        self.strips = None
-
-    def set_sensor(self, sensor):
-        self.sensor = sensor
-
-    def set_strips(self, strips):
-        self.strips = strips
-
-    def check_collisions(self):
-        set_of_intersecting = [s for s in self.strips.get_polys() if s.intersects(self.sensor.get_border())]
-        max_area = self.sensor.get_polys()[0].area
-        readout = max_area * np.ones(self.sensor.N)
-        for i in range(0, self.sensor.N):
-            segment = self.sensor.get_polys()[i]
-            for strip in set_of_intersecting:
-                readout[i] -= segment.intersection(strip).area
-
-        return readout + 0.1 * max_area * (-0.5 * np.ones(self.sensor.N) + np.random.rand(self.sensor.N))
-
-
 collision_checker = CollisionChecker()
 
 estimator = EstimatorPreviousN(10)
@@ -198,7 +178,7 @@ def update():
     # estimate position:
     estimate_arcsec = 4.18*estimator.estimate(readout)
     error_arcsec = estimate_arcsec - random_angle_arcsec
-    global_errors.append(error_arcsec)
+    global_errors.update(random_angle_arcsec, estimate_arcsec)
 
     print(f"phi: {global_phi}\", "
           f"delta = {random_angle_arcsec}\","
@@ -248,11 +228,11 @@ for i in range(0, 500):
 
 plt.show()
 
+print(global_errors.summary())
+snapshot = global_errors.snapshot()
 fig, ax = plt.subplots()
-ax.plot(global_errors[1:])
-sums = [np.sum(global_errors[1:i]) for i in range(1, len(global_errors))]
-print(sums)
-ax.plot(sums)
+ax.plot(snapshot["error"])
+ax.plot(snapshot["cumulative"])
 ax.set_ylim(-1000, 1000)
 plt.show()
 
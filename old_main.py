@@ -13,6 +13,7 @@ import json
 import argparse
 import logging
 from config.config_utils import get_default_sensors_config
+from estimators import Correlator
 
 grubosc_paska_mm = 0.128
 N_paskow = 3600
@@ -39,44 +40,6 @@ class Fragment:
         return f"[{self.begin}, {self.end})"
 
 
-class Correlator:
-    def __init__(self, readout_t_us=200):
-        self.phi_as = 0
-        self.images = []
-        self.readout_t_us = readout_t_us
-        self.last_readout = 0
-        self.N = 10
-        self.difference_threshold = 1.0
-
-    def update(self, new_image):
-        if not self.images:
-            self.images.append(new_image)
-            return 0
-
-        if self.N > 0:
-            self.N -= 1
-        else:
-            self.N = 10
-            self.images.insert(0, new_image)
-
-        c = self._get_shift_in_pixels_between_images(new_image, self.images[-1])
-        if len(self.images) > self.N and abs(self.last_readout - c) > self.difference_threshold:
-            self.images.pop()
-
-        self.last_readout = c
-        return c
-
-    def _get_shift_in_pixels_between_images(self, new_image, old_image):
-        x_corr = np.correlate(new_image, old_image, "same")
-
-        # plotter = Plotter()
-        # plotter.plot_simple(new_image)
-        # plotter.plot_simple(old_image)
-        # plotter.plot_simple(x_corr)
-        # plotter.show_plot()
-        return np.argmax(x_corr)
-
-
 def get_longest_line_fragment(image):
 
     image = savgol_filter(image, 25, 2)
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+def threshold_states(data, threshold):
+    """
+    State of every sample: True above threshold, False under it.
+    Sample equal to threshold keeps state of previous one, first sample is above unless it is under threshold.
+    :param data: array of shape (..., N), crossings are searched along last axis
+    :param threshold: scalar or array broadcastable to data (e.g. (n_frames, 1) for one threshold per frame)
+    :return: boolean array of the same shape as data
+    """
+    data = np.asarray(data)
+    under = data < threshold
+    above = ~under
+    decided = under | (data > threshold)
+    decided[..., 0] = True
+    if decided.all():
+        return above
+
+    n = data.shape[-1]
+    last_decided = np.where(decided, np.arange(0, n), 0)
+    np.maximum.accumulate(last_decided, axis=-1, out=last_decided)
+    return np.take_along_axis(above, last_decided, axis=-1)
+
+
+def crossing_mask(data, threshold):
+    """
+    :return: boolean array of the same shape as data, True at samples where state differs from previous sample
+    """
+    return _state_changes(threshold_states(data, threshold))
+
+
+def _state_changes(states):
+    mask = np.zeros(states.shape, dtype=bool)
+    mask[..., 1:] = states[..., 1:] != states[..., :-1]
+    return mask
+
+
+def find_crossings(data, threshold):
+    """
+    :return: indices of crossings of 1D data, or list of such arrays for every row of 2D data
+    """
+    mask = crossing_mask(data, threshold)
+    if mask.ndim == 1:
+        return np.flatnonzero(mask)
+    return [np.flatnonzero(row) for row in mask]
+
+
+def multi_threshold_crossing_mask(data, thresholds):
+    """
+    Crossings of data with every threshold at once.
+    :param data: array of shape (..., N)
+    :param thresholds: 1D array of T thresholds
+    :return: boolean array of shape (..., T, N)
+    """
+    data = np.asarray(data)
+    thresholds = np.asarray(thresholds)
+    return crossing_mask(data[..., np.newaxis, :], thresholds[:, np.newaxis])
+
+
+def ragged_indices(mask):
+    """
+    Indices of True values in every row of 2D mask, in compact (CSR-like) form.
+    Indices of row t are indices[offsets[t]:offsets[t+1]].
+    :return: (indices, offsets)
+    """
+    counts = np.count_nonzero(mask, axis=-1)
+    offsets = np.zeros(len(mask) + 1, dtype=int)
+    np.cumsum(counts, out=offsets[1:])
+    return np.nonzero(mask)[1], offsets
+
+
+def last_indices(mask, fill=-1):
+    """
+    :return: index of last True value in every row of mask (fill for rows without any)
+    """
+    n = mask.shape[-1]
+    last = n - 1 - np.argmax(mask[..., ::-1], axis=-1)
+    return np.where(mask.any(axis=-1), last, fill)
+
+
+def first_crossings(data, thresholds, falling_thresholds=None):
+    """
+    Sub-pixel positions of first rising and first falling crossing of data with every threshold.
+    Position is linearly interpolated between the crossing sample and the one before it.
+    :param data: array of shape (..., N)
+    :param thresholds: 1D array of T thresholds
+    :param falling_thresholds: 1D array of T thresholds for falling crossings (default: the same as thresholds)
+    :return: (rising, falling), both of shape (..., T), NaN where there is no such crossing
+    """
+    if falling_thresholds is None:
+        falling_thresholds = thresholds
+    data = np.asarray(data, dtype=float)[..., np.newaxis, :]
+    return _first_crossing(data, thresholds, True), _first_crossing(data, falling_thresholds, False)
+
+
+def _first_crossing(data, thresholds, rising):
+    thresholds = np.asarray(thresholds, dtype=float)
+    states = threshold_states(data, thresholds[:, np.newaxis])
+    hits = _state_changes(states) & (states == rising)
+    i = np.maximum(np.argmax(hits, axis=-1), 1)[..., np.newaxis]
+    y_before = np.take_along_axis(data, i - 1, axis=-1)[..., 0]
+    y_after = np.take_along_axis(data, i, axis=-1)[..., 0]
+    with np.errstate(divide='ignore', invalid='ignore'):  # only where there is no crossing, dropped below
+        x = i[..., 0] - 1 + (thresholds - y_before) / (y_after - y_before)
+    return np.where(hits.any(axis=-1), x, np.nan)
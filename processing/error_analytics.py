@@ -0,0 +1,133 @@
+"""
+Errors of angle estimates analysed while they arrive, one (truth, estimate) pair at a time in O(1):
+running cumulative error, mean and variance of errors (Welford), maximal errors and drift of cumulative error
+per period of strips. Only last `capacity` samples and periods are kept for plots, so arbitrarily long runs
+take constant memory and nothing has to be recomputed at the end.
+"""
+import math
+import logging
+import numpy as np
+from processing.streaming_stats import RunningMoments
+
+logger = logging.getLogger(__name__)
+
+
+class _History:
+    """
+    Last `capacity` rows of named columns in preallocated ring buffer
+    """
+    def __init__(self, capacity, names):
+        self.columns = {name: np.full(capacity, np.nan) for name in names}
+        self.capacity = capacity
+        self.count = 0
+
+    def append(self, *values):
+        i = self.count % self.capacity
+        for column, value in zip(self.columns.values(), values):
+            column[i] = value
+        self.count += 1
+
+    def snapshot(self):
+        if self.count <= self.capacity:
+            return {name: column[:self.count].copy() for name, column in self.columns.items()}
+        return {name: np.roll(column, -(self.count % self.capacity)) for name, column in self.columns.items()}
+
+
+class ErrorAnalytics:
+    """
+    Pairs are either increments of angle between consecutive frames (increments=True, e.g. estimated shift
+    and true rotation) or absolute angles (increments=False, e.g. integrated estimate and true angle),
+    both in the same units. Error of sample is error of increment, so cumulative error is error of position.
+    Pairs with NaN estimate are only counted as invalid.
+    """
+    def __init__(self, period=None, capacity=1 << 16, increments=True, warmup=0):
+        """
+        :param period: period of strips in units of angle, None for no drift statistics
+        :param capacity: number of last samples (and periods) kept for snapshot()
+        :param warmup: number of first pairs ignored (e.g. estimator without previous frame)
+        """
+        self.period = period
+        self.increments = increments
+        self.warmup = warmup
+        self.samples = 0
+        self.errors = RunningMoments()
+        self.drifts = RunningMoments()
+        self.position = 0.0
+        self.cumulative = 0.0
+        self.max_abs_cumulative = 0.0
+        self.last_truth = 0.0
+        self.last_estimate = 0.0
+        self.period_index = None
+        self.period_start = 0.0
+        self.history = _History(capacity, ("position", "estimate", "error", "cumulative"))
+        self.period_history = _History(capacity, ("period", "drift"))
+
+    def update(self, truth, estimate):
+        self.samples += 1
+        if self.increments:
+            step_truth, step_estimate = truth, estimate
+        else:
+            step_truth, step_estimate = truth - self.last_truth, estimate - self.last_estimate
+        if self.samples <= self.warmup:
+            self.last_truth, self.last_estimate = truth, estimate
+            return
+        error = step_estimate - step_truth
+        if not math.isfinite(error):
+            self.errors.invalid += 1
+            if self.increments:
+                self.position += step_truth  # absolute pairs cover the gap with next step
+            return
+        self.last_truth, self.last_estimate = truth, estimate
+
+        self.errors.add(error)
+        self.position += step_truth
+        self.cumulative += error
+        self.max_abs_cumulative = max(self.max_abs_cumulative, abs(self.cumulative))
+        self.history.append(self.position, self.position + self.cumulative, error, self.cumulative)
+        if self.period is not None:
+            self._update_periods()
+
+    def _update_periods(self):
+        index = math.floor(self.position / self.period)
+        if self.period_index is None:
+            self.period_index = index
+            self.period_start = self.cumulative
+        elif index != self.period_index:
+            drift = (self.cumulative - self.period_start) / abs(index - self.period_index)
+            self.drifts.add(drift)
+            self.period_history.append(index, drift)
+            self.period_index = index
+            self.period_start = self.cumulative
+
+    @property
+    def max_abs_error(self):
+        return max(abs(self.errors.min), abs(self.errors.max)) if self.errors.n else np.nan
+
+    def sink(self, samples, origin_as=0.0):
+        """
+        Pipeline stage feeding true angle (minus origin) and absolute estimate of every sample, in arcseconds
+        """
+        for sample in samples:
+            self.update(sample.angle_deg * 3600 - origin_as, sample.estimate_as)
+            yield sample
+
+    def snapshot(self):
+        """
+        :return: dictionary of arrays of last samples (position, estimate, error, cumulative)
+                 and of last periods (period, drift)
+        """
+        return dict(self.history.snapshot(), **self.period_history.snapshot())
+
+    def summary(self):
+        return {"samples": self.samples, "n": self.errors.n, "invalid": self.errors.invalid,
+                "mean": float(self.errors.mean), "std": float(self.errors.std),
+                "max_abs_error": float(self.max_abs_error), "cumulative": float(self.cumulative),
+                "max_abs_cumulative": float(self.max_abs_cumulative), "periods": self.drifts.n,
+                "drift_mean": float(self.drifts.mean), "drift_std": float(self.drifts.std)}
+
+    def log_summary(self, level=logging.INFO):
+        s = self.summary()
+        logger.log(level, "%d samples (%d invalid): error mean %.4f, std %.4f, max %.4f; "
+                   "cumulative %.4f, max %.4f; drift per period mean %.4f, std %.4f over %d periods",
+                   s["samples"], s["invalid"], s["mean"], s["std"], s["max_abs_error"], s["cumulative"],
+                   s["max_abs_cumulative"], s["drift_mean"], s["drift_std"], s["periods"])
@@ -0,0 +1,23 @@
+import numpy as np
+from scipy.ndimage import convolve1d
+
+
+def convolve_same_batch(frames, kernel):
+    """
+    np.convolve(frame, kernel, mode='same') for every row of frames at once.
+    Edges are zero padded like in np.convolve; for kernels of even length np.convolve centers them
+    one sample to the left, hence the origin shift.
+    :param frames: array of shape (n_frames, N) (or a single frame of shape (N,)), N >= len(kernel)
+    :param kernel: 1D kernel
+    :return: array of the same shape as frames
+    """
+    frames = np.asarray(frames, dtype=float)
+    kernel = np.asarray(kernel, dtype=float)
+    return convolve1d(frames, kernel, axis=-1, mode='constant', cval=0.0, origin=len(kernel) % 2 - 1)
+
+
+def smooth_batch(frames, box_pts):
+    """
+    Moving average over box_pts samples (np.convolve with box, mode='same') for every row of frames at once
+    """
+    return convolve_same_batch(frames, np.ones(box_pts)/box_pts)
@@ -0,0 +1,189 @@
+"""
+Opt-in timing of stages of estimation. Functions decorated with @stage(name) and blocks within span(name)
+are measured only after enable(); when disabled, decorated function costs one extra call and a flag check.
+Every stage accumulates count, total, min, max and histogram of latencies with power of two buckets,
+with enable(trace=True) every call is also kept as event for export_chrome_trace (chrome://tracing, Perfetto).
+"""
+import os
+import json
+import time
+import logging
+import functools
+import threading
+import contextlib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_enabled = False
+_tracing = False
+_max_events = 0
+_stats = {}
+_events = []
+_dropped_events = 0
+_origin_ns = time.perf_counter_ns()
+_null_span = contextlib.nullcontext()
+
+
+class StageStats:
+    """
+    Latencies of one stage. Bucket k of histogram counts latencies in [2**(k-1), 2**k) nanoseconds.
+    """
+    __slots__ = ("count", "total_ns", "min_ns", "max_ns", "histogram")
+    n_buckets = 48
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.histogram = [0] * self.n_buckets
+
+    def add(self, duration_ns, items=1):
+        """
+        :param items: number of items processed together, each is counted with equal share of duration
+        """
+        self.count += items
+        self.total_ns += duration_ns
+        item_ns = duration_ns // items
+        if self.min_ns is None or item_ns < self.min_ns:
+            self.min_ns = item_ns
+        if item_ns > self.max_ns:
+            self.max_ns = item_ns
+        self.histogram[min(item_ns.bit_length(), self.n_buckets - 1)] += items
+
+    def percentile_ns(self, q):
+        """
+        :return: q-th percentile, interpolated linearly within its bucket
+        """
+        if self.count == 0:
+            return np.nan
+        cumulative = np.cumsum(self.histogram)
+        rank = q / 100.0 * self.count
+        k = int(np.searchsorted(cumulative, rank))
+        before = cumulative[k] - self.histogram[k]
+        low = 2.0 ** (k - 1) if k else 0.0
+        value = low + (2.0 ** k - low) * (rank - before) / self.histogram[k]
+        return float(np.clip(value, self.min_ns, self.max_ns))
+
+    def as_dict(self):
+        return {"count": self.count, "total_s": self.total_ns * 1e-9,
+                "mean_us": self.total_ns / self.count * 1e-3 if self.count else np.nan,
+                "p50_us": self.percentile_ns(50) * 1e-3, "p99_us": self.percentile_ns(99) * 1e-3,
+                "min_us": (self.min_ns or 0) * 1e-3, "max_us": self.max_ns * 1e-3}
+
+
+def enable(trace=False, max_events=1000000):
+    """
+    :param trace: keep every call as event for export_chrome_trace (at most max_events of them)
+    """
+    global _enabled, _tracing, _max_events
+    _enabled = True
+    _tracing = trace
+    _max_events = max_events
+
+
+def disable():
+    global _enabled, _tracing
+    _enabled = False
+    _tracing = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    global _dropped_events
+    _stats.clear()
+    _events.clear()
+    _dropped_events = 0
+
+
+def _record(name, start_ns, end_ns, items=1):
+    global _dropped_events
+    duration_ns = end_ns - start_ns
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = StageStats()
+    stats.add(duration_ns, items)
+    if _tracing:
+        if len(_events) < _max_events:
+            _events.append((name, start_ns, duration_ns, threading.get_ident()))
+        else:
+            _dropped_events += 1
+
+
+def stage(name):
+    """
+    Decorator measuring every call of function as stage of given name
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            start_ns = time.perf_counter_ns()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _record(name, start_ns, time.perf_counter_ns())
+        return wrapper
+    return decorator
+
+
+class _Span:
+    __slots__ = ("name", "items", "start_ns")
+
+    def __init__(self, name, items):
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _record(self.name, self.start_ns, time.perf_counter_ns(), self.items)
+
+
+def span(name, items=1):
+    """
+    Context manager measuring block of code as stage of given name
+    :param items: number of items (e.g. frames of a chunk) the block processes, statistics are then per item;
+                  trace keeps the block as one event
+    """
+    return _Span(name, max(items, 1)) if _enabled else _null_span
+
+
+def summary():
+    """
+    :return: dictionary stage name -> statistics (count, total, mean, percentiles, min, max)
+    """
+    return {name: stats.as_dict() for name, stats in _stats.items()}
+
+
+def log_summary(level=logging.INFO):
+    for name, s in sorted(summary().items(), key=lambda item: -item[1]["total_s"]):
+        logger.log(level, "%30s: %8d calls, %10.6fs, mean %10.1fus, p50 %10.1fus, p99 %10.1fus, max %10.1fus",
+                   name, s["count"], s["total_s"], s["mean_us"], s["p50_us"], s["p99_us"], s["max_us"])
+    if _dropped_events:
+        logger.log(level, "%d trace events dropped (more than %d)", _dropped_events, _max_events)
+
+
+def export_chrome_trace(path):
+    """
+    Writes recorded events in Chrome trace event format, as complete ("X") events with microsecond timestamps
+    """
+    pid = os.getpid()
+    threads = {ident: i for i, ident in enumerate(dict.fromkeys(e[3] for e in _events))}
+    names = {t.ident: t.name for t in threading.enumerate()}
+    events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+               "args": {"name": names.get(ident, f"thread {tid}")}} for ident, tid in threads.items()]
+    events += [{"name": name, "cat": "stage", "ph": "X", "pid": pid, "tid": threads[ident],
+                "ts": (start_ns - _origin_ns) * 1e-3, "dur": duration_ns * 1e-3}
+               for name, start_ns, duration_ns, ident in _events]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ns",
+                   "otherData": {"dropped_events": _dropped_events}}, f)
+    logger.info("Trace with %d events written to %s", len(_events), path)
@@ -1,6 +1,6 @@
 import logging
 import numpy as np
-import heapq
+from processing.crossings import find_crossings
 
 logger = logging.getLogger(__name__)
 
@@ -13,57 +13,23 @@ def smooth(y, box_pts):
 threshold_coefficient = 0.5
 
 
-def strip_outliners(t, max_points, initial_tan):
-    return heapq.nsmallest(max_points, t,
-                           key=lambda x: abs(x.tan - initial_tan))
-
-
 def split_vertically_by_threshold(data, threshold, raw_data=None):
     """
     Split data into continuous parts lying above and under threshold
     :param raw_data: data that will actually be sampled (default = same as data)
-    :param data:
-    :param threshold:
-    :return: crossings is array of indices where crossing above/under threshold occurs
+    :param data: single frame (N,) or batch of frames (n_frames, N)
+    :param threshold: scalar, for batch also array of shape (n_frames, 1)
+    :return: crossings is array of indices where crossing above/under threshold occurs,
+             hills are views of raw_data between crossings;
+             for batch both are lists with one entry per frame
     """
     if raw_data is None:
         raw_data = data
-    crossings = []
-    hills = []
-    current_hill = []
-
-    direction = "minus" if data[0] < threshold else "plus"
-
-    p_index = 0
-    for p in data:
-        if direction == "minus":
-            if p > threshold:
-                direction = "plus"
-                crossings.append(p_index)
-                hills.append(current_hill.copy())
-                current_hill = []
-        elif direction == "plus":
-            if p < threshold:
-                direction = "minus"
-                crossings.append(p_index)
-                hills.append(current_hill.copy())
-                current_hill = []
-
-        current_hill.append(raw_data[p_index])
-        p_index += 1
-    hills.append(current_hill.copy())
-    return crossings, hills
-
-
-class PointWithProps:
-    def __init__(self, x, y, tan, raw_data):
-        self.x = x
-        self.y = y
-        self.raw_y = raw_data
-        self.tan = tan
-
-    def __repr__(self):
-        return f"tan={self.tan}"
+    raw_data = np.asarray(raw_data)
+    crossings = find_crossings(data, threshold)
+    if raw_data.ndim == 1:
+        return crossings, np.split(raw_data, crossings)
+    return crossings, [np.split(row, c) for row, c in zip(raw_data, crossings)]
 
 
 class LineFitter:
@@ -72,6 +38,7 @@ class LineFitter:
 
     def fit_line(self, raw_data):
         N = self.sensor.N
+        raw_data = np.asarray(raw_data)
         smooth_data = smooth(raw_data, 5)
         data_y_range = np.ptp(raw_data)
         logger.debug(f"Data range = {data_y_range}")
@@ -83,8 +50,7 @@ class LineFitter:
 
         hills.pop(0)
         hills.pop(-1)
-        init = crossings[0]+1
-        logger.debug(f"Found {len(hills)} hills and {len(crossings)} crossings.")
+        logger.debug("Lengths of inner hills: %s", [len(h) for h in hills])
 
         full_stripes = len(hills)/2
         max_length_for_slopes = 100  # for 128
@@ -92,55 +58,61 @@ class LineFitter:
         half_av_slope_len = int(av_slope_lenght / 2)
         two_thirds_av_slope = int(0.66*av_slope_lenght)
         logger.debug(f"Average length of slope: {av_slope_lenght}")
-        for h in hills:
-            r = [i for i in range(init, init + len(h))]
-            print(len(h))
-            # ax.plot(r, h)
-            init += len(h)
-
-        init_linear_range = 3
-        slopes = []
-        coefficients = []
-        for c_index in crossings:
-            logger.debug(f"Processing crossing at {c_index}")
-            beg_slope = max(1,   c_index-half_av_slope_len)
-            end_slope = min(N-1, c_index+half_av_slope_len)
-            slope_len = end_slope-beg_slope
-            logger.debug(f"Slope length = {slope_len}")
-            if slope_len < av_slope_lenght:
-                continue
-            slopes.append([i for i in range(beg_slope, end_slope)])
-            bx = c_index - init_linear_range
-            ex = c_index + init_linear_range
-            by = raw_data[c_index-init_linear_range]
-            ey = raw_data[c_index+init_linear_range]
-            inital_slope_tan = (ey - by)/(ex - bx)
-            tans = [PointWithProps(i, smooth_data[i], (smooth_data[i] - smooth_data[i - 1]), raw_data[i]) for i in range(beg_slope, end_slope)]
-
-            tans = strip_outliners(tans, two_thirds_av_slope, inital_slope_tan)
-
-            min_x = min(tans, key=lambda e: e.x)
-            max_x = max(tans, key=lambda e: e.x)
-            logger.debug(f"Min x = {min_x.x}, max x = {max_x.x}")
-
-            new_x = [p.x for p in tans]
-            new_y = [p.raw_y for p in tans]
-            [coeff_a, coeff_b] = np.polyfit(new_x, new_y, 1)
-            coefficients.append({"a": coeff_a, "b": coeff_b})
-            logger.debug(f"Model: y = {coeff_a}*x + {coeff_b}")
-
-
-
-            logger.debug(f"Lenght of slope: {end_slope - beg_slope}, tans = {tans}")
-
-            logger.debug(f"Initial_slope = {inital_slope_tan}")
-
-            ttt = range(min_x.x, max_x.x)
-            ttttt = range(min_x.x - 5, max_x.x + 5)
-            fit_y = [coeff_a*x + coeff_b for x in ttt]
-            fit_yyy = [coeff_a*x + coeff_b for x in ttttt]
-            # ax.plot(ttttt, fit_yyy, color="blue")
-            # ax.plot(ttt, fit_y, color="green")
-            #rysuj_segment(ax, (beg_slope, aa[beg_slope], end_slope, aa[end_slope]))
+
+        coefficients = fit_slopes(raw_data, smooth_data, crossings, N,
+                                  half_av_slope_len, av_slope_lenght, two_thirds_av_slope)
+        logger.debug("Models y = a*x + b: %s", coefficients)
         return crossings, coefficients, hills
 
+
+init_linear_range = 3
+
+
+def fit_slopes(raw_data, smooth_data, crossings, n, half_slope_len, min_slope_len, max_points):
+    """
+    Line fitted to raw data around every crossing, all crossings at once.
+    Window [c - half_slope_len, c + half_slope_len) clipped to [1, n - 1) is used when it is at least min_slope_len long,
+    from its points only max_points with local slope of smooth data closest to initial slope are kept
+    (ties go to the earlier point) and line is fitted to them with closed-form least squares.
+    :return: list of {"a": a, "b": b} for every used crossing, in order of crossings (NaN when max_points < 2)
+    """
+    crossings = np.asarray(crossings, dtype=int)
+    beg_slope = np.maximum(1, crossings - half_slope_len)
+    end_slope = np.minimum(n - 1, crossings + half_slope_len)
+    used = end_slope - beg_slope >= min_slope_len
+    crossings = crossings[used]
+    beg_slope = beg_slope[used]
+    end_slope = end_slope[used]
+    if len(crossings) == 0:
+        return []
+
+    # windows clipped by the edges are shorter, their positions past the end are masked out:
+    window = beg_slope[:, np.newaxis] + np.arange(0, 2*half_slope_len)
+    in_window = window < end_slope[:, np.newaxis]
+    window = np.minimum(window, n - 1)
+
+    by = raw_data[crossings - init_linear_range]
+    ey = raw_data[crossings + init_linear_range]
+    inital_slope_tan = (ey - by)/(2*init_linear_range)
+    tans = smooth_data[window] - smooth_data[window - 1]
+    distance = np.where(in_window, np.abs(tans - inital_slope_tan[:, np.newaxis]), np.inf)
+
+    k = np.minimum(max_points, end_slope - beg_slope)[:, np.newaxis]
+    kth = np.take_along_axis(np.sort(distance, axis=1), k - 1, axis=1)
+    below = distance < kth
+    ties = distance == kth
+    missing = k - np.count_nonzero(below, axis=1, keepdims=True)
+    inliers = below | (ties & (np.cumsum(ties, axis=1) <= missing))
+    k = k[:, 0]
+
+    # x relative to crossing keeps sums small:
+    x = np.where(inliers, window - crossings[:, np.newaxis], 0)
+    y = np.where(inliers, raw_data[window], 0)
+    sx = x.sum(axis=1)
+    sy = y.sum(axis=1)
+    sxx = (x*x).sum(axis=1)
+    sxy = (x*y).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coeff_a = (k*sxy - sx*sy) / (k*sxx - sx*sx)
+    coeff_b = (sy - coeff_a*sx)/k - coeff_a*crossings
+    return [{"a": a, "b": b} for a, b in zip(coeff_a, coeff_b)]
@@ -0,0 +1,253 @@
+"""
+Streaming estimation as a chain of generator stages:
+
+    source -> preprocess -> estimators -> integrator -> sinks
+
+Every stage takes iterator of samples and yields them further, one sample in flight at a time,
+so nothing waits in queues and arbitrarily long streams run in constant memory.
+Stages fill fields of the same Sample object and write frames into buffers allocated once,
+so consumer has to copy whatever it wants to keep after next sample arrives.
+"""
+import time
+import logging
+import numpy as np
+from processing.instrumentation import span
+from hardware.acquisition import open_connection, read_lines
+
+logger = logging.getLogger(__name__)
+
+
+class Sample:
+    """
+    Everything known about one frame. Fields not filled by any stage stay NaN / None.
+    """
+    __slots__ = ("index", "angle_deg", "raw", "frame", "dx_px", "width_px", "dfi_as", "estimate_as")
+
+    def __init__(self):
+        self.index = -1
+        self.angle_deg = np.nan
+        self.raw = None
+        self.frame = None
+        self.dx_px = np.nan
+        self.width_px = np.nan
+        self.dfi_as = np.nan
+        self.estimate_as = np.nan
+
+    def __repr__(self):
+        return f"Sample {self.index}: angle={self.angle_deg}deg, dx={self.dx_px}px, estimate={self.estimate_as}\""
+
+
+# Sources:
+
+def simulated_source(readout_generator, angles_deg, chunk_size=256, noise=None):
+    """
+    Readouts simulated for angles in chunks, so only one chunk of frames is in memory.
+    Simulation of chunk is measured per frame (ReadoutGenerator.for_angles stage is per chunk).
+    :param angles_deg: any iterable of angles, may be endless
+    :param noise: anything with apply(frames) (e.g. SensorNoiseModel), applied to whole chunk at once
+    """
+    sample = Sample()
+    chunk = np.empty(chunk_size)
+    index = 0
+    angles = iter(angles_deg)
+    while True:
+        n = 0
+        for angle in angles:
+            chunk[n] = angle
+            n += 1
+            if n == chunk_size:
+                break
+        if n == 0:
+            return
+        with span("simulated_source.per_frame", n):
+            readouts = readout_generator.for_angles(chunk[:n])
+            if noise is not None:
+                readouts = noise.apply(readouts)
+        for angle, raw in zip(chunk[:n], readouts):
+            sample.index = index
+            sample.angle_deg = angle
+            sample.raw = raw
+            index += 1
+            yield sample
+        if n < chunk_size:
+            return
+
+
+def store_source(store):
+    """
+    Frames of ReadoutStore, as views of memory mapped file
+    """
+    sample = Sample()
+    angles_deg = store.angles_deg
+    for index in range(0, len(store)):
+        sample.index = index
+        sample.angle_deg = angles_deg[index]
+        sample.raw = store.get_data(index)
+        yield sample
+
+
+def text_source(lines, separator=","):
+    """
+    Frames sent as lines of text with pixel values, like rows of fake_inputs.json.
+    Empty lines and lines which are not frames (e.g. "[G] ..." status messages) are skipped.
+    """
+    sample = Sample()
+    index = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.strip().strip("[]")
+        if not line:
+            continue
+        try:
+            raw = np.array(line.split(separator), dtype=float)
+        except ValueError:
+            logger.debug("Skipping line which is not a frame: %s", line)
+            continue
+        sample.index = index
+        sample.raw = raw
+        index += 1
+        yield sample
+
+
+def serial_source(port, baudrate=115200, timeout_s=0.5):
+    """
+    text_source reading lines from serial port (pyserial, or plain file descriptor when it is not installed).
+    Pauses of device do not end the stream, it runs until port is closed or consumer stops.
+    """
+    connection = open_connection(port, baudrate, timeout_s)
+    try:
+        yield from text_source(read_lines(connection))
+    finally:
+        connection.close()
+
+
+# Processing stages:
+
+def preprocess(samples, begin=0, end=None):
+    """
+    Copies useful part of raw frame into preallocated float buffer, sample.frame is that buffer.
+    """
+    buffer = None
+    for sample in samples:
+        useful = sample.raw[begin:end]
+        if buffer is None or buffer.shape != useful.shape:
+            buffer = np.empty(useful.shape)
+        np.copyto(buffer, useful)
+        sample.frame = buffer
+        yield sample
+
+
+def estimate_shift(samples, estimator, args=()):
+    """
+    :param estimator: anything with get_dx_px(frame, *args) returning shift in pixels (or tuple starting with it)
+    """
+    for sample in samples:
+        dx = estimator.get_dx_px(sample.frame, *args)
+        sample.dx_px = dx[0] if isinstance(dx, tuple) else dx
+        yield sample
+
+
+def estimate_width(samples, width_function, sane_estimate_px, threshold_of_sanity=0.8):
+    """
+    :param width_function: width_function(frame, sane_estimate_px) returns width of stripe in pixels
+    :return: widths too far from sane_estimate_px are replaced by it
+    """
+    for sample in samples:
+        width = width_function(sample.frame, sane_estimate_px)
+        if abs(width - sane_estimate_px) > threshold_of_sanity * sane_estimate_px:
+            width = sane_estimate_px
+        sample.width_px = width
+        yield sample
+
+
+def integrate(samples, dfi_function, width_of_stripe_px=None, sensitivity_threshold_as=np.inf):
+    """
+    Sums angle increments into estimate of angle. Increments larger than sensitivity threshold
+    are replaced by the previous one. The first sample defines zero.
+    :param dfi_function: dfi_function(width_of_stripe_px, dx_px) returns increment of angle in arcseconds
+    :param width_of_stripe_px: fixed width, when None width measured by estimate_width is used
+    """
+    estimate_as = None
+    last_dfi_as = 0
+    for sample in samples:
+        width = sample.width_px if width_of_stripe_px is None else width_of_stripe_px
+        dfi_as = dfi_function(width, sample.dx_px)
+        sample.dfi_as = dfi_as
+        if estimate_as is None:
+            estimate_as = 0
+        else:
+            estimate_as += (dfi_as if abs(dfi_as) < sensitivity_threshold_as else last_dfi_as)
+            last_dfi_as = dfi_as
+        sample.estimate_as = estimate_as
+        yield sample
+
+
+# Sinks (they pass samples further, so several can be chained):
+
+def log_sink(samples, level=logging.INFO, every=1):
+    for sample in samples:
+        if sample.index % every == 0:
+            with span("logging"):
+                logger.log(level, "Index = %d. Angle = %s\". Actual estimate = %s\"",
+                           sample.index, sample.angle_deg * 3600, sample.estimate_as)
+        yield sample
+
+
+def _stage_name(stage):
+    stage = getattr(stage, "func", stage)  # functools.partial
+    return getattr(stage, "__name__", type(stage).__name__)
+
+
+class Pipeline:
+    """
+    Source followed by stages, every stage is a function taking iterator of samples and returning one
+    (functools.partial or lambda binds its other parameters). Time spent in every stage is measured,
+    excluding time of stages before it.
+    """
+    def __init__(self, source, *stages):
+        self.source = source
+        self.stages = stages
+        self.names = ["source"] + [_stage_name(stage) for stage in stages]
+        self.times_s = np.zeros(len(self.names))
+        self.counts = np.zeros(len(self.names), dtype=int)
+
+    def _timed(self, samples, i):
+        samples = iter(samples)
+        while True:
+            start = time.perf_counter()
+            try:
+                sample = next(samples)
+            except StopIteration:
+                self.times_s[i] += time.perf_counter() - start
+                return
+            self.times_s[i] += time.perf_counter() - start
+            self.counts[i] += 1
+            yield sample
+
+    def __iter__(self):
+        samples = self._timed(self.source, 0)
+        for i, stage in enumerate(self.stages):
+            samples = self._timed(stage(samples), i + 1)
+        return samples
+
+    def run(self):
+        """
+        Pulls all samples through the pipeline
+        :return: number of samples which reached the end
+        """
+        n = 0
+        for _ in self:
+            n += 1
+        return n
+
+    def stats(self):
+        """
+        :return: list of (name of stage, own time in seconds, samples per second of own time)
+        """
+        own_times_s = np.diff(self.times_s, prepend=0.0)
+        return [(name, t, c / t if t > 0 else np.inf) for name, t, c in zip(self.names, own_times_s, self.counts)]
+
+    def log_stats(self, level=logging.INFO):
+        for name, t, rate in self.stats():
+            logger.log(level, "%20s: %10.6fs, %12.1f samples/s", name, t, rate)
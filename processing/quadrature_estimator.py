@@ -0,0 +1,178 @@
+import logging
+import numpy as np
+from scipy.optimize import minimize
+from hardware.geometry_cache import GeometryCache
+from processing.instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+
+class QuadratureEstimator:
+    """
+    Angle of wheel from phase of stripe pattern, like GetAngle in old_stuff/graf.py does with two analog channels.
+    Pattern seen by pixel at polar angle theta depends only on (theta - angle of wheel) modulo angular pitch of strips,
+    so every frame is projected on cos/sin templates of phase 2*pi*theta/dphi and atan2 gives angle of wheel
+    modulo one strip. Constant and linear trend along the radius (strips have constant width, so their duty cycle
+    changes with radius) and a few higher harmonics are fitted together with the fundamental, otherwise
+    they would leak into it over the incomplete periods seen by the sensor.
+    Consecutive phases are unwrapped into continuous angle in arcseconds.
+
+    Placement of sensor is rarely known well enough (0.1 deg of tilt already spoils the templates), so by default
+    the templates are calibrated from frames instead: pixels on strips are those changing while wheel turns,
+    phase of pattern along them is modelled as quadratic in position of pixel (period of strips seen by sensor
+    changes with radius) and its coefficients are fitted to calibration frames. Phase of pattern
+    at the middle pixel then also grows by 2*pi with every strip. Direction is a convention: positive when
+    pattern moves towards higher pixels, like for shifts of pixel based estimators.
+    Templates from known placement depend only on it and are rebuilt only when it changes.
+    """
+    def __init__(self, sensor, wheel, sensor_tilt_deg=None, sensor_shift_um=None, harmonics=3, direction=1):
+        """
+        :param sensor_tilt_deg: tilt of sensor, None (with sensor_shift_um None) to calibrate templates from frames
+        :param harmonics: number of harmonics of stripe pattern fitted together with the fundamental one
+        :param direction: 1 or -1, sign of angle for pattern moving towards higher pixels (calibrated templates)
+        """
+        self.sensor = sensor
+        self.wheel = wheel
+        self.tilt_deg = sensor_tilt_deg
+        self.shift_um = sensor_shift_um
+        self.harmonics = harmonics
+        self.direction = direction
+        self.templates_cache = GeometryCache()
+        self.calibration = None
+        self.last_phase = None
+        self.unwrapped_phase = 0.0
+
+    @property
+    def strip_as(self):
+        return self.wheel.dphi_deg * 3600
+
+    def pixel_centers_um(self):
+        """
+        Centers of pixels in coordinates of the wheel, placed like ReadoutGenerator places the sensor
+        :return: array of shape (N, 2)
+        """
+        (x, y) = self.shift_um
+        u = np.arange(0, self.sensor.N)*self.sensor.dx + self.sensor.pixel_w_um/2
+        v = self.sensor.pixel_h_um/2
+        a = np.radians(90 + self.tilt_deg)
+        return np.stack([np.cos(a)*u - np.sin(a)*v + x,
+                         np.sin(a)*u + np.cos(a)*v + y + self.wheel.radius_mm*1000], axis=-1)
+
+    def _templates_key(self):
+        return (self.sensor.N, self.sensor.pixel_w_um, self.sensor.pixel_h_um, self.sensor.horizontal_spacing_um,
+                self.tilt_deg, tuple(self.shift_um), self.wheel.radius_mm, self.wheel.count,
+                self.wheel.line_height_mm, self.harmonics)
+
+    @property
+    def placement_known(self):
+        return self.tilt_deg is not None
+
+    def _templates(self):
+        if not self.placement_known:
+            if self.calibration is None:
+                raise ValueError("Placement of sensor is not given, calibrate() with frames of turning wheel first")
+            return self.calibration
+        return self.templates_cache.get(self._templates_key(), self._create_templates)
+
+    def _create_templates(self):
+        """
+        Only pixels lying fully within radial reach of strips are used.
+        Rows of pseudo-inverse of design matrix belonging to cos/sin of fundamental are the actual templates.
+        """
+        centers = self.pixel_centers_um()
+        radius = np.hypot(centers[:, 0], centers[:, 1])
+        margin = max(self.sensor.pixel_w_um, self.sensor.pixel_h_um)
+        used = np.flatnonzero((radius > self.wheel.strip_min_y_um + margin) &
+                              (radius < self.wheel.strip_max_y_um - margin))
+        if len(used) < 2*self.harmonics + 2:
+            raise ValueError(f"Only {len(used)} pixels of sensor lie on strips, too few for quadrature estimation")
+
+        theta = np.arctan2(-centers[used, 0], centers[used, 1])
+        phase = 2*np.pi*theta / np.radians(self.wheel.dphi_deg)
+        trend = (radius[used] - radius[used].mean()) / np.ptp(radius[used])
+        k = np.arange(1, self.harmonics + 1)[:, np.newaxis]
+        design = np.concatenate([np.ones((1, len(used))), trend[np.newaxis], np.cos(k*phase), np.sin(k*phase)]).T
+        projection = np.linalg.pinv(design)
+        logger.debug("Quadrature templates built for %d pixels", len(used))
+        return {"used": used, "cos": projection[2], "sin": projection[2 + self.harmonics]}
+
+    def _design(self, t, omega, chirp):
+        phase = omega*t + chirp*t**2
+        k = np.arange(1, self.harmonics + 1)[:, np.newaxis]
+        return np.concatenate([np.ones((1, len(t))), t[np.newaxis], np.cos(k*phase), np.sin(k*phase)]).T
+
+    def calibrate(self, frames, min_variation=0.3):
+        """
+        Templates fitted to frames of turning wheel (phases of pattern in them should cover most of a strip,
+        a few dozens of frames are enough). Placement of sensor is not used.
+        :param min_variation: pixels on strips change over frames at least this fraction of the most changing one
+        """
+        frames = np.asarray(frames, dtype=float)
+        variation = frames.std(axis=0)
+        varying = np.concatenate([[0], (variation > min_variation*variation.max()).astype(np.int8), [0]])
+        starts, ends = np.flatnonzero(np.diff(varying) == 1), np.flatnonzero(np.diff(varying) == -1)
+        longest = np.argmax(ends - starts)
+        trim = max(1, (ends[longest] - starts[longest]) // 50)  # pixels covered by strips only partially
+        used = np.arange(starts[longest] + trim, ends[longest] - trim)
+        if len(used) < 2*self.harmonics + 4:
+            raise ValueError(f"Only {len(used)} pixels of sensor change with angle, too few for quadrature estimation")
+
+        t = np.linspace(-1.0, 1.0, len(used))
+        samples = frames[:, used].T / variation[used].mean()
+        trend = np.stack([np.ones_like(t), t], axis=-1)
+        detrended = samples - trend @ np.linalg.lstsq(trend, samples, rcond=None)[0]
+        n_fft = 16*len(used)
+        power = (np.abs(np.fft.rfft(detrended*np.hanning(len(used))[:, np.newaxis], n_fft, axis=0))**2).mean(axis=1)
+        cycles = np.arange(len(power)) * len(used) / n_fft  # periods of pattern over used pixels
+        power[cycles < 0.5] = 0
+        omega = np.pi*cycles[np.argmax(power)]  # t spans 2
+
+        def residual(parameters):
+            design = self._design(t, *parameters)
+            return np.sum((samples - design @ np.linalg.lstsq(design, samples, rcond=None)[0])**2)
+
+        omega, chirp = minimize(residual, [omega, 0.0], method="Nelder-Mead", options={"xatol": 1e-6}).x
+        if omega < 0:
+            omega, chirp = -omega, -chirp
+        projection = np.linalg.pinv(self._design(t, omega, chirp))
+        logger.debug("Quadrature templates calibrated on %d frames: %d pixels, %.2f periods, chirp %.3f",
+                     len(frames), len(used), omega / np.pi, chirp)
+        # pattern moving towards higher pixels increases psi of fit A*cos(phase - psi):
+        self.calibration = {"used": used, "cos": projection[2], "sin": self.direction*projection[2 + self.harmonics],
+                            "omega": omega, "chirp": chirp}
+        self.reset()
+
+    def phases(self, frames):
+        """
+        :param frames: one frame (N,) or many frames (..., N)
+        :return: phase of stripe pattern in (-pi, pi] for every frame, it grows by 2*pi with every strip
+        """
+        templates = self._templates()
+        samples = np.asarray(frames, dtype=float)[..., templates["used"]]
+        return np.arctan2(samples @ templates["sin"], samples @ templates["cos"])
+
+    def estimate_angle_as(self, raw):
+        """
+        :return: angle of wheel in arcseconds, relative to the first frame ever estimated
+        """
+        return self.estimate_angles_as(np.asarray(raw)[np.newaxis])[0]
+
+    @stage("QuadratureEstimator.estimate_angles_as")
+    def estimate_angles_as(self, frames):
+        """
+        Same as estimate_angle_as for every frame of (n_frames, N) array, in order.
+        Unwrapping assumes the wheel turns by less than half of a strip between consecutive frames.
+        """
+        phases = self.phases(frames)
+        if self.last_phase is None:
+            self.last_phase = phases[0]
+        steps = np.diff(phases, prepend=self.last_phase)
+        steps = np.mod(steps + np.pi, 2*np.pi) - np.pi
+        unwrapped = self.unwrapped_phase + np.cumsum(steps)
+        self.last_phase = phases[-1]
+        self.unwrapped_phase = unwrapped[-1]
+        return unwrapped * self.strip_as / (2*np.pi)
+
+    def reset(self):
+        self.last_phase = None
+        self.unwrapped_phase = 0.0
@@ -0,0 +1,169 @@
+"""
+Statistics of arbitrarily long streams in constant memory: moments (Welford, batches merged like
+partial results of parallel computation) and quantiles estimated by P-square algorithm (Jain, Chlamtac 1985).
+"""
+import math
+import numpy as np
+
+
+class RunningMoments:
+    """
+    Count, mean, variance, min and max of all values seen so far. NaN values are only counted as invalid.
+    """
+    def __init__(self):
+        self.n = 0
+        self.invalid = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        valid = values[np.isfinite(values)]
+        self.invalid += len(values) - len(valid)
+        if len(valid):
+            mean = valid.mean()
+            self._merge(len(valid), mean, np.sum((valid - mean)**2), valid.min(), valid.max())
+
+    def add(self, value):
+        """
+        Single value in O(1), without overhead of numpy for every sample
+        """
+        if not math.isfinite(value):
+            self.invalid += 1
+            return
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.invalid += other.invalid
+        if other.n:
+            self._merge(other.n, other.mean, other.m2, other.min, other.max)
+
+    def _merge(self, n, mean, m2, minimum, maximum):
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta**2 * self.n * n / total
+        self.n = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """
+        :return: standard error of mean
+        """
+        return self.std / np.sqrt(self.n) if self.n > 1 else np.nan
+
+
+class P2Quantile:
+    """
+    Estimate of q-quantile from five markers, updated with every value in O(1) time and memory
+    """
+    def __init__(self, q):
+        self.q = q
+        self.initial = []
+        self.heights = None
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2*q, 1 + 4*q, 3 + 2*q, 5]
+        self.increments = [0, q/2, q, (1 + q)/2, 1]
+
+    def update(self, values):
+        for x in np.asarray(values, dtype=float).ravel().tolist():
+            if x == x:  # NaN is skipped
+                self.add(x)
+
+    def add(self, x):
+        if self.heights is None:
+            self.initial.append(x)
+            if len(self.initial) == 5:
+                self.heights = sorted(self.initial)
+            return
+
+        h, n = self.heights, self.positions
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= h[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(0, 5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if h[i - 1] < parabolic < h[i + 1]:
+                    h[i] = parabolic
+                else:
+                    h[i] += d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    @property
+    def value(self):
+        if self.heights is None:
+            return float(np.quantile(self.initial, self.q)) if self.initial else np.nan
+        return self.heights[2]
+
+
+class ErrorAccumulator:
+    """
+    Moments of errors and of their squares, quantiles of errors and confidence interval of RMS error
+    """
+    def __init__(self, quantiles=(0.05, 0.5, 0.95)):
+        self.moments = RunningMoments()
+        self.squares = RunningMoments()
+        self.quantiles = [P2Quantile(q) for q in quantiles]
+
+    def update(self, errors):
+        errors = np.asarray(errors, dtype=float)
+        self.moments.update(errors)
+        self.squares.update(errors**2)
+        for quantile in self.quantiles:
+            quantile.update(errors)
+
+    @property
+    def n(self):
+        return self.moments.n
+
+    @property
+    def rms(self):
+        return np.sqrt(self.squares.mean) if self.squares.n else np.nan
+
+    def rms_half_width(self, z=1.96):
+        """
+        :return: half width of confidence interval of RMS error (delta method: se(rms) = se(mean square) / 2 rms)
+        """
+        if self.squares.n < 2 or self.rms == 0:
+            return np.nan
+        return z * self.squares.sem / (2.0 * self.rms)
+
+    def summary(self, z=1.96):
+        values = dict({"mean": self.moments.mean, "std": self.moments.std, "rms": self.rms,
+                       "rms_half_width": self.rms_half_width(z), "min": self.moments.min, "max": self.moments.max},
+                      **{f"q{100*q.q:g}": q.value for q in self.quantiles})
+        return dict({"n": self.n, "invalid": self.moments.invalid}, **{k: float(v) for k, v in values.items()})
@@ -1,4 +1,11 @@
 import numpy as np
+from processing.filters import convolve_same_batch
+from processing.instrumentation import stage
+
+gauss_4_kernel = (1.0 / 64.0) * np.array([1, 6, 15, 20, 15, 6, 1])
+gauss_5_kernel = (1.0 / 256.0) * np.array([1, 8, 28, 56, 70, 56, 28, 8, 1])
+gauss_6_kernel = (1.0 / 1024.0) * np.array([1, 10, 45, 120, 210, 252, 210, 120, 45, 10, 1])
+derivative_kernel = np.array([-0.5, 0, 0.5])
 
 
 def normalize(image):
@@ -10,30 +17,56 @@ def normalize(image):
     return image
 
 
+def normalize_batch(frames):
+    """
+    normalize() applied to every row of (n_frames, N) array, rows of (almost) constant value are left untouched
+    """
+    frames = np.asarray(frames, dtype=float)
+    amin = np.amin(frames, axis=-1, keepdims=True)
+    amp = np.amax(frames, axis=-1, keepdims=True) - amin
+    flat = amp <= 0.000001
+    return np.where(flat, frames, (frames - amin) / np.where(flat, 1.0, amp))
+
+
+@stage("gauss_4")
 def gauss_4(y):
-    kernel = (1.0 / 64.0) * np.array([1, 6, 15, 20, 15, 6, 1])
-    y_smooth = np.convolve(y, kernel, mode='same')
+    y_smooth = np.convolve(y, gauss_4_kernel, mode='same')
     return y_smooth
 
 
+@stage("gauss_5")
 def gauss_5(y):
-    kernel = (1.0 / 256.0) * np.array([1, 8, 28, 56, 70, 56, 28, 8, 1])
-    y_smooth = np.convolve(y, kernel, mode='same')
+    y_smooth = np.convolve(y, gauss_5_kernel, mode='same')
     return y_smooth
 
 
+@stage("gauss_6")
 def gauss_6(y):
-    kernel = (1.0 / 1024.0) * np.array([1, 10, 45, 120, 210, 252, 210, 120, 45, 10, 1])
-    y_smooth = np.convolve(y, kernel, mode='same')
+    y_smooth = np.convolve(y, gauss_6_kernel, mode='same')
     return y_smooth
 
 
 def derivative(y):
-    kernel = np.array([-0.5, 0, 0.5])
-    y_smooth = np.convolve(y, kernel, mode='same')
+    y_smooth = np.convolve(y, derivative_kernel, mode='same')
     return y_smooth
 
 
+def gauss_4_batch(frames):
+    return convolve_same_batch(frames, gauss_4_kernel)
+
+
+def gauss_5_batch(frames):
+    return convolve_same_batch(frames, gauss_5_kernel)
+
+
+def gauss_6_batch(frames):
+    return convolve_same_batch(frames, gauss_6_kernel)
+
+
+def derivative_batch(frames):
+    return convolve_same_batch(frames, derivative_kernel)
+
+
 def fit_parabola_to_three(x1, y1, x2, y2, x3, y3):
     denom = (x1 - x2) * (x1 - x3) * (x2 - x3)
     A = (x3 * (y2 - y1) + x2 * (y1 - y3) + x1 * (y3 - y2)) / denom
@@ -70,33 +103,77 @@ def get_extreme_subpixel(s, method=get_min_index):
     return x
 
 
+def get_vertices_from_points(p_indices, s):
+    """
+    get_vertex_from_point() for every row of s, p_indices holds one index per row.
+    Rows with extreme at the last sample have no right neighbour and give NaN instead of IndexError.
+    """
+    rows = np.arange(0, len(s))
+    x1 = p_indices
+    x2 = x1 - 1
+    x3 = x1 + 1
+    last = x3 >= s.shape[-1]
+    y1 = s[rows, x1]
+    y2 = s[rows, x2]
+    y3 = np.where(last, np.nan, s[rows, np.minimum(x3, s.shape[-1] - 1)])
+    return parabola_vertex(*fit_parabola_to_three(x1, y1, x2, y2, x3, y3))
+
+
+def get_extremes_subpixel(s, method=np.argmin):
+    """
+    get_extreme_subpixel() for every row of (n_frames, N) array
+    :param method: np.argmin or np.argmax, called along rows
+    """
+    p_indices = method(s, axis=-1)
+    x, y = get_vertices_from_points(p_indices, s)
+    return x
+
+
 class SensorYShiftEstimator:
+    """
+    Estimates vertical shift of sensor from edges of the line fixed below strips.
+    Single frame methods are the batch ones applied to one row, so both give identical results.
+    """
     def __init__(self, sensor, wheel, N_first=28):
         self.sensor = sensor
         self.wheel = wheel
         self.N_first = N_first
 
-    def _estimate(self, sample, method):
-        g_sample = gauss_4(sample)  # todo: maybe 5? maybe 3?
-        d_sample = derivative(g_sample)
+    def _estimate(self, samples, method):
+        g_samples = gauss_4_batch(samples)  # todo: maybe 5? maybe 3?
+        d_samples = derivative_batch(g_samples)
         hhh = self.sensor.pixel_pitch_h_um
-        extreme = get_extreme_subpixel(d_sample, method)
-        y_subpixel = extreme * hhh
+        extremes = get_extremes_subpixel(d_samples, method)
+        y_subpixel = extremes * hhh
         return y_subpixel
 
-    def estimate_bottom_edge(self, raw):
+    def estimate_bottom_edges(self, frames):
+        """
+        :param frames: array of readouts, shape (n_frames, N)
+        :return: array of n_frames estimates
+        """
         ddd = self.sensor.pixel_w_um
         ad = self.wheel.distance_to_bottom_line_um + (ddd / 2.0)
-        sample = normalize(raw[:self.N_first])
-        return self._estimate(sample, method=get_min_index) + ad
-
-    def estimate_top_edge(self, raw):
-        sample = normalize(raw[-self.N_first:])
+        samples = normalize_batch(np.asarray(frames)[:, :self.N_first])
+        return self._estimate(samples, method=np.argmin) + ad
+
+    def estimate_top_edges(self, frames):
+        """
+        :param frames: array of readouts, shape (n_frames, N)
+        :return: array of n_frames estimates
+        """
+        samples = normalize_batch(np.asarray(frames)[:, -self.N_first:])
         hhh = self.sensor.pixel_pitch_h_um
         ddd = self.sensor.pixel_w_um
-        y = self._estimate(sample, method=get_max_index)
+        y = self._estimate(samples, method=np.argmax)
         rev = hhh * self.N_first - y
 
         return -rev + self.sensor.width_um \
                - (self.wheel.distance_to_bottom_line_um +
-                  self.wheel.line_height_um) + (ddd / 2.0)
\ No newline at end of file
+                  self.wheel.line_height_um) + (ddd / 2.0)
+
+    def estimate_bottom_edge(self, raw):
+        return self.estimate_bottom_edges(np.asarray(raw)[np.newaxis])[0]
+
+    def estimate_top_edge(self, raw):
+        return self.estimate_top_edges(np.asarray(raw)[np.newaxis])[0]
@@ -0,0 +1,39 @@
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+
+class CollisionChecker:
+    """
+    Readout of sensor as area of every pixel not covered by strips, with noise of SensorNoiseModel
+    or (without model) 10% of uniform noise. Sensor is anything with N and get_polys(), strips anything with get_polys().
+    """
+    def __init__(self, noise=None, rng=None):
+        """
+        :param noise: SensorNoiseModel, None for uniform noise
+        :param rng: seed or numpy.random.Generator of noise
+        """
+        self.sensor = None
+        self.strips = None
+        self.noise = noise
+        self.rng = np.random.default_rng(rng)
+
+    def set_sensor(self, sensor):
+        self.sensor = sensor
+        self.sensor_polys = np.array(sensor.get_polys(), dtype=object)
+        self.sensor_tree = STRtree(self.sensor_polys)
+
+    def set_strips(self, strips):
+        self.strips = strips
+
+    def check_collisions(self):
+        strips = np.array(self.strips.get_polys(), dtype=object)
+        max_area = self.sensor_polys[0].area
+        # only pairs of strip and pixel with overlapping bounding boxes are clipped:
+        strip_index, pixel_index = self.sensor_tree.query(strips)
+        areas = shapely.area(shapely.intersection(strips[strip_index], self.sensor_polys[pixel_index]))
+        readout = max_area - np.bincount(pixel_index, weights=areas, minlength=self.sensor.N)
+
+        if self.noise is not None:
+            return self.noise.apply(readout, self.rng)
+        return readout + 0.1 * max_area * (self.rng.random(self.sensor.N) - 0.5)
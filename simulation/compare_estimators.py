@@ -0,0 +1,169 @@
+from config.config_utils import get_default_sensors_config
+from hardware.linear_ccd_sensor import LinearCCDSensor
+from hardware.encoder_wheel import EncoderWheelWithTopAndBottomStrips
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_CLOSED_FORM
+from simulation.noise import SensorNoiseModel
+from simulation.compare_quadrature import estimators as quadrature_comparison_estimators, accumulate_like_main, \
+    timed_run, sensor_tilt_deg, sensor_shift_um
+from estimators import EstimatorPreviousN, Correlator
+from main import SimplestEstimator, CrudestEstimator, useful_begin, R_mm, N_paskow, odleglosc_dolnego_paska
+import numpy as np
+import json
+import logging
+import argparse
+import warnings
+
+logger = logging.getLogger(__name__)
+
+full_turn_as = 1296000.0
+
+
+def prepare_simplest_crudest(readouts, sensor, wheel):
+    """
+    Shifts of SimplestEstimator corrected by strips counted by CrudestEstimator
+    (alone it only corrects estimate given to it, so it is not compared alone)
+    """
+    simplest = SimplestEstimator()
+    crudest = CrudestEstimator()
+
+    def run(frames):
+        estimates_as = np.zeros(len(frames))
+        reference = accumulate_like_main([simplest.get_dx_px(raw[useful_begin:], 60, True)[0] for raw in frames])
+        actual_as = 0
+        for i in range(0, len(frames)):
+            actual_as += reference[i] - (reference[i - 1] if i else 0)
+            actual_as = crudest.update_with_global(actual_as, frames[i][useful_begin:])
+            estimates_as[i] = actual_as
+        return estimates_as
+    return run
+
+
+def prepare_previous_n(readouts, sensor, wheel):
+    estimator = EstimatorPreviousN(10)
+    return lambda frames: accumulate_like_main([estimator.estimate(raw) for raw in frames])
+
+
+def prepare_correlator(readouts, sensor, wheel):
+    """
+    Like old_main.py: correlation of first 97 useful pixels, difference of consecutive peak positions is the shift
+    """
+    correlator = Correlator()
+
+    def run(frames):
+        peaks = np.array([correlator.update(raw[useful_begin:][:97]) for raw in frames], dtype=float)
+        return accumulate_like_main(np.diff(peaks, prepend=peaks[:1]))
+    return run
+
+
+# Quadrature with templates from placement of sensor used for simulation is only reference
+# for sensitivity to placement (see compare_quadrature), real estimator does not know it.
+estimators = {name: prepare for name, prepare in quadrature_comparison_estimators.items() if "placement" not in name}
+estimators.update({
+    "simplest+crudest": prepare_simplest_crudest,
+    "previous_n": prepare_previous_n,
+    "correlator": prepare_correlator
+})
+
+
+def error_statistics(estimates_as, true_as):
+    """
+    :return: dictionary with RMS and max error and drift - slope of error extrapolated to full turn of wheel
+    """
+    error_as = estimates_as - true_as
+    finite = np.isfinite(error_as)
+    if np.count_nonzero(finite) < 2:
+        return {"rms_as": np.nan, "max_as": np.nan, "drift_as_per_turn": np.nan}
+    slope = np.polyfit(true_as[finite], error_as[finite], 1)[0]
+    return {"rms_as": float(np.sqrt(np.mean(error_as[finite]**2))),
+            "max_as": float(np.abs(error_as[finite]).max()),
+            "drift_as_per_turn": float(slope * full_turn_as)}
+
+
+def pareto_front(results, rtol=1e-6):
+    """
+    Estimator is dominated by another one which is at least as fast and as accurate (by RMS error)
+    and strictly better in one of them; values within relative tolerance rtol are equal
+    (the same errors summed in different order differ in last digits)
+    :return: names of estimators not dominated by any other
+    """
+    def better(a, b):
+        return a > b and not np.isclose(a, b, rtol=rtol, atol=0)
+
+    front = set()
+    for r in results:
+        dominated = any(not better(r["frames_per_s"], o["frames_per_s"]) and not better(-r["rms_as"], -o["rms_as"]) and
+                        (better(o["frames_per_s"], r["frames_per_s"]) or better(-o["rms_as"], -r["rms_as"]))
+                        for o in results)
+        if not dominated and np.isfinite(r["rms_as"]):
+            front.add(r["name"])
+    return front
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Error against throughput of all estimators on the same simulated "
+                                                 "sweep, as Pareto table")
+    parser.add_argument("-c", "--config_for_sensors", default=get_default_sensors_config())
+    parser.add_argument("-s", "--sensor", default="TSL1401")
+    parser.add_argument("-n", "--steps", type=int, default=720)
+    parser.add_argument("--step_as", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noise", action="store_true", help="simulate noise of sensor and ADC (seeded by --seed)")
+    parser.add_argument("-t", "--target_rate", type=float, default=None,
+                        help="frames per second needed, the most accurate estimator reaching it is recommended")
+    parser.add_argument("-o", "--output", default=None, help="JSON file for results")
+    parser.add_argument("-l", "--log_level", default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level,
+                        format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    logging.getLogger("main").setLevel(logging.WARNING)
+    warnings.simplefilter("ignore", RuntimeWarning)  # NaN shifts of frames without enough crossings
+
+    with open(args.config_for_sensors) as f:
+        sensor_config_json = json.load(f)
+
+    sensor = LinearCCDSensor.from_json(sensor_config_json[args.sensor])
+    wheel = EncoderWheelWithTopAndBottomStrips(R_mm, N_paskow, 10, odleglosc_dolnego_paska)
+    generator = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=sensor_tilt_deg, sensor_shift_um=sensor_shift_um,
+                                 engine=ENGINE_CLOSED_FORM)
+
+    rng = np.random.default_rng(args.seed)
+    angles_as = np.arange(0, args.steps)*args.step_as + (0.5 - rng.random(args.steps))
+    readouts = generator.for_angles(angles_as / 3600.0)
+    if args.noise:
+        readouts = SensorNoiseModel.for_sensor(sensor, seed=rng).apply(readouts)
+    true_as = angles_as - angles_as[0]
+    logger.info(f"Simulated {args.steps} frames of {sensor}, {args.step_as}\" per frame")
+
+    results = []
+    for name, prepare in estimators.items():
+        try:
+            estimates_as, setup_s, run_s = timed_run(prepare, readouts, sensor, wheel)
+        except Exception as e:
+            logger.warning(f"{name} failed: {e!r}")
+            continue
+        # one-time setup (e.g. calibration of quadrature) is reported apart, it does not limit the rate:
+        results.append(dict(name=name, frames_per_s=args.steps / run_s, setup_ms=1000*setup_s,
+                            **error_statistics(estimates_as, true_as)))
+
+    front = pareto_front(results)
+    results.sort(key=lambda r: -r["frames_per_s"])
+    logger.info(f"{'estimator':>30} {'frames/s':>12} {'setup ms':>10} {'rms error':>12} {'max error':>12} "
+                f"{'drift/turn':>14} pareto")
+    for r in results:
+        r["pareto"] = r["name"] in front
+        logger.info(f"{r['name']:>30} {r['frames_per_s']:>12.1f} {r['setup_ms']:>10.1f} {r['rms_as']:>11.3f}\" "
+                    f"{r['max_as']:>11.3f}\" {r['drift_as_per_turn']:>13.1f}\" {'*' if r['pareto'] else ''}")
+
+    if args.target_rate is not None:
+        # the most accurate one fast enough is on the front, equally accurate slower ones are not:
+        fast_enough = [r for r in results if r["frames_per_s"] >= args.target_rate and r["pareto"]]
+        if fast_enough:
+            best = min(fast_enough, key=lambda r: r["rms_as"])
+            logger.info(f"For {args.target_rate} frames/s: {best['name']} (rms error {best['rms_as']:.3f}\")")
+        else:
+            logger.info(f"No estimator reaches {args.target_rate} frames/s")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"arguments": vars(args), "results": results}, f, indent=2)
@@ -0,0 +1,145 @@
+from config.config_utils import get_default_sensors_config
+from hardware.linear_ccd_sensor import LinearCCDSensor
+from hardware.encoder_wheel import EncoderWheelWithTopAndBottomStrips
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_CLOSED_FORM
+from processing.quadrature_estimator import QuadratureEstimator
+from main import SimplestEstimator, FinerEstimator, CORRELATION_INTERPOLATED, CORRELATION_FFT, calculate_dfi_as, \
+    useful_begin, sensitivity_threshold_as, R_mm, N_paskow, odleglosc_dolnego_paska
+import numpy as np
+import json
+import time
+import logging
+import argparse
+
+logger = logging.getLogger(__name__)
+
+sensor_tilt_deg = 1.4
+sensor_shift_um = (0, -765)
+width_of_stripe_px = 45.0
+calibration_frames = 72
+# plausible error of measured placement, to show sensitivity of templates built from it:
+measured_tilt_deg = 2.0
+measured_shift_um = (0, -700)
+
+
+def accumulate_like_main(dx_px_per_frame):
+    """
+    Pixel shifts between frames turned into angle the same way main loop does it
+    """
+    estimates_as = np.zeros(len(dx_px_per_frame))
+    actual_as = 0
+    last_dfi_as = 0
+    for i in range(1, len(dx_px_per_frame)):
+        dfi_as = calculate_dfi_as(width_of_stripe_px, dx_px_per_frame[i])
+        actual_as += (dfi_as if abs(dfi_as) < sensitivity_threshold_as else last_dfi_as)
+        last_dfi_as = dfi_as
+        estimates_as[i] = actual_as
+    return estimates_as
+
+
+def prepare_simplest(readouts, sensor, wheel):
+    estimator = SimplestEstimator()
+    return lambda frames: accumulate_like_main([estimator.get_dx_px(raw[useful_begin:], 60, True)[0]
+                                                for raw in frames])
+
+
+def prepare_finer(method):
+    def prepare(readouts, sensor, wheel):
+        estimator = FinerEstimator(method)
+        return lambda frames: accumulate_like_main([estimator.get_dx_px(raw[useful_begin:]) for raw in frames])
+    return prepare
+
+
+def prepare_quadrature(readouts, sensor, wheel):
+    """
+    Templates calibrated on the first frames, placement of sensor is not used
+    """
+    estimator = QuadratureEstimator(sensor, wheel)
+    estimator.calibrate(readouts[:calibration_frames])
+    return lambda frames: np.array([estimator.estimate_angle_as(raw) for raw in frames])
+
+
+def prepare_quadrature_batch(readouts, sensor, wheel):
+    estimator = QuadratureEstimator(sensor, wheel)
+    estimator.calibrate(readouts[:calibration_frames])
+    return estimator.estimate_angles_as
+
+
+def prepare_quadrature_placement(tilt_deg, shift_um):
+    """
+    Templates built from given placement of sensor instead of calibration
+    """
+    def prepare(readouts, sensor, wheel):
+        estimator = QuadratureEstimator(sensor, wheel, tilt_deg, shift_um)
+        estimator.phases(readouts[:1])  # builds templates
+        return estimator.estimate_angles_as
+    return prepare
+
+
+# prepare(readouts, sensor, wheel) does one-time work (calibration, templates) and returns function
+# giving estimates in arcseconds for frames, so that setup is timed apart from the per frame cost:
+estimators = {
+    "simplest": prepare_simplest,
+    "finer_interpolated": prepare_finer(CORRELATION_INTERPOLATED),
+    "finer_fft": prepare_finer(CORRELATION_FFT),
+    "quadrature": prepare_quadrature,
+    "quadrature_batch": prepare_quadrature_batch,
+    "quadrature_exact_placement": prepare_quadrature_placement(sensor_tilt_deg, sensor_shift_um),
+    "quadrature_measured_placement": prepare_quadrature_placement(measured_tilt_deg, measured_shift_um)
+}
+
+
+def timed_run(prepare, readouts, sensor, wheel):
+    """
+    :return: (estimates in arcseconds, seconds of one-time setup, seconds of estimating all frames)
+    """
+    start = time.perf_counter()
+    run = prepare(readouts, sensor, wheel)
+    prepared = time.perf_counter()
+    estimates_as = np.asarray(run(readouts), dtype=float)
+    return estimates_as, prepared - start, time.perf_counter() - prepared
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy and throughput of estimators on the same simulated sweep")
+    parser.add_argument("-c", "--config_for_sensors", default=get_default_sensors_config())
+    parser.add_argument("-s", "--sensor", default="TSL1401")
+    parser.add_argument("-n", "--steps", type=int, default=720)
+    parser.add_argument("--step_as", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-l", "--log_level", default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level,
+                        format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    with open(args.config_for_sensors) as f:
+        sensor_config_json = json.load(f)
+
+    sensor = LinearCCDSensor.from_json(sensor_config_json[args.sensor])
+    wheel = EncoderWheelWithTopAndBottomStrips(R_mm, N_paskow, 10, odleglosc_dolnego_paska)
+    generator = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=sensor_tilt_deg, sensor_shift_um=sensor_shift_um,
+                                 engine=ENGINE_CLOSED_FORM)
+
+    rng = np.random.default_rng(args.seed)
+    angles_as = np.arange(0, args.steps)*args.step_as + (0.5 - rng.random(args.steps))
+    readouts = generator.for_angles(angles_as / 3600.0)
+    true_as = angles_as - angles_as[0]
+    logger.info(f"Simulated {args.steps} frames of {sensor}, {args.step_as}\" per frame")
+    logger.info(f"Pixel based estimators use fixed width of stripe {width_of_stripe_px}px like main loop, "
+                f"so their scale is reported with error left after fitting it")
+    logger.info(f"Quadrature templates are calibrated on the first {calibration_frames} frames; for comparison, "
+                f"templates built from exact placement and from placement measured with error "
+                f"(tilt {measured_tilt_deg}deg, shift {measured_shift_um}um)")
+
+    logger.info(f"{'estimator':>30} {'max error':>12} {'rms error':>12} {'scale':>8} "
+                f"{'max error after scale':>22} {'frames/s':>12} {'setup ms':>10}")
+    for name, prepare in estimators.items():
+        estimates_as, setup_s, elapsed = timed_run(prepare, readouts, sensor, wheel)
+        error_as = estimates_as - true_as
+        scale = np.dot(estimates_as, true_as) / np.dot(true_as, true_as)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scaled_error_as = estimates_as / scale - true_as
+        logger.info(f"{name:>30} {np.abs(error_as).max():>11.3f}\" {np.sqrt(np.mean(error_as**2)):>11.3f}\" "
+                    f"{scale:>8.4f} {np.abs(scaled_error_as).max():>21.3f}\" {args.steps/elapsed:>12.1f} "
+                    f"{1000*setup_s:>10.1f}")
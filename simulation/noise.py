@@ -0,0 +1,59 @@
+import numpy as np
+
+
+class SensorNoiseModel:
+    """
+    Noise of linear CCD applied to whole batches of clean readouts (..., N) at once.
+    Readout equal to full_scale means full well; signal is converted to electrons, then
+    - PRNU (gain of every pixel) and DSNU (dark signal of every pixel) fixed patterns are applied,
+    - photon shot noise (Poisson) and read noise (Gaussian) are added,
+    - result is quantized by n-bit ADC spanning 0..full well and converted back to units of readouts.
+    Fixed patterns are drawn once from seed, temporal noise from generator given to apply() or the own one,
+    so the same seed gives the same noisy frames.
+    """
+    def __init__(self, n_pixels, full_scale, full_well_e=30000, read_noise_e=20.0, dark_e=50.0, dsnu_e=10.0,
+                 prnu=0.01, adc_bits=10, seed=None):
+        """
+        :param full_scale: clean readout which fills the full well (area of one pixel for ReadoutGenerator)
+        :param prnu: standard deviation of relative gain of pixels
+        :param dsnu_e: standard deviation of dark signal of pixels around dark_e
+        :param adc_bits: resolution of ADC, None for no quantization
+        :param seed: seed or numpy.random.Generator
+        """
+        self.n_pixels = n_pixels
+        self.full_scale = full_scale
+        self.full_well_e = full_well_e
+        self.read_noise_e = read_noise_e
+        self.adc_bits = adc_bits
+        self.rng = np.random.default_rng(seed)
+        self.gain = 1.0 + prnu * self.rng.standard_normal(n_pixels)
+        self.dark_e = np.maximum(dark_e + dsnu_e * self.rng.standard_normal(n_pixels), 0.0)
+
+    @classmethod
+    def for_sensor(cls, sensor, **kwargs):
+        return cls(sensor.N, sensor.pixel_w_um * sensor.pixel_h_um, **kwargs)
+
+    @property
+    def adc_levels(self):
+        return None if self.adc_bits is None else 2**self.adc_bits - 1
+
+    def apply(self, frames, rng=None):
+        """
+        :param frames: clean readouts, shape (..., N)
+        :param rng: numpy.random.Generator of temporal noise (default: own generator of the model)
+        :return: noisy readouts of the same shape, in the same units
+        """
+        rng = self.rng if rng is None else rng
+        scale_e = self.full_well_e / self.full_scale
+        electrons = np.clip(np.asarray(frames, dtype=float), 0.0, None) * (scale_e * self.gain)
+        electrons += self.dark_e
+        electrons = rng.poisson(electrons).astype(float)
+        electrons += self.read_noise_e * rng.standard_normal(electrons.shape)
+        if self.adc_levels is not None:
+            step_e = self.full_well_e / self.adc_levels
+            np.clip(np.rint(electrons / step_e), 0, self.adc_levels, out=electrons)
+            electrons *= step_e
+        return electrons / scale_e
+
+    def __call__(self, frames, rng=None):
+        return self.apply(frames, rng)
@@ -0,0 +1,135 @@
+import numpy as np
+
+
+def polygons_to_vertices(polygons):
+    """
+    Stack exterior rings of shapely polygons into one array of corners.
+    Shorter rings are padded by repeating their last corner, which adds only zero-length edges.
+    :param polygons: list of shapely polygons
+    :return: array of shape (len(polygons), V, 2)
+    """
+    rings = [np.asarray(p.exterior.coords)[:-1] for p in polygons]
+    if not rings:
+        return np.zeros((0, 0, 2))
+    v = max(len(r) for r in rings)
+    vertices = np.empty((len(rings), v, 2))
+    for i, r in enumerate(rings):
+        vertices[i, :len(r)] = r
+        vertices[i, len(r):] = r[-1]
+    return vertices
+
+
+def _edges(vertices):
+    x1 = vertices[..., 0]
+    y1 = vertices[..., 1]
+    return x1, y1, np.roll(x1, -1, axis=-1), np.roll(y1, -1, axis=-1)
+
+
+def _part_below(x1, y1, x2, y2, b):
+    """
+    Part of every edge lying under the line y = b, described from its lower end upwards
+    :return: (signed length along y, x at lower end, x at upper end)
+    """
+    dy = y2 - y1
+    going_up = dy > 0
+    y_lo = np.where(going_up, y1, y2)
+    x_lo = np.where(going_up, x1, x2)
+    y_hi = np.minimum(np.where(going_up, y2, y1), b)
+    length = np.maximum(y_hi - y_lo, 0.0)
+
+    safe_dy = np.where(dy == 0, 1.0, dy)
+    t_hi = np.clip((y_hi - y1) / safe_dy, 0.0, 1.0)
+    x_hi = x1 + t_hi * (x2 - x1)
+    return np.sign(dy) * length, x_lo, x_hi
+
+
+def _quadrant_area(signed_length, x_lo, x_hi, a):
+    """
+    Signed area of polygon lying in quadrant x < a, y < b, where b was already used to cut the edges.
+    From Green's theorem it is a closed integral of (min(x, a) - a) dy over the boundary below b.
+    Along each edge x is linear in y, so the mean of its negative part has closed form.
+    """
+    v_lo = x_lo - a
+    v_hi = x_hi - a
+    n_lo = np.minimum(v_lo, 0.0)
+    n_hi = np.minimum(v_hi, 0.0)
+    crossing = (v_lo < 0) != (v_hi < 0)
+    spread = np.where(crossing, np.abs(v_hi - v_lo), 1.0)
+    mean_negative = np.where(crossing,
+                             -(n_lo + n_hi) ** 2 / (2.0 * spread),
+                             0.5 * (n_lo + n_hi))
+    return np.sum(signed_length * mean_negative, axis=-1)
+
+
+def rectangle_overlaps(vertices, w, h):
+    """
+    Closed-form area of intersection of polygons with axis aligned rectangle [0, w] x [0, h].
+    Works by inclusion-exclusion of four quadrant areas, so any simple polygon works (not only convex).
+    :param vertices: polygon corners relative to rectangle origin, shape (..., V, 2)
+    :param w: width of rectangle
+    :param h: height of rectangle
+    :return: array of shape (...) with overlap areas
+    """
+    x1, y1, x2, y2 = _edges(vertices)
+    below_h = _part_below(x1, y1, x2, y2, h)
+    below_0 = _part_below(x1, y1, x2, y2, 0.0)
+    signed = _quadrant_area(*below_h, w) - _quadrant_area(*below_h, 0.0) \
+        - _quadrant_area(*below_0, w) + _quadrant_area(*below_0, 0.0)
+    return np.abs(signed)
+
+
+def x_range_within_band(vertices, h):
+    """
+    Horizontal extent of part of every polygon lying in band 0 <= y <= h
+    :param vertices: polygon corners, shape (S, V, 2)
+    :return: (x_min, x_max), both of shape (S,); x_min > x_max for polygons missing the band
+    """
+    x1, y1, x2, y2 = _edges(vertices)
+    dy = y2 - y1
+    flat = dy == 0
+    safe_dy = np.where(flat, 1.0, dy)
+    t_0 = (0.0 - y1) / safe_dy
+    t_h = (h - y1) / safe_dy
+    t_enter = np.where(flat, 0.0, np.maximum(np.minimum(t_0, t_h), 0.0))
+    t_exit = np.where(flat, 1.0, np.minimum(np.maximum(t_0, t_h), 1.0))
+    inside = (t_enter <= t_exit) & (~flat | ((y1 >= 0) & (y1 <= h)))
+
+    x_enter = x1 + t_enter * (x2 - x1)
+    x_exit = x1 + t_exit * (x2 - x1)
+    x_min = np.where(inside, np.minimum(x_enter, x_exit), np.inf).min(axis=-1)
+    x_max = np.where(inside, np.maximum(x_enter, x_exit), -np.inf).max(axis=-1)
+    return x_min, x_max
+
+
+def covered_area_per_pixel(vertices, n, pixel_pitch_um, pixel_w_um, pixel_h_um):
+    """
+    Sum of areas of all polygons covering each pixel of linear sensor.
+    Pixel i is rectangle [i*pixel_pitch_um, i*pixel_pitch_um + pixel_w_um] x [0, pixel_h_um].
+    Every polygon is paired only with pixels in reach of its part lying in the band of pixels,
+    so the cost scales with number of real overlaps rather than n * number of polygons.
+    :param vertices: polygon corners in sensor frame, shape (..., S, V, 2), leading axes are separate frames
+    :return: covered area for each pixel, shape (..., n)
+    """
+    frames_shape = vertices.shape[:-3]
+    n_frames = int(np.prod(frames_shape))
+    s = vertices.shape[-3]
+    vertices = vertices.reshape((n_frames*s,) + vertices.shape[-2:])
+
+    x_min, x_max = x_range_within_band(vertices, pixel_h_um)
+    with np.errstate(invalid='ignore'):
+        first = np.floor((x_min - pixel_w_um) / pixel_pitch_um) + 1
+        last = np.ceil(x_max / pixel_pitch_um) - 1
+    first = np.clip(np.nan_to_num(first, posinf=n, neginf=0), 0, n).astype(int)
+    last = np.clip(np.nan_to_num(last, posinf=n-1, neginf=-1), -1, n-1).astype(int)
+    counts = np.maximum(last - first + 1, 0)
+
+    polygon_index = np.repeat(np.arange(len(vertices)), counts)
+    starts = np.cumsum(counts) - counts
+    pixel_index = first[polygon_index] + np.arange(len(polygon_index)) - starts[polygon_index]
+
+    relative = vertices[polygon_index].copy()
+    relative[..., 0] -= (pixel_index * pixel_pitch_um)[:, np.newaxis]
+    overlaps = rectangle_overlaps(relative, pixel_w_um, pixel_h_um)
+    frame_pixel_index = (polygon_index // s) * n + pixel_index
+    covered = np.bincount(frame_pixel_index, weights=overlaps, minlength=n_frames*n)
+    return covered.reshape(frames_shape + (n,))
@@ -0,0 +1,147 @@
+from config.config_utils import get_default_sensors_config
+from hardware.linear_ccd_sensor import LinearCCDSensor
+from hardware.encoder_wheel import EncoderWheelWithTopAndBottomStrips
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_CLOSED_FORM, engines
+from simulation.noise import SensorNoiseModel
+from storage.readout_store import ReadoutStoreWriter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import json
+import time
+import logging
+import argparse
+
+
+logger = logging.getLogger(__name__)
+
+# Every worker process builds its own generator once, from configuration sent by pool initializer:
+_worker_generator = None
+
+
+def _init_worker(sensor, wheel, sensor_tilt_deg, sensor_shift_um, engine):
+    global _worker_generator
+    _worker_generator = ReadoutGenerator(sensor, wheel,
+                                         sensor_tilt_deg=sensor_tilt_deg,
+                                         sensor_shift_um=sensor_shift_um,
+                                         engine=engine)
+
+
+def _simulate_chunk(angles_deg, seed_sequence, noise_amplitude, noise):
+    readouts = _worker_generator.for_angles(angles_deg)
+    rng = np.random.default_rng(seed_sequence)
+    if noise is not None:
+        readouts = noise.apply(readouts, rng)
+    if noise_amplitude > 0:
+        max_area = _worker_generator.sensor.pixel_w_um * _worker_generator.sensor.pixel_h_um
+        readouts += noise_amplitude * max_area * (rng.random(readouts.shape) - 0.5)
+    return readouts
+
+
+class ParallelSweepSimulator:
+    """
+    Simulates readouts for long list of angles in pool of worker processes.
+    Angles are split into chunks of fixed size and every chunk gets its own random stream spawned from seed,
+    so the result does not depend on number of workers, only on seed and chunk_size.
+    """
+    def __init__(self, sensor, wheel, sensor_tilt_deg=0, sensor_shift_um=(0, 0), engine=ENGINE_CLOSED_FORM,
+                 workers=None, chunk_size=256, noise_amplitude=0.0, noise=None, seed=None):
+        """
+        :param workers: number of worker processes (default: number of CPUs), 1 means no pool at all
+        :param chunk_size: number of angles in one task
+        :param noise_amplitude: uniform noise added to readouts, as a fraction of area of one pixel
+        :param noise: SensorNoiseModel applied to readouts (its fixed patterns are the same in all chunks)
+        :param seed: seed of random streams of all chunks
+        """
+        self.config = (sensor, wheel, sensor_tilt_deg, sensor_shift_um, engine)
+        self.sensor = sensor
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.noise_amplitude = noise_amplitude
+        self.noise = noise
+        self.seed = seed
+
+    def run(self, angles_deg):
+        """
+        :param angles_deg: array of angles
+        :return: array of shape (len(angles_deg), sensor.N) with readouts in order of angles
+        """
+        angles_deg = np.asarray(angles_deg, dtype=float).ravel()
+        readouts = np.empty((len(angles_deg), self.sensor.N))
+        b = 0
+        for chunk_angles, chunk_readouts in self._chunks(angles_deg):
+            readouts[b:b+len(chunk_readouts)] = chunk_readouts
+            b += len(chunk_readouts)
+        return readouts
+
+    def run_to_store(self, angles_deg, writer):
+        """
+        Same as run, but every chunk is appended to ReadoutStoreWriter as soon as it is ready,
+        so sweeps much longer than memory can be simulated.
+        """
+        angles_deg = np.asarray(angles_deg, dtype=float).ravel()
+        for chunk_angles, chunk_readouts in self._chunks(angles_deg):
+            writer.append(chunk_readouts, angles_deg=chunk_angles)
+        return writer
+
+    def _chunks(self, angles_deg):
+        chunks = [angles_deg[b:b+self.chunk_size] for b in range(0, len(angles_deg), self.chunk_size)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(chunks))
+        amplitudes = [self.noise_amplitude] * len(chunks)
+        noises = [self.noise] * len(chunks)
+
+        if self.workers == 1:
+            _init_worker(*self.config)
+            yield from zip(chunks, map(_simulate_chunk, chunks, seeds, amplitudes, noises))
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=_init_worker,
+                                 initargs=self.config) as executor:
+            yield from zip(chunks, executor.map(_simulate_chunk, chunks, seeds, amplitudes, noises))
+
+
+grubosc_paska_mm = 0.128
+N_paskow = 3600
+obwod_mm = grubosc_paska_mm*N_paskow
+R_mm = obwod_mm / (2*np.pi)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config_for_sensors", default=get_default_sensors_config())
+    parser.add_argument("-s", "--sensor", default="TSL1401")
+    parser.add_argument("-n", "--steps", type=int, default=720)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-k", "--chunk_size", type=int, default=256)
+    parser.add_argument("-e", "--engine", default=ENGINE_CLOSED_FORM, choices=engines)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sensor_noise", action="store_true",
+                        help="apply SensorNoiseModel (shot, read, fixed pattern noise and ADC) instead of uniform noise")
+    parser.add_argument("-o", "--output", default=None, help="readout store to append simulated frames to")
+    parser.add_argument("-l", "--log_level", default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level,
+                        format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    with open(args.config_for_sensors) as f:
+        sensor_config_json = json.load(f)
+
+    sensor = LinearCCDSensor.from_json(sensor_config_json[args.sensor])
+    wheel = EncoderWheelWithTopAndBottomStrips(R_mm, N_paskow, 10, 6*grubosc_paska_mm*1000*0.5)
+    simulator = ParallelSweepSimulator(sensor, wheel, sensor_tilt_deg=1.4, sensor_shift_um=(0, -765),
+                                       engine=args.engine, workers=args.workers, chunk_size=args.chunk_size,
+                                       noise_amplitude=0.0 if args.sensor_noise else 0.1,
+                                       noise=SensorNoiseModel.for_sensor(sensor, seed=args.seed) if args.sensor_noise
+                                       else None,
+                                       seed=args.seed)
+
+    angles_deg = np.arange(0, args.steps) / 3600.0
+    start = time.perf_counter()
+    if args.output is None:
+        readouts = simulator.run(angles_deg)
+    else:
+        with ReadoutStoreWriter(args.output, args.sensor, sensor.N) as writer:
+            simulator.run_to_store(angles_deg, writer)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Simulated {len(angles_deg)} frames of {sensor} in {elapsed:.3f}s "
+                f"({len(angles_deg)/elapsed:.1f} frames/s)")
@@ -4,7 +4,12 @@ from hardware.encoder_wheel import EncoderWheel
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from shapely import affinity
+from shapely.strtree import STRtree
+import shapely
 from visualisation.plotter import Plotter
+from simulation.overlap import covered_area_per_pixel
+from hardware.geometry_cache import GeometryCache
+from processing.instrumentation import stage, span
 import numpy as np
 import json
 import logging
@@ -48,12 +53,40 @@ def get_polygons_points(polygon):
     return polygon.exterior.coords.xy
 
 
+ENGINE_SHAPELY = "shapely"
+ENGINE_CLOSED_FORM = "closed_form"
+ENGINE_LOOKUP_TABLE = "lookup_table"
+engines = [ENGINE_SHAPELY, ENGINE_CLOSED_FORM, ENGINE_LOOKUP_TABLE]
+
+
 class ReadoutGenerator:
-    def __init__(self, sensor, wheel, sensor_tilt_deg=0, sensor_shift_um=(0, 0)):
+    pixels_per_chunk = 2**15
+
+    def __init__(self, sensor, wheel, sensor_tilt_deg=0, sensor_shift_um=(0, 0), engine=ENGINE_SHAPELY,
+                 table_points_per_period=1024):
+        """
+        :param engine: ENGINE_SHAPELY clips every pixel with every strip as polygons (reference),
+                       ENGINE_CLOSED_FORM computes the same areas for all pixels at once with numpy,
+                       ENGINE_LOOKUP_TABLE interpolates between frames precomputed by ENGINE_CLOSED_FORM
+                       for angles within one period of strips (pattern repeats every wheel.dphi_deg)
+        :param table_points_per_period: density of phase grid of ENGINE_LOOKUP_TABLE
+        """
+        if engine not in engines:
+            raise ValueError(f"Unknown readout engine: {engine}, expected one of {engines}")
         self.sensor = sensor
         self.wheel = wheel
         self.tilt_deg = sensor_tilt_deg
         self.shift_um = sensor_shift_um
+        self.engine = engine
+        self.table_points_per_period = table_points_per_period
+        self.geometry_cache = GeometryCache()
+
+    def cache_stats(self):
+        """
+        Hits and misses of cached sensor geometry and of strip templates of the wheel
+        """
+        return {"sensor_geometry": self.geometry_cache.stats(),
+                "wheel_strips": self.wheel.templates_cache.stats()}
 
     def _shift_object_like_sensor(self, p):
         (x, y) = self.shift_um
@@ -64,25 +97,160 @@ class ReadoutGenerator:
                             use_radians=False)
         return affinity.translate(p, x, y + r_um)
 
+    def _shift_vertices_to_sensor_frame(self, vertices, geometry):
+        """
+        Inverse of _shift_object_like_sensor for array of corners (..., 2)
+        """
+        (x0, y0), (c, s) = geometry["sensor_origin"], geometry["sensor_direction"]
+        dx = vertices[..., 0] - x0
+        dy = vertices[..., 1] - y0
+        return np.stack([c*dx + s*dy, -s*dx + c*dy], axis=-1)
+
+    @stage("ReadoutGenerator.for_angle")
     def for_angle(self, angle_deg):
         """
         On encoder wheel with radius R and coordinates starting at center of wheel it would be (0, R).
         :param angle_deg:
         :return:
         """
+        geometry = self._sensor_geometry()
+        if self.engine == ENGINE_CLOSED_FORM:
+            return self._for_angles_closed_form(angle_deg, geometry)
+        if self.engine == ENGINE_LOOKUP_TABLE:
+            return self._for_angles_lookup_table(angle_deg, geometry)
+        return self._for_angle_shapely(angle_deg, geometry)
+
+    @stage("ReadoutGenerator.for_angles")
+    def for_angles(self, angles_deg, chunk_size=None):
+        """
+        Readouts for many angles at once. Geometry of sensor is prepared once for whole batch
+        and angles are processed in chunks, so memory stays bounded for arbitrarily long sweeps.
+        :param angles_deg: array of angles
+        :param chunk_size: number of angles processed at once (default: about pixels_per_chunk pixels per chunk)
+        :return: array of shape (len(angles_deg), sensor.N)
+        """
+        angles_deg = np.asarray(angles_deg, dtype=float).ravel()
+        if chunk_size is None:
+            chunk_size = max(1, self.pixels_per_chunk // self.sensor.N)
+
+        readouts = np.empty((len(angles_deg), self.sensor.N))
+        geometry = self._sensor_geometry()
+        if self.engine == ENGINE_CLOSED_FORM:
+            for b in range(0, len(angles_deg), chunk_size):
+                readouts[b:b+chunk_size] = self._for_angles_closed_form(angles_deg[b:b+chunk_size], geometry)
+        elif self.engine == ENGINE_LOOKUP_TABLE:
+            for b in range(0, len(angles_deg), chunk_size):
+                self._for_angles_lookup_table(angles_deg[b:b+chunk_size], geometry, out=readouts[b:b+chunk_size])
+        else:
+            for i in range(0, len(angles_deg)):
+                readouts[i] = self._for_angle_shapely(angles_deg[i], geometry)
+        return readouts
+
+    def _for_angles_closed_form(self, angles_deg, geometry):
+        """
+        Strips are moved to sensor frame, where pixels are axis aligned rectangles,
+        and their overlaps with all pixels are computed in closed form.
+        Works for single angle as well as for array of angles.
+        """
+        strips = self.wheel.strips_vertices(angles_deg, footprint=geometry["sensor_rectangle"])
+        strips = self._shift_vertices_to_sensor_frame(strips, geometry)
+        covered = covered_area_per_pixel(strips, self.sensor.N, self.sensor.dx,
+                                         self.sensor.pixel_w_um, self.sensor.pixel_h_um)
+        return geometry["max_area"] - covered
+
+    def _for_angles_lookup_table(self, angles_deg, geometry, out=None):
+        """
+        Frame for angle is linear interpolation between two rows of table around its phase within period of strips
+        """
+        table, slopes = geometry["table"], geometry["table_slopes"]
+        m = len(slopes)
+        position = np.mod(angles_deg, self.wheel.dphi_deg) * (m / self.wheel.dphi_deg)
+        row = np.minimum(position.astype(int), m - 1)
+        fraction = (position - row)[..., np.newaxis]
+        if out is None:
+            out = np.empty(np.shape(angles_deg) + (self.sensor.N,))
+        np.take(slopes, row, axis=0, out=out)
+        out *= fraction
+        out += table[row]
+        return out
+
+    def table_max_error(self):
+        """
+        Largest difference between ENGINE_LOOKUP_TABLE and exact frames, checked in the middle between rows of table
+        """
+        if self.engine != ENGINE_LOOKUP_TABLE:
+            return 0.0
+        return self._sensor_geometry()["table_max_error"]
+
+    def _geometry_key(self):
+        return (self.sensor.N, self.sensor.pixel_w_um, self.sensor.pixel_h_um, self.sensor.horizontal_spacing_um,
+                self.tilt_deg, tuple(self.shift_um), self.wheel.radius_mm, self.wheel.count, self.wheel.line_height_mm,
+                getattr(self.wheel, "distance_to_bottom_line_um", None),
+                getattr(self.wheel, "bottom_line_width_um", None),
+                getattr(self.wheel, "distance_to_top_line_um", None),
+                getattr(self.wheel, "top_line_width_um", None),
+                self.engine, self.table_points_per_period)
+
+    def _sensor_geometry(self):
+        """
+        Everything about sensor placed on the wheel that does not depend on angle.
+        Rebuilt only when sensor, tilt, shift or geometry of wheel (radius, strips, lines) change.
+        """
+        return self.geometry_cache.get(self._geometry_key(), self._create_sensor_geometry)
 
-        sensor_rectangle = self._shift_object_like_sensor(self.sensor.get_total_rectangle())
-        original_segments = self.sensor.get_array_segments()
-        sensor_segments = [self._shift_object_like_sensor(s) for s in original_segments]
+    def _create_sensor_geometry(self):
+        (x, y) = self.shift_um
+        r_um = self.wheel.radius_mm * 1000
+        a = np.radians(90+self.tilt_deg)
+        geometry = {
+            "sensor_rectangle": self._shift_object_like_sensor(self.sensor.get_total_rectangle()),
+            "max_area": self.sensor.pixel_w_um*self.sensor.pixel_h_um,
+            "sensor_origin": (x, y + r_um),
+            "sensor_direction": (np.cos(a), np.sin(a))
+        }
+        if self.engine == ENGINE_SHAPELY:
+            original_segments = self.sensor.get_array_segments()
+            sensor_segments = np.array([self._shift_object_like_sensor(s) for s in original_segments], dtype=object)
+            geometry["sensor_segments"] = sensor_segments
+            geometry["segments_tree"] = STRtree(sensor_segments)
+            geometry["max_area"] = sensor_segments[0].area
+        if self.engine == ENGINE_LOOKUP_TABLE:
+            self._create_lookup_table(geometry)
+        return geometry
+
+    def _create_lookup_table(self, geometry):
+        """
+        Rows for phases 0, 1/m, ..., 1 of period (the last one equals the first), slopes between them,
+        and maximal error of interpolation in the middle between rows
+        """
+        m = self.table_points_per_period
+        phases_deg = np.arange(0, m + 1) * (self.wheel.dphi_deg / m)
+        table = self._exact_frames(phases_deg, geometry)
+        middles = self._exact_frames(phases_deg[:-1] + 0.5*self.wheel.dphi_deg/m, geometry)
+        geometry["table"] = table
+        geometry["table_slopes"] = np.diff(table, axis=0)
+        geometry["table_max_error"] = float(np.abs(middles - 0.5*(table[:-1] + table[1:])).max())
+        logger.info(f"Lookup table of {m} phases per period, max interpolation error "
+                    f"{geometry['table_max_error']:.3g} ({geometry['table_max_error'] / geometry['max_area']:.2e} "
+                    f"of pixel area)")
+
+    def _exact_frames(self, angles_deg, geometry):
+        chunk_size = max(1, self.pixels_per_chunk // self.sensor.N)
+        return np.concatenate([self._for_angles_closed_form(angles_deg[b:b+chunk_size], geometry)
+                               for b in range(0, len(angles_deg), chunk_size)])
+
+    def _for_angle_shapely(self, angle_deg, geometry):
+        sensor_rectangle = geometry["sensor_rectangle"]
+        sensor_segments = geometry["sensor_segments"]
 
         # margin = 10
         # original_strips = self.wheel.strips[-margin:]
         # original_strips += self.wheel.strips[:margin]
-        rotated_strips = self.wheel.strips(angle_deg)
+        rotated_strips = self.wheel.strips(angle_deg, footprint=sensor_rectangle)
 
-        logger.debug(f"Interesting strips: {rotated_strips}")
-        logger.debug(f"Sensor rectangle= {sensor_rectangle}")
-        logger.debug(f"Sensor segments: {sensor_segments}")
+        logger.debug("Interesting strips: %s", rotated_strips)
+        logger.debug("Sensor rectangle= %s", sensor_rectangle)
+        logger.debug("Sensor segments: %s", sensor_segments)
 
         # plotter = Plotter()
         # plotter.add_polygon(sensor_rectangle, color='green')
@@ -95,20 +263,16 @@ class ReadoutGenerator:
         # plotter.execute()
 
 
-        max_area = sensor_segments[0].area
-        readout = max_area*np.ones(self.sensor.N)
-
-        set_of_intersecting = [s for s in rotated_strips if s.intersects(sensor_rectangle)]
-        # logger.info(f"Set of intersecting strips: {set_of_intersecting}")
-
-        for i in range(0, self.sensor.N):
-            segment = sensor_segments[i]
-            for strip in set_of_intersecting:
-                readout[i] -= segment.intersection(strip).area# * (1.06-0.12*np.random.rand())
+        max_area = geometry["max_area"]
 
-            #readout[i] *= (1.06-0.12*np.random.rand())
+        # only pairs of strip and segment with overlapping bounding boxes are clipped:
+        rotated_strips = np.array(rotated_strips, dtype=object)
+        with span("shapely_clipping"):
+            strip_index, segment_index = geometry["segments_tree"].query(rotated_strips)
+            areas = shapely.area(shapely.intersection(rotated_strips[strip_index], sensor_segments[segment_index]))
+        # logger.info(f"Number of intersecting pairs: {len(areas)}")
 
-        return readout
+        return max_area - np.bincount(segment_index, weights=areas, minlength=self.sensor.N)
 
 
 obwod_mm = 0.128*3600
@@ -117,6 +281,7 @@ R_mm = obwod_mm / (2*np.pi)
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-l", "--log_level", default=0)
+    parser.add_argument("-e", "--engine", default=ENGINE_SHAPELY, choices=engines)
     args = parser.parse_args()
 
     logging.basicConfig(level=args.log_level,
@@ -128,16 +293,18 @@ if __name__ == "__main__":
     sensor = LinearCCDSensor.from_json(config["TSL1401"])
     wheel = EncoderWheel(R_mm, 3600, 7.5)
 
-    readout_generator = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=4, sensor_shift_um=(27, -300))
-    readout = readout_generator.for_angle(0)
+    readout_generator = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=4, sensor_shift_um=(27, -300),
+                                         engine=args.engine)
+    readouts = readout_generator.for_angles([0, 0.02, 0.04, 0.06])
+    readout = readouts[0]
     logger.info(f"Readout = [N={sensor.N}] {readout}")
 
     plt.figure()
     ax = plt.gca()
-    ax.plot(range(0, len(readout)), readout_generator.for_angle(0), color='black')
-    ax.plot(range(0, len(readout)), readout_generator.for_angle(0.02), color='green')
-    ax.plot(range(0, len(readout)), readout_generator.for_angle(0.04), color='blue')
-    ax.plot(range(0, len(readout)), readout_generator.for_angle(0.06), color='red')
+    ax.plot(range(0, len(readout)), readouts[0], color='black')
+    ax.plot(range(0, len(readout)), readouts[1], color='green')
+    ax.plot(range(0, len(readout)), readouts[2], color='blue')
+    ax.plot(range(0, len(readout)), readouts[3], color='red')
     ax.set(xlabel='position (px)', ylabel='intensity (a.u.)',
            title='Linear scan of encoder')
     ax.grid()
@@ -1,11 +1,22 @@
+"""
+Monte Carlo study of SensorYShiftEstimator. Every trial samples vertical shift, tilt of sensor and angle of wheel,
+simulates one frame and estimates the shift from bottom and top edge. Trials run in chunks in worker processes,
+every chunk with its own random stream spawned from seed (results do not depend on number of workers),
+errors are only accumulated in streaming statistics. Study stops when confidence interval of RMS error
+of every estimate is narrower than target, or after max_trials.
+"""
 from hardware.linear_ccd_sensor import LinearCCDSensor
 from hardware.encoder_wheel import EncoderWheelWithTopAndBottomStrips
 from processing.y_shift_estimator import SensorYShiftEstimator
-from visualisation.plotter import Plotter
-from simulation.simulate_readouts import ReadoutGenerator
-from matplotlib import pyplot
+from processing.streaming_stats import ErrorAccumulator
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_CLOSED_FORM, ENGINE_SHAPELY
+from simulation.noise import SensorNoiseModel
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 import numpy as np
+import os
 import json
+import time
 import argparse
 import logging
 from config.config_utils import get_default_sensors_config
@@ -14,15 +25,157 @@ grubosc_paska_mm = 0.128
 N_paskow = 3600
 obwod_mm = grubosc_paska_mm*N_paskow
 R_mm = obwod_mm / (2*np.pi)
-
-# necessary to disable np debug nonsense:
-logging.getLogger("matplotlib").propagate = False
+grubosc_czarnego_um = grubosc_paska_mm*1000*0.5
+odleglosc_dolnego_paska = 6*grubosc_czarnego_um
 
 logger = logging.getLogger(__name__)
 
+estimates = ("bottom", "top", "mean")
+# every trial places sensor differently, lookup table would be rebuilt for every one of them:
+trial_engines = [ENGINE_SHAPELY, ENGINE_CLOSED_FORM]
+
+
+class TrialParameters:
+    """
+    Ranges of sampled parameters: shift uniform in [y_shift_um, y_shift_um + y_range_um),
+    tilt uniform in tilt_deg +- tilt_spread_deg, angle uniform within one period of strips
+    """
+    def __init__(self, y_shift_um=-831.4724514, y_range_um=164.0, tilt_deg=1.3925103, tilt_spread_deg=0.05):
+        self.y_shift_um = y_shift_um
+        self.y_range_um = y_range_um
+        self.tilt_deg = tilt_deg
+        self.tilt_spread_deg = tilt_spread_deg
+
+    def sample(self, rng, n, dphi_deg):
+        y = self.y_shift_um + self.y_range_um*rng.random(n)
+        tilt = self.tilt_deg + self.tilt_spread_deg*(2*rng.random(n) - 1)
+        angle = dphi_deg*rng.random(n)
+        return y, tilt, angle
+
+
+# Every worker process builds its own generator and estimator once:
+_worker = None
+
+
+def _init_worker(sensor, wheel, engine, parameters, noise):
+    global _worker
+    _worker = {
+        "generator": ReadoutGenerator(sensor, wheel, engine=engine),
+        "estimator": SensorYShiftEstimator(sensor, wheel),
+        "parameters": parameters,
+        "noise": noise
+    }
+
+
+def _run_chunk(seed_sequence, n):
+    """
+    :return: dictionary estimate -> errors of n trials
+    """
+    generator = _worker["generator"]
+    estimator = _worker["estimator"]
+    rng = np.random.default_rng(seed_sequence)
+    y, tilt, angle = _worker["parameters"].sample(rng, n, generator.wheel.dphi_deg)
+
+    frames = np.empty((n, generator.sensor.N))
+    for i in range(0, n):
+        generator.tilt_deg = tilt[i]
+        generator.shift_um = (0, y[i])
+        frames[i] = generator.for_angle(angle[i])
+    if _worker["noise"] is not None:
+        frames = _worker["noise"].apply(frames, rng)
+
+    bottom = y + estimator.estimate_bottom_edges(frames)
+    top = y + estimator.estimate_top_edges(frames)
+    return {"bottom": bottom, "top": top, "mean": 0.5*(bottom + top)}
+
+
+class MonteCarloYShiftStudy:
+    def __init__(self, sensor, wheel, parameters, engine=ENGINE_CLOSED_FORM, noise=None, workers=None,
+                 chunk_size=500, seed=None):
+        """
+        :param noise: SensorNoiseModel applied to frames, None for clean frames
+        :param workers: number of worker processes (default: number of CPUs), 1 means no pool at all
+        """
+        if engine not in trial_engines:
+            raise ValueError(f"Engine {engine} is not suitable for trials with different placement of sensor, "
+                             f"use one of {trial_engines}")
+        self.config = (sensor, wheel, engine, parameters, noise)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.accumulators = {name: ErrorAccumulator() for name in estimates}
+        self.trials = 0
+
+    def converged(self, target_half_width_um, min_trials, z=1.96):
+        """
+        Estimates without any valid value (e.g. edge out of sensor for every trial) do not hold the study
+        """
+        valid = [a for a in self.accumulators.values() if a.n]
+        return self.trials >= min_trials and len(valid) > 0 and \
+            all(a.rms_half_width(z) < target_half_width_um for a in valid)
+
+    def _accumulate(self, errors, n):
+        for name, accumulator in self.accumulators.items():
+            accumulator.update(errors[name])
+        self.trials += n
+
+    def run(self, max_trials, target_half_width_um=0.0, min_trials=1000, z=1.96):
+        """
+        Chunks are accumulated in order of submission, so result depends only on seed and chunk size.
+        :return: number of trials run
+        """
+        chunks = [self.chunk_size]*(max_trials // self.chunk_size) + \
+                 ([max_trials % self.chunk_size] if max_trials % self.chunk_size else [])
+        seeds = self.seed_sequence.spawn(len(chunks))
+        trials = self.trials
+        if self.workers == 1:
+            _init_worker(*self.config)
+            for seed, n in zip(seeds, chunks):
+                self._accumulate(_run_chunk(seed, n), n)
+                if self.converged(target_half_width_um, min_trials, z):
+                    break
+            return self.trials - trials
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=self.config) as executor:
+            in_flight = deque()
+            tasks = iter(zip(seeds, chunks))
+            max_in_flight = 2*(self.workers or os.cpu_count())
+            for seed, n in tasks:
+                in_flight.append((executor.submit(_run_chunk, seed, n), n))
+                if len(in_flight) < max_in_flight:
+                    continue
+                future, n = in_flight.popleft()
+                self._accumulate(future.result(), n)
+                if self.converged(target_half_width_um, min_trials, z):
+                    break
+            else:
+                while in_flight and not self.converged(target_half_width_um, min_trials, z):
+                    future, n = in_flight.popleft()
+                    self._accumulate(future.result(), n)
+            for future, n in in_flight:
+                future.cancel()
+        return self.trials - trials
+
+    def summary(self, z=1.96):
+        return {name: a.summary(z) for name, a in self.accumulators.items()}
+
+
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(description="Monte Carlo study of errors of vertical shift estimates")
     parser.add_argument("-c", "--config_for_sensors", default=get_default_sensors_config())
+    parser.add_argument("-s", "--sensor", default="TSL1401")
+    parser.add_argument("-n", "--max_trials", type=int, default=100000)
+    parser.add_argument("-t", "--target_um", type=float, default=0.05,
+                        help="stop when half width of confidence interval of RMS error is below this")
+    parser.add_argument("--min_trials", type=int, default=1000)
+    parser.add_argument("--tilt_spread_deg", type=float, default=0.05)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-k", "--chunk_size", type=int, default=500)
+    parser.add_argument("-e", "--engine", default=ENGINE_CLOSED_FORM, choices=trial_engines)
+    parser.add_argument("--noise", action="store_true", help="simulate noise of sensor and ADC")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default=None, help="JSON file for statistics")
     parser.add_argument("-l", "--log_level", default=20)
     args = parser.parse_args()
 
@@ -33,41 +186,26 @@ if __name__ == "__main__":
     with open(args.config_for_sensors) as f:
         sensor_config_json = json.load(f)
 
-    logger.debug(f"Creating instance of sensor...")
-    sensor = LinearCCDSensor.from_json(sensor_config_json["TSL1401"])
+    sensor = LinearCCDSensor.from_json(sensor_config_json[args.sensor])
     logger.info(sensor)
-    logger.debug(f"Creating line fitter...")
-
-    grubosc_czarnego_um = grubosc_paska_mm*1000*0.5
-    odleglosc_dolnego_paska = 6*grubosc_czarnego_um
-    grubosc_dolnego_paska = 3*grubosc_czarnego_um
-    wheel = EncoderWheelWithTopAndBottomStrips(R_mm, N_paskow, 6.4, odleglosc_dolnego_paska) #, grubosc_dolnego_paska)
-
-    dev = []
-    rev = []
-    y_estimator = SensorYShiftEstimator(sensor, wheel)
-    for i in range(0, 200):
-        tested_y_shift = -831.4724514 + 164.0*np.random.rand()
-        readout_generator = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=1.3925103, sensor_shift_um=(0, tested_y_shift))
-
-        tested_angle_deg = 0.02784789
-
-        raw = readout_generator.for_angle(tested_angle_deg)
-        y_estimate_bot = y_estimator.estimate_bottom_edge(raw)
-        y_estimate_top = y_estimator.estimate_top_edge(raw)
-        print(f"{i} ESTIMATE BOT = {y_estimate_bot}, REAL = {tested_y_shift}, ERROR = {tested_y_shift + y_estimate_bot}")
-        print(f"{i} ESTIMATE TOP = {y_estimate_top}, REAL = {tested_y_shift}, ERROR = {tested_y_shift + y_estimate_top}")
-
-        y_estimate = 0.5*y_estimate_bot + 0.5*y_estimate_top
-
-        dev.append(tested_y_shift + y_estimate)
-        rev.append(tested_y_shift + y_estimate_top)
-
-
-    plotter = Plotter()
-
-    # plotter.plot_simple(raw)
-    pyplot.hist(dev, bins=16)
-    pyplot.hist(rev, color='red', bins=16)
-
-    plotter.show_plot()
+    wheel = EncoderWheelWithTopAndBottomStrips(R_mm, N_paskow, 6.4, odleglosc_dolnego_paska)
+    noise = SensorNoiseModel.for_sensor(sensor, seed=args.seed) if args.noise else None
+
+    study = MonteCarloYShiftStudy(sensor, wheel, TrialParameters(tilt_spread_deg=args.tilt_spread_deg),
+                                  engine=args.engine, noise=noise, workers=args.workers, chunk_size=args.chunk_size,
+                                  seed=args.seed)
+    start = time.perf_counter()
+    trials = study.run(args.max_trials, args.target_um, args.min_trials)
+    elapsed = time.perf_counter() - start
+    logger.info(f"{trials} trials in {elapsed:.1f}s ({trials/elapsed:.1f} trials/s)")
+
+    summary = study.summary()
+    logger.info(f"{'estimate':>8} {'mean':>10} {'std':>10} {'rms':>10} {'+-':>8} {'q5':>10} {'q50':>10} {'q95':>10} "
+                f"{'invalid':>8}")
+    for name, s in summary.items():
+        logger.info(f"{name:>8} {s['mean']:>10.3f} {s['std']:>10.3f} {s['rms']:>10.3f} {s['rms_half_width']:>8.3f} "
+                    f"{s['q5']:>10.3f} {s['q50']:>10.3f} {s['q95']:>10.3f} {s['invalid']:>8d}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"arguments": vars(args), "trials": trials, "statistics": summary}, f, indent=2)
@@ -0,0 +1,200 @@
+"""
+Binary archive of sensor readouts.
+
+<path>       header of header_size bytes: magic, uint32 size of header, JSON description padded with spaces,
+             then frames as one contiguous C-ordered matrix (frames x N) of given dtype
+<path>.meta  one record of metadata_dtype (angle, timestamp) per frame
+
+Number of frames in header is rewritten after every append, so the archive stays readable while it grows.
+"""
+import json
+import os
+import zlib
+import argparse
+import numpy as np
+from config.config_utils import get_cache_dir
+
+
+magic = b"ENKREADS"
+header_size = 4096
+metadata_dtype = np.dtype([("angle_deg", "<f8"), ("timestamp_s", "<f8")])
+version = 1
+
+
+def metadata_path(path):
+    return path + ".meta"
+
+
+def _write_header(f, header):
+    text = json.dumps(header).encode("utf-8")
+    prefix = magic + np.uint32(header_size).tobytes()
+    if len(prefix) + len(text) > header_size:
+        raise ValueError(f"Header of readout store does not fit in {header_size} bytes")
+    f.seek(0)
+    f.write(prefix + text.ljust(header_size - len(prefix)))
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        prefix = f.read(len(magic) + 4)
+        if prefix[:len(magic)] != magic:
+            raise ValueError(f"{path} is not a readout store")
+        size = int(np.frombuffer(prefix[len(magic):], dtype="<u4")[0])
+        return json.loads(f.read(size - len(prefix)).decode("utf-8"))
+
+
+class ReadoutStore:
+    """
+    Read-only view of archive. Frames and metadata are memory mapped, nothing is loaded until used,
+    so get_data(i) is a view of one row of file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self.sensor_model = self.header["sensor"]
+        self.N = self.header["N"]
+        self.dtype = np.dtype(self.header["dtype"])
+        n = self.header["frames"]
+        if n > 0:
+            self.frames = np.memmap(path, dtype=self.dtype, mode="r", offset=header_size, shape=(n, self.N))
+            self.metadata = np.memmap(metadata_path(path), dtype=metadata_dtype, mode="r", shape=(n,))
+        else:
+            self.frames = np.zeros((0, self.N), dtype=self.dtype)
+            self.metadata = np.zeros(0, dtype=metadata_dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_data(self, i=0):
+        return self.frames[i]
+
+    @property
+    def angles_deg(self):
+        return self.metadata["angle_deg"]
+
+    @property
+    def timestamps_s(self):
+        return self.metadata["timestamp_s"]
+
+    def __repr__(self):
+        return f"Readout store {self.path}: {len(self)} frames of {self.sensor_model} (N={self.N}, {self.dtype})"
+
+
+class ReadoutStoreWriter:
+    """
+    Appends frames to archive, creating it if it does not exist yet.
+    Sensor, N and dtype given for existing archive have to match it, otherwise ValueError is raised.
+    """
+    def __init__(self, path, sensor_model=None, n=None, dtype=None):
+        """
+        :param dtype: dtype of frames (default for new archive: "<f8")
+        """
+        self.path = path
+        if os.path.exists(path):
+            self.header = read_header(path)
+            self._check_existing(sensor_model, n, dtype)
+        else:
+            if n is None:
+                raise ValueError("Number of pixels is needed to create readout store")
+            self.header = {"version": version, "sensor": sensor_model, "N": n,
+                           "dtype": np.dtype("<f8" if dtype is None else dtype).str, "frames": 0}
+            with open(path, "wb") as f:
+                _write_header(f, self.header)
+            open(metadata_path(path), "wb").close()
+
+        self.dtype = np.dtype(self.header["dtype"])
+        self.N = self.header["N"]
+        self.frames_file = open(path, "r+b")
+        self.metadata_file = open(metadata_path(path), "r+b")
+
+    def _check_existing(self, sensor_model, n, dtype):
+        path, header = self.path, self.header
+        if sensor_model is not None and sensor_model != header["sensor"]:
+            raise ValueError(f"{path} holds frames of sensor {header['sensor']}, not {sensor_model}")
+        if n is not None and n != header["N"]:
+            raise ValueError(f"{path} holds frames of N={header['N']}, not {n}")
+        if dtype is not None and np.dtype(dtype) != np.dtype(header["dtype"]):
+            raise ValueError(f"{path} holds frames of dtype {header['dtype']}, not {np.dtype(dtype).str}")
+        frames_size = header_size + header["frames"] * header["N"] * np.dtype(header["dtype"]).itemsize
+        metadata_size = header["frames"] * metadata_dtype.itemsize
+        if not os.path.exists(metadata_path(path)) or os.path.getsize(metadata_path(path)) < metadata_size or \
+                os.path.getsize(path) < frames_size:
+            raise ValueError(f"{path} or its metadata is shorter than {header['frames']} frames of its header")
+
+    def append(self, frames, angles_deg=None, timestamps_s=None):
+        """
+        :param frames: one frame (N,) or many frames (n, N)
+        :param angles_deg: angle of every frame (default: NaN)
+        :param timestamps_s: time of every frame (default: NaN)
+        """
+        frames = np.ascontiguousarray(np.atleast_2d(frames), dtype=self.dtype)
+        if frames.shape[1] != self.N:
+            raise ValueError(f"Frames have {frames.shape[1]} pixels, store expects {self.N}")
+        metadata = np.empty(len(frames), dtype=metadata_dtype)
+        metadata["angle_deg"] = np.nan if angles_deg is None else angles_deg
+        metadata["timestamp_s"] = np.nan if timestamps_s is None else timestamps_s
+
+        n = self.header["frames"]
+        self.frames_file.seek(header_size + n * self.N * self.dtype.itemsize)
+        self.frames_file.write(frames.tobytes())
+        self.metadata_file.seek(n * metadata_dtype.itemsize)
+        self.metadata_file.write(metadata.tobytes())
+        self.header["frames"] = n + len(frames)
+        self.flush()
+
+    def flush(self):
+        self.metadata_file.flush()
+        self.frames_file.flush()
+        _write_header(self.frames_file, self.header)
+        self.frames_file.flush()
+
+    def close(self):
+        self.flush()
+        self.frames_file.close()
+        self.metadata_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def convert_json(json_path, store_path, sensor_model=None, dtype="<f8"):
+    """
+    Converts readouts from JSON file of form {"data": [[...], [...], ...]} (like fake_inputs.json)
+    """
+    with open(json_path) as f:
+        data = np.array(json.load(f)["data"], dtype=dtype)
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    with ReadoutStoreWriter(store_path, sensor_model, data.shape[1], dtype) as writer:
+        writer.append(data)
+    return ReadoutStore(store_path)
+
+
+def open_converted(json_path, cache_dir=None):
+    """
+    Store converted from JSON file, kept in cache directory (not next to JSON, which may be in source tree).
+    Conversion happens only when JSON is newer than store.
+    :param cache_dir: default: get_cache_dir()
+    """
+    cache_dir = get_cache_dir() if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    json_path = os.path.abspath(json_path)
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    store_path = os.path.join(cache_dir, f"{name}-{zlib.crc32(json_path.encode()):08x}.rdo")
+    if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(json_path):
+        return convert_json(json_path, store_path)
+    return ReadoutStore(store_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts JSON readouts into binary readout store")
+    parser.add_argument("json_path")
+    parser.add_argument("store_path")
+    parser.add_argument("-s", "--sensor", default="TSL1401")
+    parser.add_argument("-d", "--dtype", default="<f8")
+    args = parser.parse_args()
+
+    print(convert_json(args.json_path, args.store_path, args.sensor, args.dtype))
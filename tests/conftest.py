@@ -0,0 +1,35 @@
+import json
+import numpy as np
+import pytest
+from config.config_utils import get_default_sensors_config
+from hardware.linear_ccd_sensor import LinearCCDSensor
+from hardware.encoder_wheel import EncoderWheelWithTopAndBottomStrips
+
+grubosc_paska_mm = 0.128
+N_paskow = 3600
+R_mm = grubosc_paska_mm*N_paskow / (2*np.pi)
+odleglosc_dolnego_paska = 6*grubosc_paska_mm*1000*0.5
+
+sensor_tilt_deg = 1.4
+sensor_shift_um = (0, -765)
+
+
+@pytest.fixture(scope="session")
+def sensors_config():
+    with open(get_default_sensors_config()) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session", params=["TSL1401", "TCD1304"])
+def sensor(request, sensors_config):
+    return LinearCCDSensor.from_json(sensors_config[request.param])
+
+
+@pytest.fixture(scope="session")
+def tsl1401(sensors_config):
+    return LinearCCDSensor.from_json(sensors_config["TSL1401"])
+
+
+@pytest.fixture
+def wheel():
+    return EncoderWheelWithTopAndBottomStrips(R_mm, N_paskow, 10, odleglosc_dolnego_paska)
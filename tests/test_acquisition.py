@@ -0,0 +1,50 @@
+import numpy as np
+from hardware.acquisition import RingBuffer, measure_rate, synthetic_telemetry_lines
+
+dtype = [("value", "<i8")]
+
+
+def values(first, n):
+    return np.array([(v,) for v in range(first, first + n)], dtype=dtype)
+
+
+def test_ring_buffer_drains_oldest_first():
+    buffer = RingBuffer(8, dtype)
+    buffer.extend(values(0, 3))
+    buffer.push((3,))
+    buffer.extend(values(4, 2))
+    assert len(buffer) == 6
+    first = buffer.drain(4)
+    rest = buffer.drain()
+    assert first["sequence"].tolist() == [0, 1, 2, 3]
+    assert rest["value"].tolist() == [4, 5]
+    assert len(buffer) == 0 and len(buffer.drain()) == 0
+    assert buffer.overruns == 0
+
+
+def test_ring_buffer_counts_overwritten_records():
+    buffer = RingBuffer(4, dtype)
+    for v in range(0, 6):
+        buffer.push((v,))
+    assert buffer.drain()["value"].tolist() == [2, 3, 4, 5]
+    assert buffer.overruns == 2
+
+    buffer.extend(values(6, 10))  # more than capacity at once, only the newest fit
+    drained = buffer.drain()
+    assert drained["sequence"].tolist() == [12, 13, 14, 15]
+    assert drained["value"].tolist() == [12, 13, 14, 15]
+    assert buffer.overruns == 2 + 6
+
+
+def test_ring_buffer_constant_fields():
+    buffer = RingBuffer(4, [("received_s", "<f8")] + dtype)
+    buffer.extend(values(0, 2), received_s=1.5)
+    assert buffer.drain()["received_s"].tolist() == [1.5, 1.5]
+
+
+def test_fake_device_received_without_losses():
+    lines = synthetic_telemetry_lines(1000)
+    result = measure_rate(lines, rate_hz=2000, duration_s=0.3, drain_period_s=0.02, capacity=1 << 12)
+    assert result["sent"] > 0
+    assert result["received"] == result["sent"]
+    assert result["lost"] == 0 and result["overruns"] == 0 and result["decode_errors"] == 0
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from processing.line_fitter import split_vertically_by_threshold
+from processing.crossings import find_crossings, multi_threshold_crossing_mask
+
+
+def split_reference(data, threshold, raw_data=None):
+    """
+    Loop of split_vertically_by_threshold before vectorization
+    """
+    if raw_data is None:
+        raw_data = data
+    crossings = []
+    hills = []
+    current_hill = []
+    direction = "minus" if data[0] < threshold else "plus"
+    for p_index, p in enumerate(data):
+        if (direction == "minus" and p > threshold) or (direction == "plus" and p < threshold):
+            direction = "plus" if direction == "minus" else "minus"
+            crossings.append(p_index)
+            hills.append(current_hill)
+            current_hill = []
+        current_hill.append(raw_data[p_index])
+    hills.append(current_hill)
+    return crossings, hills
+
+
+# integers make samples equal to threshold (they keep previous state) common:
+frames = np.random.default_rng(1).integers(0, 5, size=(20, 60)).astype(float)
+
+
+@pytest.mark.parametrize("threshold", [0.5, 2.0, 4.0, 5.0])
+def test_split_matches_loop(threshold):
+    raw = frames * 10
+    for frame, raw_frame in zip(frames, raw):
+        crossings, hills = split_vertically_by_threshold(frame, threshold, raw_frame)
+        expected_crossings, expected_hills = split_reference(frame, threshold, raw_frame)
+        assert list(crossings) == expected_crossings
+        assert [list(h) for h in hills] == expected_hills
+
+
+def test_split_of_batch_matches_single_frames():
+    thresholds = np.linspace(1, 3, len(frames))[:, np.newaxis]
+    crossings, hills = split_vertically_by_threshold(frames, thresholds)
+    for i, frame in enumerate(frames):
+        expected_crossings, expected_hills = split_reference(frame, thresholds[i, 0])
+        assert list(crossings[i]) == expected_crossings
+        assert [list(h) for h in hills[i]] == expected_hills
+
+
+def test_multi_threshold_mask_matches_single_thresholds():
+    thresholds = np.array([0.5, 1.0, 2.0, 3.5])
+    mask = multi_threshold_crossing_mask(frames, thresholds)
+    for i, frame in enumerate(frames):
+        for t, threshold in enumerate(thresholds):
+            assert list(np.flatnonzero(mask[i, t])) == split_reference(frame, threshold)[0]
+            assert list(find_crossings(frame, threshold)) == split_reference(frame, threshold)[0]
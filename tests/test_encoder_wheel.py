@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from shapely import affinity
+from shapely.geometry import Polygon
+from conftest import sensor_tilt_deg, sensor_shift_um
+
+
+def sensor_like_footprint(wheel, x_um):
+    """
+    Rectangle lying along the radius, like sensor placed over the strips, a few strips wide
+    """
+    y0 = wheel.radius_mm*1000 + sensor_shift_um[1]
+    footprint = Polygon([(x_um - 300, y0), (x_um + 300, y0), (x_um + 300, y0 + 8200), (x_um - 300, y0 + 8200)])
+    return affinity.rotate(footprint, sensor_tilt_deg, origin=(x_um, y0), use_radians=False)
+
+
+def touching_strips(strips, footprint):
+    """
+    :return: sorted centroids and areas of parts of strips overlapping footprint
+    """
+    parts = [strip.intersection(footprint) for strip in strips]
+    return np.array(sorted((p.centroid.x, p.centroid.y, p.area) for p in parts if p.area > 1e-3))
+
+
+@pytest.mark.parametrize("angle_deg", [0.0, 0.00371, -0.0417, 359.95, 359.9999, 360.0, 360.0613, 719.98, 720.0])
+@pytest.mark.parametrize("x_um", [0.0, -2500.0, 1800.0])
+def test_culled_strips_match_fixed_margin(wheel, angle_deg, x_um):
+    footprint = sensor_like_footprint(wheel, x_um)
+    culled = wheel.strips(angle_deg, footprint)
+    fixed_margin = wheel.strips(angle_deg)
+    assert len(culled) < len(fixed_margin)
+    expected = touching_strips(fixed_margin, footprint)
+    assert len(expected) > 5
+    np.testing.assert_allclose(touching_strips(culled, footprint), expected, rtol=0, atol=1e-5)
+    np.testing.assert_allclose(wheel.strips_vertices(angle_deg, footprint),
+                               [np.asarray(p.exterior.coords)[:4] for p in culled], atol=1e-6)
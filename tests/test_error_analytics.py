@@ -0,0 +1,73 @@
+import numpy as np
+from processing.error_analytics import ErrorAnalytics
+
+rng = np.random.default_rng(0)
+truth_steps = 5.0 + rng.random(400)
+estimate_steps = truth_steps + rng.normal(0.0, 0.3, len(truth_steps))
+estimate_steps[[17, 18, 150]] = np.nan
+
+
+def feed(analytics, truths, estimates):
+    for truth, estimate in zip(truths, estimates):
+        analytics.update(truth, estimate)
+    return analytics
+
+
+def test_cumulative_error_matches_brute_force():
+    analytics = feed(ErrorAnalytics(capacity=100), truth_steps, estimate_steps)
+    errors = estimate_steps - truth_steps
+    valid = errors[np.isfinite(errors)]
+    cumulative = np.cumsum(valid)
+    summary = analytics.summary()
+    assert (summary["samples"], summary["n"], summary["invalid"]) == (400, 397, 3)
+    np.testing.assert_allclose(analytics.cumulative, valid.sum(), rtol=1e-12)
+    np.testing.assert_allclose(analytics.max_abs_cumulative, np.abs(cumulative).max(), rtol=1e-12)
+    np.testing.assert_allclose(summary["mean"], valid.mean(), rtol=1e-12)
+    np.testing.assert_allclose(summary["std"], valid.std(ddof=1), rtol=1e-10)
+    np.testing.assert_allclose(analytics.max_abs_error, np.abs(valid).max())
+
+    snapshot = analytics.snapshot()  # only the last 100 samples are kept
+    np.testing.assert_allclose(snapshot["cumulative"], cumulative[-100:], rtol=1e-12)
+    np.testing.assert_allclose(snapshot["error"], valid[-100:], rtol=1e-12)
+    np.testing.assert_allclose(snapshot["position"], np.cumsum(truth_steps)[-100:], rtol=1e-12)
+
+
+def test_drift_per_period_of_linear_drift():
+    scale_error = 1e-3
+    steps = np.full(1000, 0.5)
+    analytics = feed(ErrorAnalytics(period=10.0), steps, steps*(1 + scale_error))
+    summary = analytics.summary()
+    assert summary["periods"] == 1000*0.5/10.0
+    drifts = analytics.snapshot()["drift"]
+    # the first period starts at the first sample, after one step already:
+    np.testing.assert_allclose(drifts[0], 9.5*scale_error, rtol=1e-9)
+    np.testing.assert_allclose(drifts[1:], 10.0*scale_error, rtol=1e-9)
+    np.testing.assert_allclose(summary["drift_mean"], drifts.mean(), rtol=1e-9)
+
+
+def test_warmup_skips_first_samples():
+    analytics = feed(ErrorAnalytics(warmup=5), [1.0]*5 + [2.0]*10, [100.0]*5 + [2.5]*10)
+    summary = analytics.summary()
+    assert (summary["samples"], summary["n"]) == (15, 10)
+    np.testing.assert_allclose(analytics.cumulative, 5.0)
+    np.testing.assert_allclose(analytics.max_abs_error, 0.5)
+
+
+def test_absolute_angles_give_the_same_errors_as_increments():
+    complete = np.nan_to_num(estimate_steps, nan=5.5)
+    incremental = feed(ErrorAnalytics(period=20.0), truth_steps, complete)
+    absolute = feed(ErrorAnalytics(period=20.0, increments=False), np.cumsum(truth_steps), np.cumsum(complete))
+    for name in ("cumulative", "position", "error"):
+        np.testing.assert_allclose(absolute.snapshot()[name], incremental.snapshot()[name], rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(absolute.snapshot()["drift"], incremental.snapshot()["drift"], rtol=1e-9, atol=1e-9)
+
+
+def test_absolute_angles_cover_missing_estimates():
+    truths = np.cumsum(truth_steps)
+    estimates = truths + rng.normal(0.0, 0.3, len(truths))
+    estimates[np.isnan(estimate_steps)] = np.nan
+    analytics = feed(ErrorAnalytics(increments=False), truths, estimates)
+    assert analytics.errors.invalid == 3
+    # error of position does not depend on the missing ones:
+    np.testing.assert_allclose(analytics.cumulative, estimates[-1] - truths[-1], rtol=1e-9)
+    np.testing.assert_allclose(analytics.snapshot()["position"][-1], truths[-1], rtol=1e-12)
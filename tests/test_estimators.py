@@ -0,0 +1,68 @@
+import warnings
+import numpy as np
+from estimators import EstimatorPreviousN, Marker, normalize
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_CLOSED_FORM
+from conftest import sensor_tilt_deg, sensor_shift_um
+
+
+def marks_reference(marker, thresholds):
+    """
+    Loop of Marker.get_marks before vectorization
+    """
+    marks = [[] for _ in thresholds]
+    is_unders = [marker.working_image[0] < threshold for threshold in thresholds]
+    for i, p in enumerate(marker.working_image):
+        for t, threshold in enumerate(thresholds):
+            if p < threshold and not is_unders[t]:
+                marks[t].append(i + marker.begin_index)
+                is_unders[t] = True
+            elif p > threshold and is_unders[t]:
+                marks[t].append(i + marker.begin_index)
+                is_unders[t] = False
+    return marks
+
+
+class PreviousNReference:
+    """
+    Loop of EstimatorPreviousN.estimate before vectorization
+    """
+    def __init__(self, N):
+        self.thresholds = np.linspace(0.3, 0.7, N)
+        self.previous_marks = np.zeros(N)
+        self.estimates = np.zeros(N)
+
+    def estimate(self, readout):
+        marks = marks_reference(Marker(normalize(readout)), self.thresholds)
+        for t in range(0, len(self.thresholds)):
+            if len(marks[t]) < 2:
+                self.estimates[t] = -100
+                continue
+            self.estimates[t] = marks[t][-1] - self.previous_marks[t]
+            self.previous_marks[t] = marks[t][-1]
+        return np.average([e for e in self.estimates if -10 < e < 10])
+
+
+def sweep(sensor, wheel):
+    generator = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=sensor_tilt_deg, sensor_shift_um=sensor_shift_um,
+                                 engine=ENGINE_CLOSED_FORM)
+    frames = generator.for_angles(np.arange(0, 40)*4.0/3600)
+    # integer frames make samples equal to thresholds and frames without enough crossings common:
+    steps = np.random.default_rng(2).integers(0, 11, size=(20, sensor.N)) * 108.0
+    return np.vstack([frames, steps, np.full((2, sensor.N), 1800.0), frames[:5]])
+
+
+def test_marks_match_loop(tsl1401, wheel):
+    thresholds = np.linspace(0.3, 0.7, 10)
+    for frame in sweep(tsl1401, wheel):
+        marker = Marker(normalize(frame))
+        assert marker.get_marks(thresholds) == marks_reference(marker, thresholds)
+
+
+def test_previous_n_matches_loop(tsl1401, wheel):
+    estimator = EstimatorPreviousN(10)
+    reference = PreviousNReference(10)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # average of no good estimates
+        for frame in sweep(tsl1401, wheel):
+            np.testing.assert_array_equal(estimator.estimate(frame), reference.estimate(frame))
+            np.testing.assert_array_equal(estimator.estimates, reference.estimates)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from processing.filters import convolve_same_batch, smooth_batch
+from processing.y_shift_estimator import normalize, normalize_batch, gauss_4, gauss_5, gauss_6, derivative, \
+    gauss_4_batch, gauss_5_batch, gauss_6_batch, derivative_batch
+from estimators import smooth
+
+frames = np.random.default_rng(0).random((5, 40)) * 3600
+
+
+@pytest.mark.parametrize("kernel_length", [1, 2, 3, 4, 7, 10])
+def test_convolve_same_batch_matches_np_convolve(kernel_length):
+    kernel = np.random.default_rng(kernel_length).random(kernel_length)
+    expected = [np.convolve(frame, kernel, mode='same') for frame in frames]
+    np.testing.assert_allclose(convolve_same_batch(frames, kernel), expected, rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize("single, batch", [(gauss_4, gauss_4_batch), (gauss_5, gauss_5_batch),
+                                           (gauss_6, gauss_6_batch), (derivative, derivative_batch),
+                                           (lambda y: smooth(y, 5), lambda f: smooth_batch(f, 5))])
+def test_batch_filters_match_single_frame_ones(single, batch):
+    np.testing.assert_allclose(batch(frames), [single(frame) for frame in frames], rtol=1e-12, atol=1e-9)
+
+
+def test_normalize_batch_matches_normalize():
+    with_flat_row = np.vstack([frames, np.full(40, 7.0)])
+    np.testing.assert_allclose(normalize_batch(with_flat_row), [normalize(frame) for frame in with_flat_row])
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from main import FinerEstimator, CORRELATION_FFT, CORRELATION_INTERPOLATED
+
+
+def frame(shift_px, n=113):
+    """
+    Smooth synthetic frame, pattern moved by shift_px towards higher pixels
+    """
+    x = np.arange(0, n) - shift_px
+    return 2000 + 900*np.sin(2*np.pi*x/45.0) + 300*np.exp(-((x - 50)/9.0)**2) + 200*np.cos(2*np.pi*x/17.0)
+
+
+def shift_px(method, shift):
+    estimator = FinerEstimator(method)
+    estimator.get_dx_px(frame(0.0))
+    return estimator.get_dx_px(frame(shift))
+
+
+@pytest.mark.parametrize("shift", [0.0, 0.3, -0.73, 1.26, -1.85])
+def test_fft_shift_matches_interpolated(shift):
+    fft = shift_px(CORRELATION_FFT, shift)
+    # interpolated method only has resolution of 0.1 px and is biased by energy of frame moving in and out:
+    assert abs(fft - shift_px(CORRELATION_INTERPOLATED, shift)) < 0.35
+    assert abs(fft - shift) < 0.01
+
+
+def test_fft_shifts_are_relative_to_previous_frame():
+    estimator = FinerEstimator(CORRELATION_FFT)
+    shifts = [estimator.get_dx_px(frame(s)) for s in [0.0, 0.4, 0.9, 1.5, 2.6, 2.8]]
+    np.testing.assert_allclose(shifts, [0.0, 0.4, 0.5, 0.6, 1.1, 0.2], atol=0.01)
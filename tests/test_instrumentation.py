@@ -0,0 +1,24 @@
+from processing import instrumentation
+from processing.instrumentation import span, StageStats
+
+
+def test_stage_stats_of_items_processed_together():
+    stats = StageStats()
+    stats.add(1000, items=4)
+    stats.add(300)
+    assert stats.count == 5
+    assert stats.total_ns == 1300
+    assert (stats.min_ns, stats.max_ns) == (250, 300)
+    assert stats.as_dict()["mean_us"] == 1300 / 5 * 1e-3
+
+
+def test_span_with_items_counts_every_item():
+    instrumentation.reset()
+    instrumentation.enable()
+    try:
+        with span("chunk", 8):
+            sum(range(0, 1000))
+    finally:
+        instrumentation.disable()
+    assert instrumentation.summary()["chunk"]["count"] == 8
+    instrumentation.reset()
@@ -0,0 +1,57 @@
+import heapq
+import numpy as np
+import pytest
+from processing.line_fitter import LineFitter, fit_slopes, smooth
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_CLOSED_FORM
+from conftest import sensor_tilt_deg, sensor_shift_um
+
+
+def fit_slopes_reference(raw_data, smooth_data, crossings, n, half_slope_len, min_slope_len, max_points):
+    """
+    Loop of LineFitter.fit_line before vectorization, with np.polyfit on every slope
+    """
+    coefficients = []
+    for c in crossings:
+        beg_slope = max(1, c - half_slope_len)
+        end_slope = min(n - 1, c + half_slope_len)
+        if end_slope - beg_slope < min_slope_len:
+            continue
+        inital_slope_tan = (raw_data[c + 3] - raw_data[c - 3]) / 6
+        tans = {i: smooth_data[i] - smooth_data[i - 1] for i in range(beg_slope, end_slope)}
+        inliers = heapq.nsmallest(max_points, tans, key=lambda i: abs(tans[i] - inital_slope_tan))
+        x = np.array(sorted(inliers))
+        a, b = np.polyfit(x, raw_data[x], 1)
+        coefficients.append({"a": a, "b": b})
+    return coefficients
+
+
+def assert_same_lines(actual, expected):
+    assert len(actual) == len(expected)
+    np.testing.assert_allclose([c["a"] for c in actual], [c["a"] for c in expected], rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose([c["b"] for c in actual], [c["b"] for c in expected], rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize("angle_deg", [0.0, 0.0123, 0.02784789, 0.05])
+def test_fit_line_matches_polyfit(tsl1401, wheel, angle_deg):
+    generator = ReadoutGenerator(tsl1401, wheel, sensor_tilt_deg=sensor_tilt_deg, sensor_shift_um=sensor_shift_um,
+                                 engine=ENGINE_CLOSED_FORM)
+    raw = generator.for_angle(angle_deg)
+    raw = raw + np.random.default_rng(4).normal(0, 20, raw.shape)
+    crossings, coefficients, hills = LineFitter(tsl1401).fit_line(raw)
+    full_stripes = len(hills)/2
+    av_slope_lenght = int(50/full_stripes)
+    expected = fit_slopes_reference(raw, smooth(raw, 5), crossings, tsl1401.N,
+                                    int(av_slope_lenght/2), av_slope_lenght, int(0.66*av_slope_lenght))
+    assert_same_lines(coefficients, expected)
+
+
+@pytest.mark.parametrize("half_slope_len, min_slope_len, max_points", [(4, 8, 5), (6, 10, 8), (6, 6, 12)])
+def test_fit_slopes_matches_polyfit(half_slope_len, min_slope_len, max_points):
+    rng = np.random.default_rng(half_slope_len + max_points)
+    # integer samples give equal local slopes, which checks that ties go to the earlier point:
+    raw = rng.integers(0, 6, 128).astype(float)
+    smooth_data = raw.copy()
+    crossings = np.array([3, 5, 20, 47, 64, 90, 121, 124])
+    assert_same_lines(fit_slopes(raw, smooth_data, crossings, len(raw), half_slope_len, min_slope_len, max_points),
+                      fit_slopes_reference(raw, smooth_data, crossings, len(raw),
+                                           half_slope_len, min_slope_len, max_points))
@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from simulation.parallel_sweep import ParallelSweepSimulator
+from simulation.noise import SensorNoiseModel
+from conftest import sensor_tilt_deg, sensor_shift_um
+
+angles_deg = np.arange(0, 50) / 3600.0
+
+
+@pytest.mark.parametrize("sensor_noise", [False, True])
+def test_result_does_not_depend_on_workers(tsl1401, wheel, sensor_noise):
+    def simulate(workers, seed=3):
+        simulator = ParallelSweepSimulator(tsl1401, wheel, sensor_tilt_deg=sensor_tilt_deg,
+                                           sensor_shift_um=sensor_shift_um, workers=workers, chunk_size=8,
+                                           noise_amplitude=0.0 if sensor_noise else 0.1,
+                                           noise=SensorNoiseModel.for_sensor(tsl1401, seed=3) if sensor_noise
+                                           else None,
+                                           seed=seed)
+        return simulator.run(angles_deg)
+
+    single = simulate(1)
+    assert np.array_equal(simulate(2), single)
+    assert not np.array_equal(simulate(2, seed=4), single)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_SHAPELY, ENGINE_CLOSED_FORM, ENGINE_LOOKUP_TABLE
+from conftest import sensor_tilt_deg, sensor_shift_um
+
+angles_deg = [0.0, 0.0123, 0.02784789, 0.05]
+
+
+@pytest.mark.parametrize("tilt_deg", [0.0, 1.4, 2.0])
+def test_closed_form_matches_shapely(sensor, wheel, tilt_deg):
+    exact = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=tilt_deg, sensor_shift_um=sensor_shift_um,
+                             engine=ENGINE_SHAPELY)
+    closed_form = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=tilt_deg, sensor_shift_um=sensor_shift_um,
+                                   engine=ENGINE_CLOSED_FORM)
+    for angle in angles_deg:
+        np.testing.assert_allclose(closed_form.for_angle(angle), exact.for_angle(angle), rtol=0, atol=1e-6)
+
+
+def test_closed_form_with_other_shift(tsl1401, wheel):
+    exact = ReadoutGenerator(tsl1401, wheel, sensor_tilt_deg=1.3925103, sensor_shift_um=(120, -700),
+                             engine=ENGINE_SHAPELY)
+    closed_form = ReadoutGenerator(tsl1401, wheel, sensor_tilt_deg=1.3925103, sensor_shift_um=(120, -700),
+                                   engine=ENGINE_CLOSED_FORM)
+    np.testing.assert_allclose(closed_form.for_angles(angles_deg), [exact.for_angle(a) for a in angles_deg],
+                               rtol=0, atol=1e-6)
+
+
+def test_lookup_table_close_to_closed_form(sensor, wheel):
+    closed_form = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=sensor_tilt_deg, sensor_shift_um=sensor_shift_um,
+                                   engine=ENGINE_CLOSED_FORM)
+    lookup_table = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=sensor_tilt_deg, sensor_shift_um=sensor_shift_um,
+                                    engine=ENGINE_LOOKUP_TABLE)
+    angles = np.linspace(0, 3*wheel.dphi_deg, 97)
+    error = np.abs(lookup_table.for_angles(angles) - closed_form.for_angles(angles)).max()
+    assert error < 1.0  # um^2, pixels have thousands of them
+    assert error <= 1.5*lookup_table.table_max_error() + 1e-9
+
+
+def test_lookup_table_follows_changed_wheel(tsl1401, wheel):
+    lookup_table = ReadoutGenerator(tsl1401, wheel, sensor_tilt_deg=sensor_tilt_deg, sensor_shift_um=sensor_shift_um,
+                                    engine=ENGINE_LOOKUP_TABLE)
+    lookup_table.for_angle(0.01)
+    wheel.distance_to_bottom_line_um += 100
+    closed_form = ReadoutGenerator(tsl1401, wheel, sensor_tilt_deg=sensor_tilt_deg, sensor_shift_um=sensor_shift_um,
+                                   engine=ENGINE_CLOSED_FORM)
+    np.testing.assert_allclose(lookup_table.for_angle(0.01), closed_form.for_angle(0.01), rtol=0, atol=1.0)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from processing.streaming_stats import RunningMoments, P2Quantile, ErrorAccumulator
+
+values = np.random.default_rng(0).normal(3.0, 2.0, 5000)
+with_nans = np.where(np.random.default_rng(1).random(len(values)) < 0.05, np.nan, values)
+valid = with_nans[np.isfinite(with_nans)]
+
+
+def assert_moments(moments, expected):
+    assert moments.n == len(expected)
+    assert moments.invalid == len(with_nans) - len(valid)
+    np.testing.assert_allclose(moments.mean, np.mean(expected), rtol=1e-12)
+    np.testing.assert_allclose(moments.variance, np.var(expected, ddof=1), rtol=1e-10)
+    np.testing.assert_allclose(moments.sem, np.std(expected, ddof=1)/np.sqrt(len(expected)), rtol=1e-10)
+    assert (moments.min, moments.max) == (expected.min(), expected.max())
+
+
+def test_running_moments_in_batches():
+    moments = RunningMoments()
+    for batch in np.array_split(with_nans, [1, 2, 100, 1700, 1701]):
+        moments.update(batch)
+    assert_moments(moments, valid)
+
+
+def test_running_moments_one_by_one():
+    moments = RunningMoments()
+    for value in with_nans.tolist():
+        moments.add(value)
+    assert_moments(moments, valid)
+
+
+def test_merged_running_moments():
+    parts = [RunningMoments() for _ in range(3)]
+    for part, batch in zip(parts, np.array_split(with_nans, 3)):
+        part.update(batch)
+    merged = RunningMoments()
+    for part in [RunningMoments()] + parts:
+        merged.merge(part)
+    assert_moments(merged, valid)
+
+
+@pytest.mark.parametrize("q", [0.05, 0.5, 0.95])
+def test_p2_quantile_close_to_np_quantile(q):
+    quantile = P2Quantile(q)
+    quantile.update(with_nans)
+    # estimate of quantile of 5000 samples is much better than spread of distribution (2.0):
+    assert abs(quantile.value - np.quantile(valid, q)) < 0.05
+
+
+def test_error_accumulator_matches_numpy():
+    accumulator = ErrorAccumulator()
+    for batch in np.array_split(with_nans, 7):
+        accumulator.update(batch)
+    summary = accumulator.summary()
+    assert summary["n"] == len(valid)
+    np.testing.assert_allclose(accumulator.rms, np.sqrt(np.mean(valid**2)), rtol=1e-12)
+    np.testing.assert_allclose(summary["std"], np.std(valid, ddof=1), rtol=1e-10)
+    assert 0 < summary["rms_half_width"] < 0.1
@@ -0,0 +1,33 @@
+import numpy as np
+from main import get_widths_of_stripe_in_pixels, get_width_of_stripe_in_pixels
+
+rise_px = 20.3
+width_px = 37.6
+ramp_px = 6.0
+
+
+def stripe(n=113, fall_px=rise_px + width_px):
+    """
+    Bright stripe between linear edges starting at rise_px and fall_px, both ramp_px long
+    """
+    x = np.arange(0, n)
+    return 100 + 3000*np.clip((x - rise_px)/ramp_px, 0, 1)*np.clip(1 - (x - fall_px)/ramp_px, 0, 1)
+
+
+def test_widths_of_stripe_with_known_width():
+    widths = get_widths_of_stripe_in_pixels(stripe())
+    thresholds = np.arange(0, 1, 0.1)
+    # inside of ramps samples lie on the edges, so interpolation is exact:
+    inside = (thresholds > 0.15) & (thresholds < 0.85)
+    np.testing.assert_allclose(widths[inside], width_px, atol=1e-9)
+    np.testing.assert_allclose(widths[1:], width_px, atol=0.1)
+    # minimum of normalized image equals threshold 0, which is never crossed:
+    assert np.isnan(widths[0])
+    np.testing.assert_allclose(get_width_of_stripe_in_pixels(stripe(), 45.0), width_px, atol=1e-9)
+
+
+def test_widths_without_crossing():
+    only_rising = stripe(fall_px=200.0)
+    assert np.isnan(get_widths_of_stripe_in_pixels(only_rising)).all()
+    assert np.isnan(get_widths_of_stripe_in_pixels(np.full(113, 1800.0))).all()
+    assert get_width_of_stripe_in_pixels(only_rising, 45.0) == 0
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from hardware.telemetry_protocol import TELEMETRY_DTYPE, SYNC, encode_readouts, encode_ccd_frame, \
+    BinaryTelemetryDecoder, TextTelemetryDecoder, AutoTelemetryDecoder, text_to_binary
+
+
+def random_records(n, seed=0):
+    rng = np.random.default_rng(seed)
+    records = np.empty(n, dtype=TELEMETRY_DTYPE)
+    for f in "ABT":
+        records[f] = rng.integers(0, 2**32, n)
+    for f in "CDEF":
+        records[f] = rng.integers(-2**31, 2**31, n)
+    return records
+
+
+def feed_in_chunks(decoder, data, seed=0):
+    rng = np.random.default_rng(seed)
+    cuts = [0] + sorted(rng.integers(0, len(data), 40).tolist()) + [len(data)]
+    decoded = [decoder.feed(data[b:e]) for b, e in zip(cuts[:-1], cuts[1:])]
+    return np.concatenate(decoded)
+
+
+def text_line(record):
+    return ("[E] " + ",".join(f"{f}:{record[f]:>12}" for f in "ABCDEF") + f",T:{record['T']:>13}\r\n").encode()
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_binary_round_trip_with_split_input(seed):
+    records = random_records(100, seed)
+    decoder = BinaryTelemetryDecoder()
+    decoded = feed_in_chunks(decoder, b"".join(encode_readouts(records)), seed)
+    np.testing.assert_array_equal(decoded, records)
+    assert decoder.stats() == {"records": 100, "ccd_frames": 0, "skipped": 0, "decode_errors": 0}
+
+
+def test_binary_decoder_skips_garbage_and_corrupted_frames():
+    records = random_records(30, 5)
+    frames = encode_readouts(records)
+    corrupted = 11
+    assert SYNC not in frames[corrupted][1:]  # no other frame starts inside the corrupted one
+    frames[corrupted] = frames[corrupted][:-1] + bytes([frames[corrupted][-1] ^ 0xff])
+    garbage = bytes(range(0x20, 0x60))
+    ccd_pixels = np.arange(128, dtype=np.uint16) * 17
+    ccd_frames = []
+    decoder = BinaryTelemetryDecoder(on_ccd_frames=ccd_frames.append)
+
+    data = garbage + b"".join(frames[:20]) + encode_ccd_frame(1234, ccd_pixels) + garbage + b"".join(frames[20:])
+    decoded = feed_in_chunks(decoder, data, 7)
+
+    np.testing.assert_array_equal(decoded, np.delete(records, corrupted))
+    assert decoder.stats() == {"records": 29, "ccd_frames": 1, "decode_errors": 1,
+                               "skipped": 2*len(garbage) + len(frames[corrupted]) - 1}
+    ccd = np.concatenate(ccd_frames)
+    assert ccd["T"].tolist() == [1234]
+    np.testing.assert_array_equal(ccd["pixels"][0], ccd_pixels)
+
+
+def test_text_to_binary_matches_text_decoder():
+    records = random_records(50, 3)
+    records["A"] //= 2  # text of firmware is signed long
+    records["B"] //= 2
+    records["T"] //= 2
+    lines = [text_line(r) for r in records]
+    lines.insert(10, b"[G] Global state = 1\r\n")
+    lines.insert(20, b"[E] A: 12,B: 3\r\n")
+    text = b"".join(lines)
+
+    text_decoder = TextTelemetryDecoder()
+    decoded_text = feed_in_chunks(text_decoder, text, 3)
+    np.testing.assert_array_equal(decoded_text, records)
+    assert text_decoder.stats() == {"records": 50, "skipped": 1, "decode_errors": 1}
+
+    binary = b"".join(text_to_binary(lines))
+    np.testing.assert_array_equal(feed_in_chunks(BinaryTelemetryDecoder(), binary, 4), records)
+    np.testing.assert_array_equal(feed_in_chunks(AutoTelemetryDecoder(), binary, 5), records)
+    np.testing.assert_array_equal(feed_in_chunks(AutoTelemetryDecoder(), text, 6), records)
@@ -0,0 +1,53 @@
+import numpy as np
+from hardware.encoder_wheel import EncoderWheelWithTopAndBottomStrips
+from processing.y_shift_estimator import SensorYShiftEstimator, normalize, gauss_4, derivative, \
+    get_extreme_subpixel, get_min_index, get_max_index
+from simulation.simulate_readouts import ReadoutGenerator, ENGINE_CLOSED_FORM
+from conftest import R_mm, N_paskow, odleglosc_dolnego_paska
+
+
+def extreme_um(estimator, sample, method):
+    """
+    Per frame path of the estimator before vectorization
+    """
+    try:
+        x = get_extreme_subpixel(derivative(gauss_4(normalize(sample))), method)
+    except IndexError:  # extreme at the last sample
+        return np.nan
+    return x * estimator.sensor.pixel_pitch_h_um
+
+
+def bottom_reference(estimator, raw):
+    ad = estimator.wheel.distance_to_bottom_line_um + estimator.sensor.pixel_w_um / 2.0
+    return extreme_um(estimator, raw[:estimator.N_first], get_min_index) + ad
+
+
+def top_reference(estimator, raw):
+    y = extreme_um(estimator, raw[-estimator.N_first:], get_max_index)
+    rev = estimator.sensor.pixel_pitch_h_um * estimator.N_first - y
+    return -rev + estimator.sensor.width_um - (estimator.wheel.distance_to_bottom_line_um +
+                                               estimator.wheel.line_height_um) + estimator.sensor.pixel_w_um / 2.0
+
+
+def simulated_frames(sensor, wheel):
+    rng = np.random.default_rng(2)
+    frames = []
+    for y_shift in -831.4724514 + 164.0*rng.random(6):
+        generator = ReadoutGenerator(sensor, wheel, sensor_tilt_deg=1.3925103, sensor_shift_um=(0, y_shift),
+                                     engine=ENGINE_CLOSED_FORM)
+        frames.extend(generator.for_angles(wheel.dphi_deg*rng.random(3)))
+    return np.array(frames)
+
+
+def test_batch_matches_per_frame_estimates(tsl1401):
+    wheel = EncoderWheelWithTopAndBottomStrips(R_mm, N_paskow, 6.4, odleglosc_dolnego_paska)
+    estimator = SensorYShiftEstimator(tsl1401, wheel)
+    frames = simulated_frames(tsl1401, wheel)
+    frames = np.vstack([frames, np.random.default_rng(3).random((10, tsl1401.N)) * 3600])
+
+    np.testing.assert_allclose(estimator.estimate_bottom_edges(frames),
+                               [bottom_reference(estimator, raw) for raw in frames], rtol=1e-12)
+    np.testing.assert_allclose(estimator.estimate_top_edges(frames),
+                               [top_reference(estimator, raw) for raw in frames], rtol=1e-12)
+    np.testing.assert_allclose([estimator.estimate_bottom_edge(raw) for raw in frames],
+                               estimator.estimate_bottom_edges(frames), rtol=1e-12)